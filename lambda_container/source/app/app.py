@@ -58,6 +58,7 @@ DISABLE_ALL_EMAILS = False
 TEMP_DIR = None            # Set to None (preferred) to get a new tempdir with tempfile.gettempdir()
 OVERRIDE_RUNID = None      # Set to None (preferred) to create a new unique run ID
 DELETE_TEMP_DIR = False     # Set to True (preferred) to delete the temp dir once done
+REFERENCE_CACHE_DIR = "/tmp/qpcr_reference_cache"   # Directory to cache the cleaned sites, methods and samples log tables in between runs. Set to None to disable
 UPLOAD_RESULTS = True      # Set to True to upload outputs to S3 for long-term storage
 INCLUDE_STACK_TRACE_ON_ERROR = False  # Set to True to include a stack trace in the email when an error occurs
                                       # Note that for unknown errors the stack trace is ALWAYS included
@@ -554,7 +555,8 @@ def handler(event, context):
             updater = QPCRUpdater(updater_config, 
                 populator_config, 
                 sites_config=sites_config, 
-                sites_file=sites_file)
+                sites_file=sites_file,
+                cache_dir=REFERENCE_CACHE_DIR)
             is_output_files = updater.check_valid_inputs(local_input_files)
 
             # local_inputed_output_files: Already in the output format, so don't process these
@@ -599,7 +601,8 @@ def handler(event, context):
                 sampleslog_file = sampleslog_file,
                 methods_config=methods_config,
                 methods_file=methods_file,
-                hide_qaqc=hide_qaqc)
+                hide_qaqc=hide_qaqc,
+                reference_cache_dir=REFERENCE_CACHE_DIR)
             output_files = qpcr.populate()
         populated_files.extend(output_files)
 
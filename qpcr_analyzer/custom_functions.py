@@ -228,7 +228,7 @@ def custom_func_addrowid(populator, sheet_name, id, replace_value="", **kwargs):
     if info is not None:
         cur_row = target_cell.row - info["origin"][0]
         name = add_sheet_name_to_colrow_name(target_sheet_name, id)
-        info["row_names"][cur_row].append(name)
+        populator.add_row_name(info, cur_row, name)
 
     return replace_value
 
@@ -10,16 +10,31 @@ See [excel_calculator.md](excel_calculator.md) for details.
 Usage
 -----
 
-    add_excel_calculated_values(wb)
     wb.save("output_file.xlsx")
+    values = add_excel_calculated_values(wb)
+    save_calculated_values("output_file.xlsx", values)
 
 For some unknown reason, we sometimes need to first save `wb` to disk then reload it before calling `add_excel_calculated_value`.
 Until this is fixed, it is recommended to always save and reload first:
 
     wb.save("output_file.xlsx")
     wb = openpyxl.load_workbook("output_file.xlsx")
-    add_excel_calculated_values(wb)
-    wb.save("output_file.xlsx")
+    values = add_excel_calculated_values(wb)
+    save_calculated_values("output_file.xlsx", values)
+
+If openpyxl has been patched with localfixes.sh, then the values are also set in each cell's calculated_value, and are saved
+with wb.save("output_file.xlsx") instead of save_calculated_values.
+
+To find out which formulas are slow to evaluate, pass a FormulaProfiler and save its report afterwards:
+
+    profiler = FormulaProfiler()
+    add_excel_calculated_values(wb, profiler=profiler)
+    profiler.save("output_file-formula-profile")
+
+Workbooks whose formulas form several independent groups (eg. QAQC sheets that only reference their own section of the
+Main sheet) can be calculated in parallel. The workbook must already be saved to disk, since each process loads its own copy:
+
+    add_excel_calculated_values(wb, filename="output_file.xlsx", num_processes=4)
 
 """
 
@@ -31,14 +46,30 @@ from pycel.excelutil import (
 )
 
 from openpyxl.cell.cell import Cell
-import inspect
 from pycel.excelformula import FormulaEvalError
 from openpyxl.utils import get_column_letter
+from openpyxl.formula.tokenizer import Tokenizer, Token
+from openpyxl.compat import safe_string
+from openpyxl.utils.datetime import to_excel
 import openpyxl
+import os
+import io
+import shutil
+import tempfile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import json
+import csv
+import re
+import time
+import datetime
 
-if 'calculated_value' not in Cell.__slots__:
-    path = inspect.getfile(Cell)
-    raise RuntimeError(f"OpenPYXL Cell class requires custom 'calculated_value' in its __slots__, Cell is defined in: {path}")
+# True if openpyxl has been patched (see localfixes.sh) to save the calculated_value of cells. Without the patch,
+# calculated values are only saved with save_calculated_values.
+HAS_CALCULATED_VALUE_SLOT = 'calculated_value' in Cell.__slots__
 
 import pycel
 from pycel import ExcelCompiler
@@ -51,33 +82,611 @@ import pycel.lib.lookup
 from pycel.excellib import _numerics
 from pycel.excelutil import (
     DIV0,
+    AddressRange,
 )
 import numpy as np
 
-def add_excel_calculated_values(xl, sheets=None):
+# Regex for finding all cells (eg. <c r="A1" s="2"><f>SUM(B1:B3)</f><v>6</v></c>, or <c r="A2"/>) in worksheet XML.
+# Group 1 is the attributes, group 2 is the content (None for empty cells).
+XML_CELL_REGEX = re.compile("<c\\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+XML_CELL_COORDINATE_REGEX = re.compile("\\br=\"([A-Za-z]+[0-9]+)\"")
+XML_CELL_TYPE_REGEX = re.compile("\\s+t=\"[^\"]*\"")
+XML_CELL_VALUE_REGEX = re.compile("<v\\b[^>]*?(?:/>|>.*?</v>)", re.S)
+
+# Namespaces of the xlsx workbook parts
+XLSX_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Excel functions whose references are only known once the formula is evaluated. Workbooks using these can not be
+# split into independent groups of formulas.
+DYNAMIC_REFERENCE_FUNCTIONS = ["INDIRECT", "OFFSET"]
+
+# Regex for finding the Excel function names called in a formula (eg. "AVERAGEIFS" in "=AVERAGEIFS(A:A,B:B,1)")
+EXCEL_FUNCTION_REGEX = re.compile("([A-Za-z_][A-Za-z0-9_\\.]*)\\s*\\(")
+
+class FormulaProfiler(object):
+    """Records how long pycel takes to evaluate the formulas in a workbook, so we can find which template constructs
+    are slow to calculate.
+
+    Timings are the self time of each formula cell, ie. the time spent evaluating a cell excluding the time spent
+    evaluating the formula cells it references (pycel evaluates referenced cells lazily, so without this the first cell
+    that references a large range would receive the time for the whole range). Totals are kept per sheet, per template
+    column name and per Excel function. A cell that calls several functions (eg. IF and AVERAGEIFS) adds its time to each
+    of those functions, so the function totals can add up to more than the total time.
+
+    Parameters
+    ----------
+    column_names : dict
+        Optional template column names for each sheet, in the format {sheet_title : {column_letter : [names]}}. If a sheet
+        is not in column_names then the value in row 1 of the column (ie. the header) is used as the name, or the column
+        letter if row 1 is empty.
+    num_slowest_cells : int
+        Number of slowest individual cells to keep in the report.
+    """
+    def __init__(self, column_names=None, num_slowest_cells=50):
+        super().__init__()
+        self.column_names = column_names or {}
+        self.num_slowest_cells = num_slowest_cells
+        self.sheets = {}
+        self.columns = {}
+        self.functions = {}
+        self.slowest_cells = []
+        self.total_count = 0
+        self.total_seconds = 0
+
+    def attach(self, excel, xl):
+        """Wrap the cell evaluation of the ExcelCompiler so that every formula cell it calculates is timed. Must be called before
+        anything is evaluated with excel.
+
+        Parameters
+        ----------
+        excel : pycel.ExcelCompiler
+            The compiler that will evaluate the formulas.
+        xl : openpyxl.Workbook
+            The workbook that excel was created from. Used to retrieve column headers.
+        """
+        evaluate = excel._evaluate
+        # Each item is the total time spent in the formula cells that were evaluated by the cell being evaluated at
+        # that depth, which we subtract to get the cell's self time.
+        child_seconds = []
+
+        def _evaluate(address):
+            cell = excel.cell_map.get(address)
+            needs_calc = cell is None or cell.needs_calc
+            child_seconds.append(0)
+            tic = time.perf_counter()
+            try:
+                return evaluate(address)
+            finally:
+                elapsed = time.perf_counter() - tic
+                children = child_seconds.pop()
+                cell = excel.cell_map.get(address)
+                if needs_calc and cell is not None and cell.formula and not cell.address.is_range:
+                    self.record(xl, cell.address.sheet, cell.address.column, cell.address.coordinate, cell.formula.base_formula, elapsed - children)
+                    if len(child_seconds) > 0:
+                        child_seconds[-1] += elapsed
+
+        excel._evaluate = _evaluate
+
+    def get_column_name(self, xl, sheet_name, column):
+        """Get the name of the column used in the report, see column_names in the constructor.
+        """
+        if sheet_name in self.column_names:
+            names = self.column_names[sheet_name].get(column, None) or []
+            return ",".join([n for n in names if n]) or column
+        header = xl[sheet_name][f"{column}1"].value if sheet_name in xl.sheetnames else None
+        if isinstance(header, str) and header and header[0] != "=":
+            return header
+        return column
+
+    def record(self, xl, sheet_name, column, coordinate, formula, seconds):
+        """Add the evaluation time (in seconds) of a single formula cell to the totals.
+        """
+        def _add(totals, key):
+            cur = totals.setdefault(key, [0, 0])
+            cur[0] += 1
+            cur[1] += seconds
+
+        self.total_count += 1
+        self.total_seconds += seconds
+        _add(self.sheets, sheet_name)
+        _add(self.columns, f"{sheet_name}!{self.get_column_name(xl, sheet_name, column)}")
+        for func_name in set(f.upper() for f in EXCEL_FUNCTION_REGEX.findall(formula or "")):
+            _add(self.functions, func_name)
+
+        item = (seconds, f"'{sheet_name}'!{coordinate}", formula)
+        if len(self.slowest_cells) < self.num_slowest_cells:
+            heapq.heappush(self.slowest_cells, item)
+        elif seconds > self.slowest_cells[0][0]:
+            heapq.heapreplace(self.slowest_cells, item)
+
+    def merge(self, other):
+        """Add the totals and slowest cells recorded by another FormulaProfiler (eg. one used in another process) to
+        this profiler.
+        """
+        for totals, other_totals in [(self.sheets, other.sheets), (self.columns, other.columns), (self.functions, other.functions)]:
+            for key, (count, seconds) in other_totals.items():
+                cur = totals.setdefault(key, [0, 0])
+                cur[0] += count
+                cur[1] += seconds
+        self.total_count += other.total_count
+        self.total_seconds += other.total_seconds
+        for item in other.slowest_cells:
+            if len(self.slowest_cells) < self.num_slowest_cells:
+                heapq.heappush(self.slowest_cells, item)
+            elif item[0] > self.slowest_cells[0][0]:
+                heapq.heapreplace(self.slowest_cells, item)
+
+    def get_report(self):
+        """Get the profiling report as a dictionary. Totals are sorted from slowest to fastest.
+        """
+        def _totals(totals):
+            items = sorted(totals.items(), key=lambda x: x[1][1], reverse=True)
+            return [{ "name" : k, "count" : count, "seconds" : seconds } for k, (count, seconds) in items]
+
+        return {
+            "count" : self.total_count,
+            "seconds" : self.total_seconds,
+            "sheets" : _totals(self.sheets),
+            "columns" : _totals(self.columns),
+            "functions" : _totals(self.functions),
+            "slowest_cells" : [{ "cell" : cell, "formula" : formula, "seconds" : seconds } for seconds, cell, formula in sorted(self.slowest_cells, reverse=True)],
+        }
+
+    def save(self, path):
+        """Save the report as both JSON and CSV, to path with a .json and .csv extension added.
+
+        Returns
+        -------
+        list[str]
+            The paths of the JSON and CSV files.
+        """
+        report = self.get_report()
+        json_path = f"{path}.json"
+        csv_path = f"{path}.csv"
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=4)
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["group", "name", "count", "seconds", "formula"])
+            for group in ["sheets", "columns", "functions"]:
+                for item in report[group]:
+                    writer.writerow([group, item["name"], item["count"], item["seconds"], ""])
+            for item in report["slowest_cells"]:
+                writer.writerow(["slowest_cells", item["cell"], 1, item["seconds"], item["formula"]])
+        return [json_path, csv_path]
+
+def is_formula_cell(cell):
+    """Check if the openpyxl cell contains a formula that we calculate.
+    """
+    return cell.data_type == "f" and isinstance(cell.value, str) and cell.value.strip()[0:1] == '='
+
+def get_independent_formula_groups(xl):
+    """Partition all formula cells in the workbook into groups, where no formula in a group depends (directly or indirectly)
+    on the calculated value of a formula in another group. Each group can therefore be calculated separately. Cells without
+    formulas are constants so do not link groups together, even if they are referenced by formulas in several groups.
+
+    Parameters
+    ----------
+    xl : openpyxl.Workbook
+        The workbook to partition.
+
+    Returns
+    -------
+    list[list[str]]
+        Each item is a group, with the addresses of the formula cells in the group (eg. "'Main'!A1"). None is
+        returned if the workbook can not be partitioned (eg. if formulas use INDIRECT).
+    """
+    # Formula cells for each sheet, as {sheet_title : {(row, col) : address}}
+    formula_cells = {}
+    formulas = []
+    for ws in xl.worksheets:
+        sheet_cells = formula_cells[ws.title] = {}
+        for row in ws.iter_rows():
+            for cell in row:
+                if is_formula_cell(cell):
+                    addr = f"'{ws.title}'!{cell.coordinate}"
+                    sheet_cells[(cell.row, cell.column)] = addr
+                    formulas.append((ws, addr, cell.value))
+
+    # Union-find over the formula cell addresses
+    parents = { addr : addr for _, addr, _ in formulas }
+    def _find(addr):
+        root = addr
+        while parents[root] != root:
+            root = parents[root]
+        while parents[addr] != root:
+            parents[addr], addr = root, parents[addr]
+        return root
+
+    def _union(addr1, addr2):
+        root1, root2 = _find(addr1), _find(addr2)
+        if root1 != root2:
+            parents[root1] = root2
+
+    # The formula cells referenced by each range (eg. "'Main'!A1:B3"), as the address of one of the cells (all others
+    # in the range are already joined to it), or None if no formula cells are in the range.
+    range_formulas = {}
+    def _get_range_formula(ref):
+        if ref.address in range_formulas:
+            return range_formulas[ref.address]
+        sheet_cells = formula_cells[ref.sheet]
+        if ref.is_range:
+            ws = xl[ref.sheet]
+            min_row, min_col = ref.start.row or 1, ref.start.col_idx or 1
+            max_row, max_col = min(ref.end.row or ws.max_row, ws.max_row), min(ref.end.col_idx or ws.max_column, ws.max_column)
+            if (max_row - min_row + 1) * (max_col - min_col + 1) > len(sheet_cells):
+                addrs = [addr for (row, col), addr in sheet_cells.items() if min_row <= row <= max_row and min_col <= col <= max_col]
+            else:
+                addrs = [sheet_cells[(row, col)] for row in range(min_row, max_row+1) for col in range(min_col, max_col+1) if (row, col) in sheet_cells]
+        else:
+            addrs = [sheet_cells[(ref.row, ref.col_idx)]] if (ref.row, ref.col_idx) in sheet_cells else []
+        for addr in addrs[1:]:
+            _union(addr, addrs[0])
+        range_formulas[ref.address] = addrs[0] if len(addrs) > 0 else None
+        return range_formulas[ref.address]
+
+    for ws, addr, formula in formulas:
+        try:
+            tokens = Tokenizer(formula).items
+        except Exception:
+            return None
+        for token in tokens:
+            if token.type == Token.FUNC and token.subtype == Token.OPEN and token.value[:-1].upper() in DYNAMIC_REFERENCE_FUNCTIONS:
+                return None
+            if token.type != Token.OPERAND or token.subtype != Token.RANGE:
+                continue
+            try:
+                ref = AddressRange.create(token.value)
+                if not ref.sheet:
+                    ref = AddressRange.create(token.value, sheet=ws.title)
+            except Exception:
+                # Defined names are not resolved, so we can't tell what they reference. Any other names are
+                # invalid (#NAME?) and do not reference anything.
+                if xl.defined_names.get(token.value) is not None:
+                    return None
+                continue
+            if ref.sheet not in formula_cells:
+                continue
+            ref_addr = _get_range_formula(ref)
+            if ref_addr is not None:
+                _union(addr, ref_addr)
+
+    groups = {}
+    for _, addr, _ in formulas:
+        groups.setdefault(_find(addr), []).append(addr)
+    return list(groups.values())
+
+def calculate_cell_value(excel, addr):
+    """Calculate the value of a single formula cell.
+
+    Parameters
+    ----------
+    excel : pycel.ExcelCompiler
+        The compiler for the workbook with the cell.
+    addr : str
+        The address of the cell, including the sheet name (eg. "'Main'!A1").
+
+    Returns
+    -------
+    tuple
+        The tuple (has_value, value). has_value is False if the value could not be calculated, in which case
+        no calculated value should be saved.
+    """
+    try:
+        return True, excel.evaluate(addr)
+    except NameError:
+        return True, "#NAME?"
+    except FormulaEvalError as e:
+        return False, None
+    except Exception as e:
+        formula = excel.cell_map[addr].formula.base_formula if addr in excel.cell_map and excel.cell_map[addr].formula else ""
+        raise ValueError(f"ERROR evaluating Excel formula at {addr}: {formula}: {e}")
+
+def calculate_cell_values(xl, addrs, profiler=None):
+    """Calculate the values of the formula cells in addrs. Formulas that the cells depend on are also calculated,
+    but their values are not returned.
+
+    Parameters
+    ----------
+    xl : openpyxl.Workbook
+        The workbook with the cells.
+    addrs : list
+        The addresses of the cells, including the sheet names (eg. ["'Main'!A1"]).
+    profiler : FormulaProfiler
+        If set, then the evaluation time of every formula is recorded in it.
+
+    Returns
+    -------
+    dict
+        The calculated values, in the format {addr : value}, for all cells that could be calculated.
+    """
+    excel = ExcelCompiler(excel=xl)
+    if profiler is not None:
+        profiler.attach(excel, xl)
+    values = {}
+    for addr in addrs:
+        has_value, val = calculate_cell_value(excel, addr)
+        if has_value:
+            values[addr] = val
+    return values
+
+def _calculate_cell_values(filename, addrs, profiler=None):
+    """Process pool worker for add_excel_calculated_values_parallel. Load the workbook and calculate the values of the formula
+    cells in addrs.
+
+    Returns
+    -------
+    tuple
+        The tuple (values, profiler), where values is a dict of {addr : value} for all cells that were calculated, and profiler is
+        the profiler that was passed in, with the recorded evaluations.
+    """
+    xl = openpyxl.load_workbook(filename)
+    return calculate_cell_values(xl, addrs, profiler=profiler), profiler
+
+def add_excel_calculated_values_parallel(xl, filename, sheets=None, profiler=None, num_processes=None):
+    """Add calculated values to all workbook cells in the specified sheets, calculating independent groups of formulas
+    in separate processes. See add_excel_calculated_values for details.
+
+    Returns
+    -------
+    dict
+        The calculated values, in the format {sheet_title : {coordinate : value}}, or None if the workbook could not be split
+        into more than one group (in which case nothing was calculated).
+    """
+    num_processes = num_processes or os.cpu_count() or 1
+    if num_processes <= 1:
+        return None
+    groups = get_independent_formula_groups(xl)
+    if groups is None:
+        return None
+
+    # Only calculate the formulas in the requested sheets (formulas in other sheets are still calculated by pycel if they are needed)
+    if sheets is not None:
+        sheet_prefixes = tuple(f"'{sheet_name}'!" for sheet_name in sheets)
+        groups = [[addr for addr in group if addr.startswith(sheet_prefixes)] for group in groups]
+        groups = [group for group in groups if len(group) > 0]
+
+    # Distribute the groups to the processes, assigning the largest remaining group to the process with the fewest cells
+    tasks = [[] for _ in range(min(num_processes, len(groups)))]
+    for group in sorted(groups, key=len, reverse=True):
+        min(tasks, key=len).extend(group)
+    if len(tasks) <= 1:
+        return None
+
+    print(f"Adding calculated values to {sum([len(t) for t in tasks])} formulas in {len(tasks)} processes")
+    with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(_calculate_cell_values, filename, task,
+            FormulaProfiler(column_names=profiler.column_names, num_slowest_cells=profiler.num_slowest_cells) if profiler is not None else None) for task in tasks]
+        results = [future.result() for future in futures]
+
+    all_values = { sheet_name : {} for sheet_name in xl.sheetnames }
+    for values, task_profiler in results:
+        for addr, val in values.items():
+            sheet_name, coordinate = addr.rsplit("!", 1)
+            sheet_name = sheet_name[1:-1]
+            all_values[sheet_name][coordinate] = val
+            if HAS_CALCULATED_VALUE_SLOT:
+                xl[sheet_name][coordinate].calculated_value = val
+        if profiler is not None:
+            profiler.merge(task_profiler)
+    return all_values
+
+def add_excel_calculated_values(xl, sheets=None, profiler=None, filename=None, num_processes=1):
     """Add calculated values to all workbook cells in the specified sheets (list of sheet names). If sheets is None then all sheets are
-    calculated.
+    calculated. If profiler (a FormulaProfiler) is set then the evaluation time of every formula is recorded in it.
+
+    If num_processes is more than 1 (or None, to use all CPUs) and filename is the file that xl was loaded from, then groups of
+    formulas that do not depend on each other are calculated in separate processes. If the workbook can not be split then
+    all values are calculated in the current process.
+
+    Returns
+    -------
+    dict
+        The calculated values, in the format {sheet_title : {coordinate : value}}. Pass these to save_calculated_values
+        to save them to the xlsx file. The values are also set in cell.calculated_value if openpyxl is patched to support it.
     """
+    if filename is not None and num_processes != 1:
+        all_values = add_excel_calculated_values_parallel(xl, filename, sheets=sheets, profiler=profiler, num_processes=num_processes)
+        if all_values is not None:
+            return all_values
+
     excel = ExcelCompiler(excel=xl)
+    if profiler is not None:
+        profiler.attach(excel, xl)
 
+    all_values = {}
     sheets = xl.sheetnames if sheets is None else sheets
     for sheet_name in sheets:
         print(f"Adding calculated values to {sheet_name}")
         sheet = xl[sheet_name]
+        values = all_values[sheet_name] = {}
         for row_num in range(sheet.min_row, sheet.max_row+1):
             for cell in sheet[row_num]:
-                if cell.data_type == "f" and isinstance(cell.value, str) and cell.value.strip()[0:1] == '=':
-                    addr = f"'{sheet_name}'!{cell.coordinate}"
-
-                    try:
-                        val = excel.evaluate(addr)
-                        cell.calculated_value = val
-                    except NameError:
-                        cell.calculated_value = "#NAME?"
-                    except FormulaEvalError as e:
-                        pass
-                    except Exception as e:
-                        raise ValueError(f"ERROR evaluating Excel formula at {addr}: {cell.value}: {e}")
+                if is_formula_cell(cell):
+                    has_value, val = calculate_cell_value(excel, f"'{sheet_name}'!{cell.coordinate}")
+                    if has_value:
+                        values[cell.coordinate] = val
+                        if HAS_CALCULATED_VALUE_SLOT:
+                            cell.calculated_value = val
+    return all_values
+
+def get_worksheet_parts(zip):
+    """Get the names of the worksheet XML files in an xlsx file.
+
+    Parameters
+    ----------
+    zip : ZipFile
+        The opened xlsx file.
+
+    Returns
+    -------
+    dict
+        The worksheet files in the format {sheet_title : file_name} (eg. {"Main" : "xl/worksheets/sheet1.xml"}).
+    """
+    workbook = ElementTree.fromstring(zip.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(zip.read("xl/_rels/workbook.xml.rels"))
+    targets = { rel.get("Id") : rel.get("Target") for rel in rels.iter(f"{XLSX_PACKAGE_REL_NS}Relationship") }
+    parts = {}
+    for sheet in workbook.iter(f"{XLSX_MAIN_NS}sheet"):
+        target = targets.get(sheet.get(f"{XLSX_REL_NS}id"), None)
+        if target is None:
+            continue
+        # Targets are relative to xl/ unless they are absolute
+        parts[sheet.get("name")] = target[1:] if target.startswith("/") else f"xl/{target}"
+    return parts
+
+def _get_xml_cell_with_value(match, values):
+    """Replacement function for XML_CELL_REGEX. Set the cached value of the matched cell to its value in values (a dict
+    of {coordinate : value}), if it is a formula cell. Values are formatted the same way as the patched openpyxl writer, except
+    for dates, which are saved as Excel serial numbers.
+    """
+    attributes, content = match.group(1), match.group(2)
+    if content is None or not content.lstrip().startswith("<f"):
+        return match.group(0)
+    coordinate = XML_CELL_COORDINATE_REGEX.search(attributes)
+    if coordinate is None or coordinate.group(1) not in values:
+        return match.group(0)
+    value = values[coordinate.group(1)]
+    if value is None:
+        return match.group(0)
+
+    attributes = XML_CELL_TYPE_REGEX.sub("", attributes)
+    if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+        # Dates are stored as numbers in Excel (the cell's number format shows it as a date)
+        value = to_excel(value)
+        if value is None:
+            return match.group(0)
+    if isinstance(value, str):
+        cell_type = "e" if len(value) > 0 and value[0] == '#' and value[-1] in ['!', '?'] else "str"
+        attributes = f'{attributes} t="{cell_type}"'
+    content = XML_CELL_VALUE_REGEX.sub("", content)
+    return f"<c{attributes}>{content}<v>{escape(safe_string(value))}</v></c>"
+
+def _stream_xml_cell_values(src, dst, values, chunk_size):
+    """Copy worksheet XML from src to dst (both text streams), setting the cached values of formula cells to values (a dict of
+    {coordinate : value}). At most about chunk_size characters of the XML are held in memory at once (unless a single row is larger).
+    """
+    replace = lambda match: _get_xml_cell_with_value(match, values)
+    pending = ""
+    in_sheet_data = True
+    while True:
+        chunk = src.read(chunk_size)
+        pending += chunk
+        if not in_sheet_data:
+            # Past the cells, copy the remaining XML (eg. conditional formatting) as is
+            dst.write(pending)
+            pending = ""
+        else:
+            end = pending.find("</sheetData>")
+            if end >= 0:
+                in_sheet_data = False
+                dst.write(XML_CELL_REGEX.sub(replace, pending[:end]))
+                dst.write(pending[end:])
+                pending = ""
+            elif not chunk:
+                dst.write(XML_CELL_REGEX.sub(replace, pending))
+                pending = ""
+            else:
+                # Only process complete cells, the rest is processed with the next chunk
+                end = max(pending.rfind("</c>"), pending.rfind("</row>"))
+                if end >= 0:
+                    end = pending.find(">", end) + 1
+                    dst.write(XML_CELL_REGEX.sub(replace, pending[:end]))
+                    pending = pending[end:]
+        if not chunk:
+            break
+
+def _parse_xml_cell_value(text, cell_type):
+    """Convert the cached value of a formula cell in worksheet XML to a Python value. The reverse of _get_xml_cell_with_value.
+    """
+    text = text or ""
+    if cell_type in ["str", "e"]:
+        return text
+    if text == "":
+        # An empty number is a formula without a cached value
+        return None
+    if cell_type == "b":
+        return text == "1"
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def load_calculated_values(filename):
+    """Load the cached values of all formula cells in an xlsx file, such as the values saved by save_calculated_values. Unlike
+    loading the workbook with openpyxl (with data_only=True), empty strings are kept and the formulas are not needed.
+
+    Parameters
+    ----------
+    filename : str
+        The xlsx file to load the values from.
+
+    Returns
+    -------
+    dict
+        The cached values, in the format {sheet_title : {coordinate : value}}. Formula cells without a cached value are not included.
+    """
+    all_values = {}
+    with ZipFile(filename, "r") as zip:
+        for sheet_name, part in get_worksheet_parts(zip).items():
+            values = all_values[sheet_name] = {}
+            with zip.open(part) as f:
+                for _, el in ElementTree.iterparse(f):
+                    if el.tag != f"{XLSX_MAIN_NS}c":
+                        continue
+                    formula, value = el.find(f"{XLSX_MAIN_NS}f"), el.find(f"{XLSX_MAIN_NS}v")
+                    if formula is not None and value is not None:
+                        cell_value = _parse_xml_cell_value(value.text, el.get("t"))
+                        if cell_value is not None:
+                            values[el.get("r")] = cell_value
+                    el.clear()
+    return all_values
+
+def save_calculated_values(filename, values, target_file=None, chunk_size=1024*1024):
+    """Save calculated values of formulas to an xlsx file, as the cached values of the formula cells. This does not require
+    openpyxl to be patched with calculated_value support, and the workbook is not loaded. Instead, each worksheet XML file
+    is streamed and only the formula cells are modified, so memory use stays low even for large workbooks.
+
+    Parameters
+    ----------
+    filename : str
+        The xlsx file to add the values to, usually saved by openpyxl.
+    values : dict
+        The values to save, in the format {sheet_title : {coordinate : value}}, as returned by add_excel_calculated_values.
+    target_file : str
+        The xlsx file to save to. If None then filename is overwritten.
+    chunk_size : int
+        Approximate number of characters of XML to process at once.
+    """
+    target_file = target_file or filename
+    target_dir = os.path.dirname(os.path.abspath(target_file))
+    with tempfile.NamedTemporaryFile(dir=target_dir, suffix=".xlsx", delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        with ZipFile(filename, "r") as inzip, ZipFile(temp_path, "w", ZIP_DEFLATED) as outzip:
+            parts = { part : values.get(sheet_name, {}) for sheet_name, part in get_worksheet_parts(inzip).items() }
+            for info in inzip.infolist():
+                out_info = ZipInfo(info.filename, date_time=info.date_time)
+                out_info.compress_type = ZIP_DEFLATED
+                with inzip.open(info) as src, outzip.open(out_info, "w", force_zip64=True) as dst:
+                    if len(parts.get(info.filename, {})) > 0:
+                        with io.TextIOWrapper(src, encoding="utf-8", newline="") as text_src, io.TextIOWrapper(dst, encoding="utf-8", newline="") as text_dst:
+                            _stream_xml_cell_values(text_src, text_dst, parts[info.filename], chunk_size)
+                    else:
+                        shutil.copyfileobj(src, dst, chunk_size)
+        # NamedTemporaryFile is only readable by the owner, so keep the permissions of the file that is replaced (or of
+        # filename, if target_file is new)
+        shutil.copymode(target_file if os.path.exists(target_file) else filename, temp_path)
+        os.replace(temp_path, target_file)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 @excel_helper()
 def stdev(*args):
@@ -174,7 +783,7 @@ pycel.lib.lookup.address = address
 
 if __name__ == "__main__":
     wb = openpyxl.load_workbook("/Users/martinwellman/Documents/Health/Wastewater/Code/test-new/populated-sep10.xlsx")
-    add_excel_calculated_values(wb)
-    wb.save("/Users/martinwellman/Documents/Health/Wastewater/Code/test-new/calc.xlsx")
+    values = add_excel_calculated_values(wb)
+    save_calculated_values("/Users/martinwellman/Documents/Health/Wastewater/Code/test-new/populated-sep10.xlsx", values, target_file="/Users/martinwellman/Documents/Health/Wastewater/Code/test-new/calc.xlsx")
     print("Finished!")
 
@@ -4,22 +4,48 @@ import pandas as pd
 import yaml
 import argparse
 from easydict import EasyDict
+from functools import lru_cache
 import re
 from qpcr_utils import (
-    QPCRError
+    QPCRError,
+    load_cached_reference,
 )
 
 TARGET_COLUMN = "target"
 TARGET_ALIASES_COLUMN = "targetAliases"
 DILUTION_FACTOR_COLUMN = "dilutionFactor"
 
+DILUTION_REGEX = re.compile(r"[^\:]*\:([0-9\.]*)$")
+TARGET_DILUTION_REGEX = re.compile(r"\:[0-9\.]*$")
+
+@lru_cache(maxsize=None)
+def parse_target_dilution(target):
+    """Split the target name and the dilution factor (eg. "covN1:10" is split into "covN1" and 10). The result is
+    cached for each distinct target string. See QPCRMethods.split_target_and_dilution_factor.
+    """
+    dilution = DILUTION_REGEX.sub(r"\1", target)
+    try:
+        dilution = float(dilution)
+        if dilution == int(dilution):
+            dilution = int(dilution)
+    except Exception as e:
+        dilution = 1
+    target = TARGET_DILUTION_REGEX.sub("", target)
+    
+    return target, dilution
+
 class QPCRMethods(object):
-    def __init__(self, config, methods_file): 
+    def __init__(self, config, methods_file, cache_dir=None): 
         with open(config, "r") as f:
             self.config = yaml.safe_load(f)
         
-        self.load_methods_file(methods_file)
-        self.apply_defaults()
+        def _load():
+            self.load_methods_file(methods_file)
+            self.apply_defaults()
+            return self.methods_df
+        # The cleaned methods table is cached in cache_dir (if set) while the methods file and config are unchanged
+        self.methods_df = load_cached_reference(cache_dir, "methods", [config, methods_file], _load)
+        self.index_targets()
         
     def apply_defaults(self):
         for default_info in self.config["defaults"]:
@@ -59,36 +85,51 @@ class QPCRMethods(object):
         self.methods_df = self.methods_df.dropna(axis=0, how="all")
         
         self.methods_df = self.methods_df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        
+
+    def index_targets(self):
+        """Index the methods table by target name and target alias. Creates self.target_rows, which maps each lower case
+        target name and alias to the row position of its method. Target names take precedence over aliases, and otherwise
+        the first matching row wins.
+        """
+        target_rows = {}
+        alias_rows = {}
+        for pos, (target, aliases) in enumerate(zip(self.methods_df[TARGET_COLUMN], self.methods_df[TARGET_ALIASES_COLUMN])):
+            if not isinstance(target, str):
+                continue
+            target_rows.setdefault(target.strip().lower(), pos)
+            if aliases and isinstance(aliases, str):
+                for alias in aliases.split(","):
+                    alias_rows.setdefault(alias.strip().lower(), pos)
+        alias_rows.update(target_rows)
+        self.target_rows = alias_rows
+        self.method_rows = {}
+
     def get_row_for_target(self, target):
+        """Get the method row for the target, with the dilution factor (eg. 10 for "covN1:10") in the dilutionFactor column.
+        The rows are shared between calls with the same target, and are read-only.
+
+        Parameters
+        ----------
+        target : str
+            The target name or alias, optionally followed by a colon and the dilution factor (eg. "covN1:10").
+
+        Returns
+        -------
+        pd.Series | None
+            The method row for the target, or None if the target is not recognized.
+        """
+        if target in self.method_rows:
+            return self.method_rows[target]
+
         target_nodil, dilution = self.split_target_and_dilution_factor(target)
-        
-        # Find a match for the match_target
-        match_target = target_nodil.strip().lower()
-        match = self.methods_df.loc[self.methods_df[TARGET_COLUMN].str.lower() == match_target]
-        if match is not None and len(match.index) > 0:
-            row = match.iloc[0].copy()
+        pos = self.target_rows.get(target_nodil.strip().lower(), None)
+        row = None
+        if pos is not None:
+            row = self.methods_df.iloc[pos].copy()
             row[DILUTION_FACTOR_COLUMN] = dilution
-            return row
-        
-        # Find a match for the match_target in the aliases column
-        for idx, row in self.methods_df.iterrows():
-            if pd.isna(row[TARGET_COLUMN]):
-                continue
-            if match_target == row[TARGET_COLUMN].strip().lower():
-                row = row.copy()
-                row[DILUTION_FACTOR_COLUMN] = dilution
-                return row
-            aliases = row[TARGET_ALIASES_COLUMN]
-            if not aliases:
-                continue
-            aliases = [a.strip().lower() for a in aliases.split(",")]
-            if match_target in aliases:
-                row = row.copy()
-                row[DILUTION_FACTOR_COLUMN] = dilution
-                return row
-        
-        return None
+            row.values.setflags(write=False)
+        self.method_rows[target] = row
+        return row
             
     def get_dilution_factor(self, target):
         row = self.get_row_for_target(target)
@@ -97,31 +138,24 @@ class QPCRMethods(object):
         return 1
     
     def split_target_and_dilution_factor(self, target):
-        dilution = re.sub(r"[^\:]*\:([0-9\.]*)$", r"\1", target)
-        try:
-            dilution = float(dilution)
-            if dilution == int(dilution):
-                dilution = int(dilution)
-        except Exception as e:
-            dilution = 1
-        target = re.sub(r"\:[0-9\.]*$", "", target)
-        
-        return target, dilution
+        return parse_target_dilution(target)
         
 if __name__ == "__main__":
     if "get_ipython" in globals():
         opts = EasyDict({
             "config" : "qpcr_methods.yaml",
             "methods_file" : "qpcr_methods.xlsx",
+            "cache_dir" : None,
         })
     else:
         args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
         args.add_argument("--config", type=str, help="Configuration file", default="qpcr_methods.yaml", required=True)
         args.add_argument("--methods_file", type=str, help="Methods Excel file", default="qpcr_methods.xlsx", required=True)
+        args.add_argument("--cache_dir", type=str, help="Directory to cache the cleaned methods table in. No caching is done if not set.", required=False)
         
         opts = args.parse_args()
 
-    methods = QPCRMethods(opts.config, opts.methods_file)
+    methods = QPCRMethods(opts.config, opts.methods_file, cache_dir=opts.cache_dir)
     
     r = methods.get_row_for_target("covN2")
     print(r)
@@ -22,10 +22,11 @@ import re
 import math
 import cloud_utils
 import argparse
+import pickle
 
 from datetime import datetime, date
 
-from excel_calculator import add_excel_calculated_values
+from excel_calculator import add_excel_calculated_values, calculate_cell_values, load_calculated_values, save_calculated_values, is_formula_cell, FormulaProfiler
 import logging
 logging.getLogger("pycel").setLevel(logging.CRITICAL)
 
@@ -35,6 +36,7 @@ from openpyxl.utils import units
 from openpyxl import Workbook
 from openpyxl.formula.translate import Translator
 from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.formatting.formatting import ConditionalFormattingList
 from openpyxl.chart import ScatterChart, Reference, Series
 from openpyxl.chart.trendline import Trendline, TrendlineLabel
 from openpyxl.chart.shapes import GraphicalProperties
@@ -43,7 +45,9 @@ from openpyxl.styles.numbers import is_date_format
 
 from qpcr_qaqc import (
     QPCRQAQC,
+    CT_OUTLIERS_SETTINGS,
 )
+from qpcr_qaqc_table import STATUS_PASS
 
 # pd.set_option('mode.chained_assignment', "raise")
 
@@ -51,6 +55,7 @@ from qpcr_sites import QPCRSites
 from qpcr_sampleids import QPCRSampleIDs
 from qpcr_sampleslog import QPCRSamplesLog
 from qpcr_methods import QPCRMethods
+from qpcr_targets import QPCRTargets
 from excel_file_utils import fix_xlsx_file
 from qpcr_utils import (
     OUTLIER_COL,
@@ -70,6 +75,11 @@ from qpcr_utils import (
     excel_addr_to_fixed,
     sheet_to_df,
     parse_values,
+    fit_standard_curve,
+    format_columns,
+    map_unique,
+    apply_schema,
+    QPCRError,
 )
 import custom_functions
 from custom_functions import (
@@ -78,10 +88,19 @@ from custom_functions import (
     CUSTOM_FUNC_SEP,
 )
 
+# Low cardinality columns of qpcr_df that are stored as categoricals (see QPCRPopulator.get_qpcr_df_schema). The extracter
+# columns are named by the extracter, the others are the config.input keys of the column names.
+CATEGORICAL_EXTRACTER_COLS = ["wellID", "qpcrFormat"]
+CATEGORICAL_CONFIG_COLS = ["measure_type_col", "plate_id_col", "site_id_col", "sampling_type_col", "sample_short_description_col", "sample_description_col"]
+
 class QPCRPopulator(object):
-    def __init__(self, input_file, template_file, target_file, overwrite, config_file, qaqc_config_file, sites_config, sites_file, sampleids_config, sampleslog_config, sampleslog_file, methods_config, methods_file, hide_qaqc=False):
+    def __init__(self, input_file, template_file, target_file, overwrite, config_file, qaqc_config_file, sites_config, sites_file, sampleids_config, sampleslog_config, sampleslog_file, methods_config, methods_file, hide_qaqc=False, profile_formulas=False, formula_processes=1, qaqc_table=False, save_qaqc_cache=False, qaqc_workers=1, reference_cache_dir=None):
         super().__init__()
         self.hide_qaqc = hide_qaqc
+        self.qaqc_table = qaqc_table
+        self.save_qaqc_cache = save_qaqc_cache
+        self.profile_formulas = profile_formulas
+        self.formula_processes = formula_processes
         self.input_file = input_file
         self.template_file = template_file
         self.target_file = target_file
@@ -94,12 +113,13 @@ class QPCRPopulator(object):
         self.row_data = {}
 
         self.config = load_config(self.config_file)
-        self.qaqc = QPCRQAQC(self, qaqc_config_file, config_file)
+        self.targets = QPCRTargets(self.config)
+        self.qaqc = QPCRQAQC(self, qaqc_config_file, config_file, max_workers=qaqc_workers)
 
-        self.sites = QPCRSites(sites_config, sites_file)
-        self.sampleids = QPCRSampleIDs(sampleids_config, sites_config, sites_file)
-        self.sampleslog = QPCRSamplesLog(sampleslog_config, sampleslog_file, sampleids_config, sites_config, sites_file)
-        self.methods = QPCRMethods(methods_config, methods_file)
+        self.sites = QPCRSites(sites_config, sites_file, cache_dir=reference_cache_dir)
+        self.sampleids = QPCRSampleIDs(sampleids_config, sites_config, sites_file, cache_dir=reference_cache_dir)
+        self.sampleslog = QPCRSamplesLog(sampleslog_config, sampleslog_file, sampleids_config, sites_config, sites_file, cache_dir=reference_cache_dir)
+        self.methods = QPCRMethods(methods_config, methods_file, cache_dir=reference_cache_dir)
 
     def get_column_names(self, sheet_name, col_id):
         """Get all the names (eg. "main_col_ct") attached to the specified Excel column (eg. "AB") in the specified sheet.
@@ -109,6 +129,27 @@ class QPCRPopulator(object):
         _, min_col = info["origin"]
         return info["col_names"][col - min_col]
 
+    def get_profiler_column_names(self):
+        """Get the template column names of all sheets in worksheets_info, for use by the FormulaProfiler. The sheet name
+        that qualifies the column names internally is removed (eg. "main_col_ct" instead of "Main-main_col_ct").
+
+        Returns
+        -------
+        dict
+            The column names, in the format {sheet_title : {column_letter : [names]}}.
+        """
+        column_names = {}
+        for info in self.worksheets_info:
+            if info.get("col_names") is None:
+                continue
+            _, min_col = info["origin"]
+            prefix = add_sheet_name_to_colrow_name(info["sheet_name"], "")
+            column_names[info["ws"].title] = {
+                get_column_letter(min_col + idx) : [n[len(prefix):] if n and n.startswith(prefix) else n for n in names]
+                for idx, names in enumerate(info["col_names"])
+            }
+        return column_names
+
     def get_named_columns(self, sheet_name, match_col_name, flatten_names=False):
         """Get the Excel column Ids (eg. 'A', 'AB') of the named columns, as specified in a
         template file. (These are the named columns in the formatted output file).
@@ -156,6 +197,66 @@ class QPCRPopulator(object):
             columns = flatten(columns)
         return columns
 
+    def index_row_names(self, info):
+        """Build the index of row names for a worksheet from its current row names. The index is then kept up to
+        date by copy_rows. See get_named_rows.
+
+        Parameters
+        ----------
+        info : dict
+            The worksheet info dictionary (from worksheets_info). The index is stored in info["row_index"], in the
+            format {row_name : set(row_idx)}, with row_idx relative to the sheet's origin. The target and sample ID
+            of each row with data is stored in info["row_keys"], in the format {row_idx : (target, sample_id)}.
+        """
+        info["row_index"] = {}
+        info["row_keys"] = {}
+        for row_idx, names in enumerate(info["row_names"]):
+            for name in names:
+                info["row_index"].setdefault(name, set()).add(row_idx)
+
+    def add_row_name(self, info, row_idx, row_name):
+        """Add a name to a row of a worksheet, and to the worksheet's index of row names.
+
+        Parameters
+        ----------
+        info : dict
+            The worksheet info dictionary (from worksheets_info).
+        row_idx : int
+            The row, relative to the sheet's origin.
+        row_name : str
+            The row name to add. The sheet name should already be added to it (see add_sheet_name_to_colrow_name).
+        """
+        row_names = info["row_names"]
+        while len(row_names) <= row_idx:
+            row_names.append([])
+        row_names[row_idx].append(row_name)
+        info["row_index"].setdefault(row_name, set()).add(row_idx)
+
+    def get_named_rows(self, sheet_name, match_row_name):
+        """Get the rows that have any of the specified row names and that have data.
+
+        Parameters
+        ----------
+        sheet_name : str
+            The sheet name.
+        match_row_name : str | list | tuple | np.ndarray
+            The row names to match. The sheet name must already be added to the row names (see add_sheet_name_to_colrow_name).
+
+        Returns
+        -------
+        list
+            The matching rows, as indices relative to the sheet's origin (ie. into info["row_data"]), in ascending order.
+        """
+        if isinstance(match_row_name, str):
+            match_row_name = [match_row_name]
+        _, info = self.get_worksheet_and_info(sheet_name)
+        row_index = info["row_index"]
+        row_data = info["row_data"]
+        rows = set()
+        for name in match_row_name:
+            rows.update(row_index.get(name, ()))
+        return sorted([r for r in rows if r < len(row_data) and len(row_data[r]) > 0])
+
     def get_named_range(self, sheet_name, row_name, col_name, fixed_rows=True, fixed_cols=True, include_sheet_name=False, override_row=None, override_col=None, max_rows=None, max_cols=None):
         """Get an Excel range (eg. "AB3:AB20") for the specified row and column names.
 
@@ -699,7 +800,6 @@ class QPCRPopulator(object):
 
         max_col = target_col
         row_name = add_sheet_name_to_colrow_name(target_sheet_name, row_name)
-        row_names = target_info["row_names"]
         row_data = target_info["row_data"]
         row_origin = target_info["origin"][0]
 
@@ -720,15 +820,14 @@ class QPCRPopulator(object):
         for cur_row in rows:
             # Add the row_name to the worksheet's row_names info
             if row_name is not None:
-                cur_idx = target_row - row_origin
-                while len(row_names) <= cur_idx:
-                    row_names.append([])
-                row_names[cur_idx].append(row_name)
+                self.add_row_name(target_info, target_row - row_origin, row_name)
             if row_data is not None:
                 cur_idx = target_row - row_origin
                 while len(row_data) <= cur_idx:
                     row_data.append([])
                 row_data[cur_idx].append(data)
+                if cur_idx not in target_info["row_keys"] and isinstance(data, pd.DataFrame) and len(data.index) > 0:
+                    target_info["row_keys"][cur_idx] = (data[self.config.input.target_col].iloc[0], data[self.config.input.sample_id_col].iloc[0])
             
             # Copy all cells in the row
             for cur_col, cell in enumerate(cur_row):
@@ -1040,7 +1139,8 @@ class QPCRPopulator(object):
             return all_groups
                         
         for idx, (target_name, target_df) in enumerate(_form_groups(std_data)):
-            for plate_id, plate_df in target_df.groupby(self.config.input.plate_id_col):
+            # Plate IDs are categorical, and groupby with observed=True keeps the categories in order of appearance, so sort explicitly
+            for plate_id, plate_df in sorted(target_df.groupby(self.config.input.plate_id_col, observed=True), key=lambda group: group[0]):
                 row_data_kwargs = {
                     "plateID" : plate_id,
                 }
@@ -1077,6 +1177,7 @@ class QPCRPopulator(object):
                         "plateID" : plate_id,
                         "ran_qaqc" : False,
                     })
+                    self.index_row_names(self.worksheets_info[-1])
                 
                 _, cal_info = self.get_worksheet_and_info(ws_title)
 
@@ -1118,47 +1219,13 @@ class QPCRPopulator(object):
                 # If calibration_multi is set, then we prefer to use at least calibration.multi.min_points
                 # values for the calibration curve. If we have more points, we pick whichever number of
                 # points that result in a slope closest to calibration_multi.preferred_slope
-                max_points = len(cal_logsq)
-                min_points = min(self.config.input.calibration_multi.min_points, max_points)
-                calibration_multi = self.config.input.get("calibration_multi", None)
-                if calibration_multi is not None:
-                    preferred_slope = calibration_multi.preferred_slope
-                    items = [(cal_logsq[:min_points], cal_ct[:min_points])]
-                    if max_points > min_points:
-                        for i in range(min_points+1, max_points+1):
-                            items.append((cal_logsq[:i], cal_ct[:i]))
-                else:
-                    preferred_slope = None
-                    items = [(cal_logsq, cal_ct)]
-                # Calculate all the slopes, and choose the best one
-                slope = intercept = rsq = None
-                num_points = max_points
-                
-                # print("SAMPLEID:", sample_id, len(cur_sq_data.index), items)
-                
-                for idx, (logsq, ct) in enumerate(items):
-                    A = np.vstack([logsq, np.ones(len(logsq))]).T
-                    _slope, _intercept = np.linalg.lstsq(A, ct, rcond=None)[0]
-                    corr_matrix = np.corrcoef(logsq, ct)
-                    _rsq = corr_matrix[0,1]**2
-
-                    if slope is None or abs(_slope - preferred_slope) < abs(slope - preferred_slope):
-                        num_points = idx + min_points
-                        slope, intercept = _slope, _intercept
-                        rsq = _rsq 
-
-                eff = 10**(-1/slope) - 1
+                curve = fit_standard_curve(cal_logsq, cal_ct, self.config.input.get("calibration_multi", None))
 
                 # Add our calculated values.
                 cal_info["cal_curve"] = {
                     # "reg" : reg,
                     "sq" : sq,
-                    "slope" : slope,
-                    "intercept" : intercept,
-                    "rsq" : rsq,
-                    "eff" : eff,
-                    "num_points" : num_points,
-                    "max_points" : max_points,
+                    **curve,
                     "max_ct" : cal_ct[-1],
                     "min_ct" : cal_ct[0],
                 }
@@ -1341,37 +1408,11 @@ class QPCRPopulator(object):
         return row_data.copy()
 
     def get_recognized_target(self, target_name, main_targets_only=False):
-        """Map the specified target name to a unique one, ensuring that target names are consistent.
-        The map is specified by input.main_targets and input.other_targets in the config file.
+        """Map the specified target name (or a pd.Series of target names) to a unique one, ensuring that target names are consistent.
+        The map is specified by input.main_targets, input.other_targets, input.inhibition_targets and input.normalizing_targets in
+        the config file. See QPCRTargets.get_recognized_target.
         """
-        if target_name is None:
-            return None
-        recognized_targets = self.config.input.get("main_targets", [])
-        if isinstance(recognized_targets, str):
-            recognized_targets = [recognized_targets]
-
-        # Add other targets
-        if not main_targets_only:
-            other_targets = self.config.input.get("other_targets", []) or []
-            if isinstance(other_targets, str):
-                other_targets = [other_targets]
-            inhibition_targets = self.config.input.get("inhibition_targets", []) or []
-            if isinstance(inhibition_targets, str):
-                inhibition_targets = [inhibition_targets]
-            normalizing_targets = self.config.input.get("normalizing_targets", []) or []
-            if isinstance(normalizing_targets, str):
-                normalizing_targets = [normalizing_targets]
-            recognized_targets = list(recognized_targets) + list(other_targets) + list(inhibition_targets) + list(normalizing_targets)
-            
-        if len(recognized_targets) == 0:
-            return target_name
-        
-        lower_recognized_targets = [g.lower() for g in recognized_targets]
-
-        if target_name.lower() in lower_recognized_targets:
-            return recognized_targets[lower_recognized_targets.index(target_name.lower())]
-        
-        return None
+        return self.targets.get_recognized_target(target_name, main_targets_only=main_targets_only)
     
     def create_main(self, group_name, data):
         """Create the main sheet for the specified group of data. The data should usually represent a full QPCR run, possibly
@@ -1387,13 +1428,13 @@ class QPCRPopulator(object):
         target_groups = []
 
         # Group by all the main_targets (specified in config file)
-        other_targets = [g.lower() for g in self.config.input.other_targets or []]
+        lower_targets = ct_values[self.config.input.target_col].str.lower()
+        # Collect all other targets that we're interested in (other_targets in the config file)
+        other_targets_filt = lower_targets.isin([g.lower() for g in self.config.input.other_targets or []])
         for target_name in self.config.input.main_targets:
-            target_filt = ct_values[self.config.input.target_col].str.lower() == target_name.lower()
+            target_filt = lower_targets == target_name.lower()
             if target_filt.sum() == 0:
                 continue
-            # Collect all other targets that we're interested in (other_targets in the config file)
-            other_targets_filt = ct_values[self.config.input.target_col].str.lower().isin(other_targets)
             group = ct_values[target_filt | other_targets_filt]
             target_groups.append((target_name, group))
 
@@ -1422,6 +1463,7 @@ class QPCRPopulator(object):
         info["col_names"] = col_names
         info["row_names"] = row_names
         info["row_data"] = []
+        self.index_row_names(info)
 
         row_data_kwargs = {
             "groupName" : group_name,
@@ -1620,7 +1662,7 @@ class QPCRPopulator(object):
 
         unknowns_filt = df[self.config.input.measure_type_col] == self.config.input.measure_type_unknown
         cleaned_site_id_col = "___cleaned_site_id___"
-        df[cleaned_site_id_col] = df[self.config.input.site_id_col].map(_clean_site_id)
+        df[cleaned_site_id_col] = map_unique(df[self.config.input.site_id_col], _clean_site_id)
         groups = self.sites.group_by_file_template(df, cleaned_site_id_col, self.target_file, intersection_filter=unknowns_filt, always_include_filter=~unknowns_filt)
         del df[cleaned_site_id_col]
         return groups
@@ -1683,72 +1725,92 @@ class QPCRPopulator(object):
         return int(match[1] if match[1] else 0) if match is not None else None
 
     def prepare_reruns(self, df):
-        # @TODO: Test this and rewrite (with comments)
+        """Collapse the reruns of samples (see collapse_reruns in the config). A sample ID that matches sample_rerun_number
+        is a rerun of the sample ID captured by sample_rerun_id (the same as get_rerun_number and get_id_without_rerun), for
+        the same target and measure type. Going through the reruns of each sample from the lowest rerun number to the
+        highest, each rerun replaces (drops) as many of the sample's remaining rows (lowest index_col first), and is then
+        renamed to the sample ID without the rerun.
+
+        The rerun numbers and IDs are extracted for all rows at once. Samples where each rerun has at least as many rows as
+        the rerun (or original) before it keep only their last rerun. The few other samples are collapsed one rerun at a time.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The QPCR data, with the index_col column set.
+
+        Returns
+        -------
+        pd.DataFrame
+            df with the replaced rows dropped and the reruns renamed.
+        """
         if "collapse_reruns" not in self.config.input:
             return df
+        collapse_reruns = self.config.input.collapse_reruns
+        sample_ids = df[self.config.input.sample_id_col]
+        targets = df[self.config.input.target_col]
+        measure_types = df[self.config.input.measure_type_col]
+
+        # Group 0 is the full match (only NaN if there is no match), group 1 is the rerun number
+        numbers = sample_ids.str.extract(f"({collapse_reruns.sample_rerun_number})", expand=True)
+        rerun_pos = np.flatnonzero((numbers[0].notna() & targets.isin(collapse_reruns.targets)).to_numpy())
+        if len(rerun_pos) == 0:
+            return df
+        ids = sample_ids.iloc[rerun_pos].str.extract(collapse_reruns.sample_rerun_id, expand=True)[0]
+        ids = ids.where(ids.notna() & (ids != ""), sample_ids.iloc[rerun_pos])
+        reruns = pd.DataFrame({
+            "id" : ids.to_numpy(),
+            "target" : targets.iloc[rerun_pos].to_numpy(),
+            "measure_type" : measure_types.iloc[rerun_pos].to_numpy(),
+            "number" : numbers[1].iloc[rerun_pos].replace("", np.nan).fillna(0).astype(int).to_numpy(),
+            "pos" : rerun_pos,
+        })
 
-        reruns = pd.DataFrame()
-        reruns["original_id"] = df[self.config.input.sample_id_col]
-        reruns["id"] = df[self.config.input.sample_id_col].map(self.get_id_without_rerun)
-        reruns["number"] = df[self.config.input.sample_id_col].map(self.get_rerun_number)
-        reruns["target"] = df[self.config.input.target_col]
-        reruns["measure_type"] = df[self.config.input.measure_type_col]
-        reruns["index"] = df[self.config.input.index_col]
-        # reruns["index"] = df[self.config.input.index_col]
-        reruns.index = df.index
-        reruns = reruns.dropna(subset=["number"], how="any")
-        reruns["number"] = reruns["number"].astype(int)
-
-        reruns = reruns[reruns["target"].isin(self.config.input.collapse_reruns.targets)]
-        # print(reruns)
-
-        groups = reruns.groupby(["id", "target", "measure_type"], as_index=False)
-        for (group_id, group_target, group_measure_type), group_idx in groups.groups.items():
-            group = reruns.loc[group_idx]
-            group_id, group_target, group_measure_type = group[["id", "target", "measure_type"]].iloc[0].tolist()
-            max_rerun = group["number"].max()
-
-            # Go through all reruns, from 0 to max_rerun, project down to non-rerun values at each step
-            for r in range(max_rerun+1):
-                cur_reruns = group[group["number"] == r]
-                if len(cur_reruns.index) == 0:
-                    continue                
-                # Delete the first len(cur_reruns.index) non-reruns
-                cur_reruns = cur_reruns.sort_values("index")
-                def _match(df, value):
-                    # df["column"] == None will always be False, so we need special consideration for it.
-                    # See: https://pandas.pydata.org/pandas-docs/stable/user_guide/missing_data.html
-                    if value is None:
-                        return df.isna()
-                    return df == value
-                non_reruns = df[_match(df[self.config.input.sample_id_col], group_id) & \
-                    _match(df[self.config.input.target_col], group_target) & \
-                    _match(df[self.config.input.measure_type_col], group_measure_type)]
-                non_reruns = non_reruns.sort_values(self.config.input.index_col)
-                df = df.drop(index=non_reruns.index[:min(len(cur_reruns.index), len(non_reruns.index))])
-
-                # Rename the reruns to be a non-rerun
-                df.loc[cur_reruns.index, self.config.input.sample_id_col] = group_id
+        # The original (non-rerun) rows of each rerun sample are rerun number -1. Missing measure types are matched
+        # to each other (merge matches NaN keys).
+        key_cols = ["id", "target", "measure_type"]
+        originals = pd.DataFrame({
+            "id" : sample_ids.to_numpy(),
+            "target" : targets.to_numpy(),
+            "measure_type" : measure_types.to_numpy(),
+            "number" : -1,
+            "pos" : np.arange(len(df.index)),
+        }).merge(reruns[key_cols].drop_duplicates(), on=key_cols, how="inner")
+        rows = pd.concat([originals, reruns], ignore_index=True)
+        rows["group"] = rows.groupby(key_cols, sort=False, dropna=False).ngroup()
+        rows["index"] = df[self.config.input.index_col].to_numpy()[rows["pos"].to_numpy()]
+
+        # Samples where no rerun has fewer rows than the one before it only keep the rows of their last rerun
+        sizes = rows.groupby(["group", "number"]).size()
+        simple = (sizes.groupby(level="group").diff().fillna(0) >= 0).groupby(level="group").all()
+        is_simple = simple.reindex(rows["group"]).to_numpy()
+        dropped = is_simple & (rows["number"] != rows.groupby("group")["number"].transform("max")).to_numpy()
+
+        # Collapse the other samples one rerun at a time. Each rerun drops the first rows (by index_col with missing values
+        # last, then by order in df) of the rows remaining so far.
+        for _, group_rows in rows[~is_simple].groupby("group"):
+            remaining = []
+            for number, cur_rows in group_rows.groupby("number"):
+                cur_rows = list(zip(cur_rows["index"].isna(), cur_rows["index"].fillna(0), cur_rows["pos"], cur_rows.index))
+                if number >= 0:
+                    remaining = sorted(remaining)
+                    dropped[[row[-1] for row in remaining[:len(cur_rows)]]] = True
+                    remaining = remaining[len(cur_rows):]
+                remaining.extend(cur_rows)
+
+        renamed = rows[~dropped & (rows["number"] >= 0).to_numpy()]
+        renamed_index = df.index[renamed["pos"].to_numpy()]
+        df = df.drop(index=df.index[rows.loc[dropped, "pos"].to_numpy()])
+        df.loc[renamed_index, self.config.input.sample_id_col] = renamed["id"].to_numpy()
 
         return df
         
     def get_standard_curve_common_target(self, target):
         """Get the common root target name that is used for the specified target to refer to a standard curve. For example,
         the target PMMoV:10, which is a PMMoV dilution, will typically be mapped to the target PMMoV, which is
-        the undiluted form. Both PMMoV:10 and PMMoV use the same standard curve.
+        the undiluted form. Both PMMoV:10 and PMMoV use the same standard curve. See QPCRTargets.get_standard_curve_common_target.
         """
-        def _get_common_target(target):
-            common_targets = self.config.input.get("standard_curve_common_targets", None)
-            if common_targets is not None:
-                for key, names in common_targets.items():
-                    if target.lower() in [n.lower() for n in names]:
-                        return key
-            return target
-        if isinstance(target, str):
-            target = _get_common_target(target)
-        else:
-            target = target.map(_get_common_target)
-        return target
+        return self.targets.get_standard_curve_common_target(target)
 
     def get_standard_curve_id(self, target, plateID):
         """Get the standard curve ID (ie. it's sheet name) for the standard curve for the specified target
@@ -1756,12 +1818,11 @@ class QPCRPopulator(object):
 
         Parameters
         ----------
-        target : str | pd.DataFrame
-            The target to get the curve ID for. Can be a single target (str) or a DataFrame of targets. If a DataFrame
-            then the column self.config.input.target_col is used.
-        plateID : str | pd.DataFrame
-            The plate ID that contains the standard curve for the target. Can be a single plate ID (str) or a DataFrame 
-            of plate IDs. If a DataFrame then the column self.config.input.plate_id_col is used.
+        target : str | pd.Series
+            The target to get the curve ID for. Can be a single target (str) or a Series of targets.
+        plateID : str | pd.Series
+            The plate ID that contains the standard curve for the target. Can be a single plate ID (str) or a Series 
+            of plate IDs.
 
         Returns
         -------
@@ -1773,16 +1834,8 @@ class QPCRPopulator(object):
 
         if isinstance(target, str) and isinstance(plateID, str):
             return CAL_SHEET_FMT.format(targetName=target, plateID=plateID)
-        elif isinstance(target, str):
-            # target is a string, plateID is a DataFrame
-            target = pd.DataFrame({self.config.input.target_col : [target]*len(plateID.index)}, index=plateID.index)
-        elif isinstance(plateID, str):
-            # target is a DataFrame, plateID is a string
-            plateID = pd.DataFrame({self.config.input.plate_id_col : [plateID]*len(target.index)}, index=target.index)
-
-        return pd.concat([target, plateID], axis=1).agg(lambda x: CAL_SHEET_FMT.format(targetName=x[self.config.input.target_col], plateID=x[self.config.input.plate_id_col]), axis=1)
 
-        # return CAL_SHEET_FMT.format(targetName=target, plateID=plateID)
+        return format_columns(CAL_SHEET_FMT, plateID.index if isinstance(target, str) else target.index, targetName=target, plateID=plateID)
 
     def assign_standard_curve_ids(self):
         """Add the standard curve IDs to all items in the QPCR DataFrame (self.qpcr_df). The standard curve IDs depend
@@ -1798,33 +1851,42 @@ class QPCRPopulator(object):
         known_std_curves = self.qpcr_df.loc[std_filt]
         known_std_curves = known_std_curves.sort_values(self.config.input.analysis_date_col, ascending=False)
 
-        def _find_standard_curve(row):
-            same_target_filt = self.get_standard_curve_common_target(row[self.config.input.target_col]) == self.get_standard_curve_common_target(known_std_curves[self.config.input.target_col])
-            same_plate_id_filt = row[self.config.input.plate_id_col] == known_std_curves[self.config.input.plate_id_col] #standard_curve_id_col]
-
-            # Our own plate has a standard curve for our target type
-            if (same_target_filt & same_plate_id_filt).sum() > 0:
-                return self.get_standard_curve_id(row[self.config.input.target_col], row[self.config.input.plate_id_col])
-
-            if self.config.input.require_cal_curve_on_same_plate:
-                # Standard curves must be on the same plate as the unknowns, but none was found
-                return ""
-
-            # Try to find another plate with a standard curve for our target type
-            # We take the plate with the QPCR date closest to our own QPCR date (either before or after)
-            other_plates_filt = known_std_curves[self.config.input.plate_id_col] != row[self.config.input.plate_id_col]
-            other_plates = known_std_curves[other_plates_filt & same_target_filt]
-            if len(other_plates.index) == 0:
-                # No standard curves with same target (but on different plate) found
-                return ""
-
-            delta_date = (other_plates[self.config.input.analysis_date_col] - row[self.config.input.analysis_date_col]).map(abs)
-            min_delta = delta_date.idxmin()
-            return other_plates.loc[min_delta][self.config.input.standard_curve_id_col]
+        # All available curves, by common target and plate ID. Curves earlier in the table are preferred if the dates are tied.
+        curves = pd.DataFrame({
+            "target" : self.get_standard_curve_common_target(known_std_curves[self.config.input.target_col]).to_numpy(),
+            "plate_id" : known_std_curves[self.config.input.plate_id_col].to_numpy(),
+            "date" : known_std_curves[self.config.input.analysis_date_col].to_numpy(),
+            "curve_id" : known_std_curves[self.config.input.standard_curve_id_col].to_numpy(),
+            "order" : np.arange(len(known_std_curves.index)),
+        })
 
         # Assign all curve plate IDs for all QPCR samples
         ct_filt = self.qpcr_df[self.config.input.measure_type_col].isin([self.config.input.measure_type_unknown, self.config.input.measure_type_ntc, self.config.input.measure_type_eb])
-        self.qpcr_df.loc[ct_filt, self.config.input.standard_curve_id_col] = self.qpcr_df.loc[ct_filt].agg(_find_standard_curve, axis=1)
+        samples = self.qpcr_df.loc[ct_filt]
+        sample_curves = pd.DataFrame({
+            "target" : self.get_standard_curve_common_target(samples[self.config.input.target_col]).to_numpy(),
+            "plate_id" : samples[self.config.input.plate_id_col].to_numpy(),
+            "date" : samples[self.config.input.analysis_date_col].to_numpy(),
+        })
+
+        # Our own plate has a standard curve for our target type
+        on_plate = pd.MultiIndex.from_frame(sample_curves[["target", "plate_id"]]).isin(pd.MultiIndex.from_frame(curves[["target", "plate_id"]].dropna()))
+        curve_ids = pd.Series("", index=samples.index, dtype=object)
+        curve_ids[on_plate] = self.get_standard_curve_id(samples.loc[on_plate, self.config.input.target_col], samples.loc[on_plate, self.config.input.plate_id_col])
+
+        # If standard curves don't need to be on the same plate as the unknowns, then try to find another plate with a
+        # standard curve for our target type. We take the plate with the QPCR date closest to our own QPCR date (either
+        # before or after). Each distinct target, plate ID and date is only looked up once.
+        if not self.config.input.require_cal_curve_on_same_plate:
+            others = sample_curves[~on_plate].drop_duplicates()
+            matches = others.merge(curves, on="target", suffixes=("", "_curve"))
+            matches = matches[matches["plate_id"] != matches["plate_id_curve"]]
+            matches["delta"] = (matches["date_curve"] - matches["date"]).abs()
+            matches = matches.dropna(subset=["delta"]).sort_values(["delta", "order"], kind="stable").drop_duplicates(["target", "plate_id", "date"])
+            found = sample_curves[~on_plate].merge(matches[["target", "plate_id", "date", "curve_id"]], on=["target", "plate_id", "date"], how="left")
+            curve_ids[~on_plate] = found["curve_id"].fillna("").to_numpy()
+
+        self.qpcr_df.loc[ct_filt, self.config.input.standard_curve_id_col] = curve_ids
 
         # Remove all Unknowns that do not have a standard curve
         # if self.config.input.require_cal_curve_on_same_plate:
@@ -1841,7 +1903,259 @@ class QPCRPopulator(object):
                 filt = self.qpcr_df[value_mapper.match_column].str.contains(value_mapper.match_expression, case=value_mapper.get("ignore_case", False))
                 filt = filt.fillna(False)
                 self.qpcr_df.loc[filt, value_mapper.target_column] = value_mapper.target_value
+
+    def get_qpcr_df_schema(self):
+        """Get the in-memory schema of qpcr_df, as {column name : dtype}. Low cardinality columns that are only ever
+        assigned as a whole (measure types, plate IDs, site info, etc.) are categoricals, which greatly reduces the memory
+        used by large inputs. All other columns keep the dtypes they were loaded with.
+        """
+        schema = { col : "category" for col in CATEGORICAL_EXTRACTER_COLS }
+        for key in CATEGORICAL_CONFIG_COLS:
+            if key in self.config.input:
+                schema[self.config.input[key]] = "category"
+        return schema
                                         
+    def save_qaqc_tables(self, qaqc_tables, output_file):
+        """Save the QAQC tables of all analysis groups (see QPCRQAQC.run_qaqc_table) to a CSV file next to the output file.
+
+        Parameters
+        ----------
+        qaqc_tables : list
+            The QAQC table (pd.DataFrame) of each analysis group. None items are skipped.
+        output_file : str
+            The (local) output Excel file. The CSV file has the same name, ending in "-qaqc.csv".
+
+        Returns
+        -------
+        str
+            The saved CSV file, or None if there were no QAQC tables to save.
+        """
+        qaqc_tables = [t for t in qaqc_tables if t is not None]
+        if len(qaqc_tables) == 0:
+            return None
+        qaqc_table = pd.concat(qaqc_tables, ignore_index=True)
+        qaqc_table_file = f"{os.path.splitext(output_file)[0]}-qaqc.csv"
+        qaqc_table.to_csv(qaqc_table_file, index=False)
+        print(f"Saved QAQC table to {qaqc_table_file} ({(qaqc_table['status'] != STATUS_PASS).sum()} of {len(qaqc_table.index)} checks did not pass)")
+        return qaqc_table_file
+
+    def upload_side_file(self, local_file, local_target_file, target_file):
+        """Upload a file that was saved next to a local output file (eg. "my_output-formula-profile.csv" next to "my_output.xlsx")
+        to the same location as the remote output file, with the same suffix. Nothing is uploaded if the output file is local
+        (ie. local_target_file == target_file).
+
+        Parameters
+        ----------
+        local_file : str
+            The local file to upload. Its name must start with the name of local_target_file, without the extension.
+        local_target_file : str
+            The local output Excel file.
+        target_file : str
+            The (possibly remote) output Excel file that local_target_file is uploaded to.
+        """
+        if local_target_file == target_file:
+            return
+        suffix = local_file[len(os.path.splitext(local_target_file)[0]):]
+        cloud_utils.upload_file(local_file, f"{os.path.splitext(target_file)[0]}{suffix}")
+
+    def get_qaqc_cache_file(self, output_file):
+        """Get the file name of the QAQC cache for an output file. See rerun_qaqc.
+        """
+        return f"{os.path.splitext(output_file)[0]}-qaqc-cache.pkl"
+
+    def make_qaqc_cache_group(self, name, group):
+        """Get all data needed to rerun QAQC on the analysis group that was just populated (see rerun_qaqc). This is
+        the info of all sheets in worksheets_info, without the Worksheet objects, the attached_data of all cells
+        in those sheets, and the QAQC formatting rules added while populating. For the main sheet, only the rows of
+        the current analysis group are included.
+
+        Parameters
+        ----------
+        name : str
+            The name of the analysis group.
+        group : pd.DataFrame
+            The data of the analysis group.
+
+        Returns
+        -------
+        dict
+            The cached data, in the format {"name" : str, "df" : pd.DataFrame, "sheets" : [{"info" : dict, "attached_data" : {coordinate : list}}],
+            "formatting_rules" : [{"priority" : str, "ws" : str, "target_range" : str, "formula" : str}]}
+        """
+        sheets = []
+        for info in self.worksheets_info:
+            ws = info["ws"]
+            if info["sheet_name"] == MAIN_SHEET:
+                min_row, max_row = info["origin"][0], info["extents"][0]
+            else:
+                min_row, max_row = ws.min_row, ws.max_row
+            attached_data = {}
+            for row in ws.iter_rows(min_row=min_row, max_row=max_row):
+                for cell in row:
+                    cell_data = self.get_cell_attached_data(cell, None)
+                    if cell_data:
+                        attached_data[cell.coordinate] = cell_data
+            cached_info = copy(info)
+            cached_info["ws"] = ws.title
+            cached_info["origin"] = list(info["origin"])
+            cached_info["extents"] = list(info["extents"])
+            sheets.append({
+                "info" : cached_info,
+                "attached_data" : attached_data,
+            })
+        # Formatting rules added while populating (eg. by __QAQCHASFAILEDCATEGORY)
+        formatting_rules = []
+        for prio, rules in self.qaqc.formatting_rules.items():
+            for rule in rules:
+                formatting_rules.append({
+                    "priority" : prio,
+                    "ws" : rule["ws"].title,
+                    "target_range" : rule["target_range"],
+                    "formula" : rule["rule"].formula[0],
+                })
+        return {
+            "name" : name,
+            "df" : group,
+            "sheets" : sheets,
+            "formatting_rules" : formatting_rules,
+        }
+
+    def restore_qaqc_cache_group(self, cache_group):
+        """Restore worksheets_info, the attached_data of all cells and the QAQC formatting rules for an analysis group that was cached by make_qaqc_cache_group.
+        The sheets are matched to the sheets in output_wb by title. Sheets that are not in output_wb (eg. hidden calibration sheets) are skipped.
+        """
+        self.worksheets_info = []
+        for sheet in cache_group["sheets"]:
+            info = copy(sheet["info"])
+            if info["ws"] not in self.output_wb.sheetnames:
+                print(f"WARNING: Sheet {info['ws']} is not in the output file, skipping it for QAQC")
+                continue
+            info["ws"] = self.output_wb[info["ws"]]
+            for coordinate, cell_data in sheet["attached_data"].items():
+                self.set_cell_attached_data(info["ws"][coordinate], cell_data)
+            self.worksheets_info.append(info)
+
+        self.qaqc.formatting_rules = {}
+        for rule in cache_group["formatting_rules"]:
+            if rule["ws"] not in self.output_wb.sheetnames or rule["priority"] not in self.qaqc.styles:
+                print(f"WARNING: Could not restore the formatting of {rule['ws']}!{rule['target_range']}")
+                continue
+            self.qaqc.append_custom_formatting_rule(self.output_wb[rule["ws"]], rule["priority"], rule["target_range"], rule["formula"])
+
+    def rerun_qaqc(self):
+        """Rebuild the QAQC sheets and QAQC formatting of an output file that was already populated, using the current QAQC config.
+        Extraction, population and calculation of the formulas outside of QAQC are skipped.
+
+        The output file must have been populated with save_qaqc_cache=True, which saves the data needed for QAQC next to the
+        output file (see get_qaqc_cache_file). target_file must be the populated output file (ie. without any site tags).
+
+        The Ct outliers are removed while populating, so the outlier settings can't change (see qpcr_qaqc.CT_OUTLIERS_SETTINGS).
+
+        All conditional formatting in the output file is replaced, since it is all added by QAQC. If the output file was
+        appended to by several runs, then only the analysis groups of the run that saved the cache get their formatting back.
+
+        Returns
+        -------
+        list
+            The output files that were updated.
+
+        Raises
+        ------
+        QPCRError
+            The output file or its QAQC cache could not be downloaded or does not exist, or the Ct outlier settings in the QAQC
+            config changed (see qpcr_qaqc.CT_OUTLIERS_SETTINGS).
+        """
+        if self.qaqc is None or not self.qaqc.has_qaqc():
+            print("No QAQC config, nothing to rerun")
+            return []
+
+        local_target_file = cloud_utils.download_file(self.target_file)
+        if local_target_file is None or not os.path.isfile(local_target_file):
+            raise QPCRError(f"Could not load output file '{self.target_file}'")
+        qaqc_cache_file = cloud_utils.download_file(self.get_qaqc_cache_file(self.target_file))
+        if qaqc_cache_file is None or not os.path.isfile(qaqc_cache_file):
+            raise QPCRError(f"Could not load QAQC cache '{self.get_qaqc_cache_file(self.target_file)}', the output file must be populated with save_qaqc_cache=True")
+        print(f"Loading QAQC cache {qaqc_cache_file}...")
+        with open(qaqc_cache_file, "rb") as f:
+            cache = pickle.load(f)
+
+        # The Ct outliers were removed when populating, so changes to the outlier settings can't be applied
+        if cache.get("ct_outliers_settings", None) is None:
+            print("WARNING: The QAQC cache has no Ct outlier settings, changes to main_ct_outliers and cal_ct_outliers in the QAQC config are ignored")
+        elif cache["ct_outliers_settings"] != self.qaqc.get_ct_outliers_settings():
+            raise QPCRError(f"The Ct outlier settings ({', '.join(CT_OUTLIERS_SETTINGS)}) of main_ct_outliers or cal_ct_outliers in the QAQC config changed since '{self.target_file}' was populated, populate it again to apply them")
+
+        print(f"Loading output file {local_target_file}...")
+        fix_xlsx_file(local_target_file)
+        self.output_wb = openpyxl.load_workbook(local_target_file)
+        qaqc_sheets = [self.qaqc.get_sheet_name(cache_group["name"]) for cache_group in cache["groups"]]
+
+        # Keep the calculated values of all formulas outside of the QAQC sheets, so we only need to calculate the QAQC formulas
+        calculated_values = load_calculated_values(local_target_file)
+        for sheet_name in qaqc_sheets:
+            calculated_values.pop(sheet_name, None)
+
+        for sheet_name in qaqc_sheets:
+            if sheet_name in self.output_wb.sheetnames:
+                self.output_wb.remove(self.output_wb[sheet_name])
+        for ws in self.output_wb:
+            ws.conditional_formatting = ConditionalFormattingList()
+
+        self.main_columns = cache["main_columns"]
+        self.late_binders = []
+        qaqc_tables = []
+        total_groups = len(cache["groups"])
+        for idx, cache_group in enumerate(cache["groups"]):
+            name = cache_group["name"]
+            print(f"Running QAQC on group {name} ({idx+1}/{total_groups})...")
+            self.restore_qaqc_cache_group(cache_group)
+            self.qaqc.set_current_name(name)
+            if self.qaqc_table:
+                qaqc_tables.append(self.qaqc.run_qaqc_table(cache_group["df"], cache["full_df"]))
+            self.qaqc.run_qaqc(self.output_wb, cache_group["df"], cache["full_df"])
+            self.qaqc.add_qaqc_to_workbook(self.output_wb)
+        self.worksheets_info = []
+
+        print("Resaving prior to calculating Excel formulas...")
+        self.output_wb.save(local_target_file)
+        self.output_wb = openpyxl.load_workbook(local_target_file)
+
+        # Calculate the formulas in the QAQC sheets and the formulas that refer to the QAQC sheets (eg. from __QAQCHASFAILEDCATEGORY).
+        # All other formulas are replaced by their previously calculated values, so they are not calculated again.
+        qaqc_sheets = [sheet_name for sheet_name in qaqc_sheets if sheet_name in self.output_wb.sheetnames]
+        qaqc_refs = tuple(f"'{sheet_name}'!" for sheet_name in qaqc_sheets)
+        addrs = []
+        for ws in self.output_wb:
+            sheet_values = calculated_values.get(ws.title, {})
+            for row in ws.iter_rows():
+                for cell in row:
+                    if not is_formula_cell(cell):
+                        continue
+                    if ws.title in qaqc_sheets or any([ref in cell.value for ref in qaqc_refs]):
+                        addrs.append(f"'{ws.title}'!{cell.coordinate}")
+                    elif cell.coordinate in sheet_values:
+                        cell.value = sheet_values[cell.coordinate]
+        print(f"Calculating {len(addrs)} QAQC Excel formulas...")
+        profiler = FormulaProfiler() if self.profile_formulas else None
+        profile_files = []
+        for addr, value in calculate_cell_values(self.output_wb, addrs, profiler=profiler).items():
+            sheet_name, coordinate = addr.rsplit("!", 1)
+            calculated_values.setdefault(sheet_name[1:-1], {})[coordinate] = value
+        if profiler is not None:
+            profile_files = profiler.save(f"{os.path.splitext(local_target_file)[0]}-formula-profile")
+            print(f"Saved formula profile to {', '.join(profile_files)}")
+
+        print(f"Saving to {local_target_file}...")
+        save_calculated_values(local_target_file, calculated_values)
+        qaqc_table_file = self.save_qaqc_tables(qaqc_tables, local_target_file)
+
+        # If local_target_file != target_file, then it's a remote file, so upload it
+        if local_target_file != self.target_file:
+            cloud_utils.upload_file(local_target_file, self.target_file)
+            for side_file in profile_files + ([qaqc_table_file] if qaqc_table_file else []):
+                self.upload_side_file(side_file, local_target_file, self.target_file)
+        return [local_target_file]
+
     def populate(self):
         """Do a full population of the output. This is the main function to call by a QPCRPopulator user.
         """        
@@ -1859,6 +2173,7 @@ class QPCRPopulator(object):
         # self.measure_sheet_df = sheet_to_df(input_xl[self.config.input.measure_sheet_name])
         self.qpcr_df = input_df #sheet_to_df(input_xl[input_xl.sheetnames[0]])
         self.apply_value_mappers()
+        self.qpcr_df = apply_schema(self.qpcr_df, self.get_qpcr_df_schema())
         self.qpcr_df = self.sampleids.make_all_sample_ids(
             self.qpcr_df, 
             sample_id_col=self.config.input.sample_id_col, 
@@ -1874,26 +2189,27 @@ class QPCRPopulator(object):
         # Add samples log data to QPCR sheet
         self.qpcr_df = self.sampleslog.join_and_cast(self.qpcr_df, on=self.config.input.match_sample_id_col)
         
-        # Populate site ID, based on the sample ID
-        self.qpcr_df[self.config.input.site_id_col] = self.qpcr_df[self.config.input.sample_id_col].apply(self.sites.get_siteid_from_sampleid)
+        # Populate site ID, based on the sample ID. The site info is looked up once for each distinct value.
+        self.qpcr_df[self.config.input.site_id_col] = self.sites.get_siteid_from_sampleid(self.qpcr_df[self.config.input.sample_id_col])
 
         # Add sample type info (eg. pSludge, pEfflu, water, etc)
-        self.qpcr_df[self.config.input.sampling_type_col] = self.sites.get_site_sample_type(self.qpcr_df[self.config.input.site_id_col])
+        self.qpcr_df[self.config.input.sampling_type_col] = self.sites.get_site_info_frame(self.qpcr_df[self.config.input.site_id_col], [self.sites.get_sample_type_column()])[self.sites.get_sample_type_column()]
         self.qpcr_df[self.config.input.sample_short_description_col] = self.sites.get_type_short_description(self.qpcr_df[self.config.input.sampling_type_col]) if self.sites is not None else ""
         self.qpcr_df[self.config.input.sample_description_col] = self.sites.get_type_description(self.qpcr_df[self.config.input.sampling_type_col]) if self.sites is not None else ""
+        self.qpcr_df = apply_schema(self.qpcr_df, self.get_qpcr_df_schema())
 
         self.assign_standard_curve_ids()
         
         # Create (overwrite) sample IDs for all std entries.
         std_filt = self.qpcr_df[self.config.input.measure_type_col] == self.config.input.measure_type_std
-        self.qpcr_df.loc[std_filt, self.config.input.sample_id_col] = self.qpcr_df[std_filt][[self.config.input.sq_col, self.config.input.plate_id_col]].agg(lambda x: f"{x[1]}-{x[0]}", axis=1)
+        self.qpcr_df.loc[std_filt, self.config.input.sample_id_col] = format_columns("{plateID}-{sq}", self.qpcr_df.index[std_filt], plateID=self.qpcr_df.loc[std_filt, self.config.input.plate_id_col], sq=self.qpcr_df.loc[std_filt, self.config.input.sq_col])
 
         # Convert target names to recognized ones
-        self.qpcr_df[self.config.input.target_col] = self.qpcr_df[self.config.input.target_col].map(self.get_recognized_target)
+        self.qpcr_df[self.config.input.target_col] = self.get_recognized_target(self.qpcr_df[self.config.input.target_col])
         
-        #  Set the index. This allows us to preserve the original ordering if needed
-        for group_name, group_df in self.qpcr_df.groupby([self.config.input.target_col, self.config.input.sample_id_col, self.config.input.measure_type_col]):
-            self.qpcr_df.loc[group_df.index, self.config.input.index_col] = list(np.arange(0, len(group_df.index)))
+        #  Set the index (the replicate number within each target, sample ID and measure type). This allows us to preserve the
+        # original ordering if needed. Rows with a missing target, sample ID or measure type have no index.
+        self.qpcr_df[self.config.input.index_col] = self.qpcr_df.groupby([self.config.input.target_col, self.config.input.sample_id_col, self.config.input.measure_type_col], observed=True).cumcount().astype(float)
         
         self.qpcr_df = self.qpcr_df.sort_values(self.config.input.order_by)
 
@@ -1903,6 +2219,10 @@ class QPCRPopulator(object):
         # Create blank outliers column. Will populate outliers later on
         self.qpcr_df[OUTLIER_COL] = None
 
+        # Index the plates of all the data once, for the NTC checks of each group
+        if self.qaqc is not None:
+            self.qaqc.index_plates(self.qpcr_df)
+
         # Split the QPCR data into groups. Each group represents a single output file.
         for file_info, file_group_df in self.make_file_splits(self.qpcr_df):
             target_file = file_info["fileName"]
@@ -1953,6 +2273,8 @@ class QPCRPopulator(object):
             # and output the results in order.
             analysis_groups = self.make_inner_splits(file_group_df)
             main_has_data = False
+            qaqc_tables = []
+            qaqc_cache_groups = []
             total_groups = len(analysis_groups)
             for idx, (name, group) in enumerate(analysis_groups):
                 print(f"Creating group {name} ({idx+1}/{total_groups})...")
@@ -1970,6 +2292,10 @@ class QPCRPopulator(object):
                 self.consolidate_extents()
                 self.handle_late_binders(inner=True)
                 self.handle_late_binders(inner=False)
+                if self.save_qaqc_cache:
+                    qaqc_cache_groups.append(self.make_qaqc_cache_group(name, group))
+                if self.qaqc_table:
+                    qaqc_tables.append(self.qaqc.run_qaqc_table(group, self.qpcr_df))
                 if not self.hide_qaqc:
                     self.qaqc.run_qaqc(self.output_wb, group, self.qpcr_df)
                     self.qaqc.add_qaqc_to_workbook(self.output_wb)
@@ -1989,19 +2315,38 @@ class QPCRPopulator(object):
                 # We have data in the main sheet, so calculate all the values of all formulas and save to disk
                 # self.remove_non_main_sheets_info()
                 output_files.append(local_target_file)
+                profiler = FormulaProfiler(column_names=self.get_profiler_column_names()) if self.profile_formulas else None
                 print("Resaving prior to calculating Excel formulas...")
                 # @TODO: If we don't save and reload then most cells do not seem to calculate properly
                 # due to various exceptions thrown within PyCel. There should be a better way to fix this.
                 self.output_wb.save(local_target_file)
                 self.output_wb = openpyxl.load_workbook(local_target_file)
                 print("Calculating Excel formulas...")
-                add_excel_calculated_values(self.output_wb)
+                calculated_values = add_excel_calculated_values(self.output_wb, profiler=profiler, filename=local_target_file, num_processes=self.formula_processes)
+                profile_files = []
+                if profiler is not None:
+                    profile_files = profiler.save(f"{os.path.splitext(local_target_file)[0]}-formula-profile")
+                    print(f"Saved formula profile to {', '.join(profile_files)}")
                 print(f"Saving to {local_target_file}...")
-                self.output_wb.save(local_target_file)
+                save_calculated_values(local_target_file, calculated_values)
+                qaqc_table_file = self.save_qaqc_tables(qaqc_tables, local_target_file)
+                qaqc_cache_file = None
+                if self.save_qaqc_cache:
+                    qaqc_cache_file = self.get_qaqc_cache_file(local_target_file)
+                    with open(qaqc_cache_file, "wb") as f:
+                        pickle.dump({
+                            "full_df" : self.qpcr_df,
+                            "main_columns" : self.main_columns,
+                            "ct_outliers_settings" : self.qaqc.get_ct_outliers_settings(),
+                            "groups" : qaqc_cache_groups,
+                        }, f)
+                    print(f"Saved QAQC cache to {qaqc_cache_file}")
 
                 # If local_target_file != target_file, then it's a remote file, so upload it
                 if local_target_file != target_file:
                     cloud_utils.upload_file(local_target_file, target_file)
+                    for side_file in profile_files + [f for f in [qaqc_table_file, qaqc_cache_file] if f]:
+                        self.upload_side_file(side_file, local_target_file, target_file)
             else:
                 print(f"No data, not saving {local_target_file}")
         
@@ -2030,6 +2375,13 @@ if __name__ == "__main__":
 
             "target_file" : "/Users/martinwellman/Documents/Health/Wastewater/Code/output/output.xlsx",
             "hide_qaqc" : False,
+            "profile_formulas" : False,
+            "formula_processes" : 1,
+            "qaqc_table" : False,
+            "save_qaqc_cache" : False,
+            "qaqc_workers" : 1,
+            "qaqc_only" : False,
+            "reference_cache_dir" : None,
             "overwrite" : True,
 
             "sites_config" : "qpcr_sites.yaml",
@@ -2051,6 +2403,12 @@ if __name__ == "__main__":
         args.add_argument("--config", nargs="+", type=str, help="Configuration file", default="qpcr_populator_long-2main-inh.yaml")
         args.add_argument("--overwrite", help="If set then overwrite the target_file (instead of appending to it).", action="store_true")
         args.add_argument("--hide_qaqc", help="If set then do not show QAQC highlighting or sheets. Outliers will still be removed and marked with square brackets.", action="store_true")
+        args.add_argument("--profile_formulas", help="If set then time the evaluation of all Excel formulas and save a report (JSON and CSV) next to each output file.", action="store_true")
+        args.add_argument("--formula_processes", type=int, help="Number of processes to use for calculating Excel formulas. Independent groups of formulas (eg. separate QAQC sheets) are calculated in parallel. Set to 0 to use all CPUs.", default=1)
+        args.add_argument("--qaqc_table", help="If set then also calculate all QAQC checks without Excel formulas and save the results (one row per check) to a CSV file next to each output file.", action="store_true")
+        args.add_argument("--save_qaqc_cache", help="If set then save the data needed to rerun QAQC (with --qaqc_only) to a file next to each output file.", action="store_true")
+        args.add_argument("--qaqc_workers", type=int, help="Number of threads to use for running independent QAQC checks at the same time. Set to 0 to use the Python default.", default=1)
+        args.add_argument("--qaqc_only", help="If set then do not populate. Instead, rebuild the QAQC sheets and formatting of target_file with the current QAQC config. target_file must have been populated with --save_qaqc_cache.", action="store_true")
         args.add_argument("--sites_config", type=str, help="Config file for the sites file.", required=True)
         args.add_argument("--sites_file", type=str, help="Excel file specifying all WW sites with information about each site.", required=True)
         args.add_argument("--sampleids_config", type=str, help="Config file for the sample IDs.", required=True)
@@ -2058,6 +2416,7 @@ if __name__ == "__main__":
         args.add_argument("--sampleslog_file", type=str, help="Log file for the samples, containing sample mass, analysis date, etc.", required=True)
         args.add_argument("--methods_config", type=str, help="Config file for the methods.", required=True)
         args.add_argument("--methods_file", type=str, help="Excel file with all the method definitions", required=True)
+        args.add_argument("--reference_cache_dir", type=str, help="Directory to cache the cleaned sites, methods and samples log tables in, so they are only parsed again when the files change. No caching is done if not set.", required=False)
         
         opts = args.parse_args()
 
@@ -2077,9 +2436,18 @@ if __name__ == "__main__":
         sampleslog_file=opts.sampleslog_file,
         methods_config=opts.methods_config,
         methods_file=opts.methods_file,
-        hide_qaqc=opts.hide_qaqc
+        hide_qaqc=opts.hide_qaqc,
+        profile_formulas=opts.profile_formulas,
+        formula_processes=opts.formula_processes or None,
+        qaqc_table=opts.qaqc_table,
+        save_qaqc_cache=opts.save_qaqc_cache,
+        qaqc_workers=opts.qaqc_workers or None,
+        reference_cache_dir=opts.reference_cache_dir,
         )
-    qpcr.populate()
+    if opts.qaqc_only:
+        qpcr.rerun_qaqc()
+    else:
+        qpcr.populate()
     toc = datetime.now()
     print("Started at:", tic)
     print("Ended at:", toc)
@@ -9,14 +9,18 @@ More instructions and comments coming soon.
 
 import pandas as pd
 from openpyxl.utils import get_column_letter
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import PatternFill
 from qpcr_utils import load_config
+from qpcr_qaqc_table import QPCRQAQCTable
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import numpy as np
 import re
 from openpyxl.styles.differential import DifferentialStyle
 from openpyxl.formatting.rule import Rule
+from openpyxl.formula.translate import Translator, TranslatorError
+from openpyxl.worksheet.cell_range import CellRange
 from openpyxl.styles import Font
 
 from qpcr_utils import (
@@ -76,17 +80,367 @@ QAQC_HAS_FAILED_CATEGORY_FORMULA="IF(COUNTIF('{qaqc_sheet}'!{cat_column}:{cat_co
 # refer to the new QAQC sheet (it will only be correct if the new QAQC sheet is identical to the old one).
 DELETE_EXISTING_SHEET = True
 
+# The settings of main_ct_outliers and cal_ct_outliers in the QAQC config that decide which Ct values are outliers. The outliers
+# are removed before the output file is populated (see QPCRQAQC.remove_all_outliers), so QPCRPopulator.rerun_qaqc can not apply
+# changes to these settings.
+CT_OUTLIERS_SETTINGS = ["targets", "max_stdev", "range", "min_replicates", "max_replicates"]
+
+# State read and written by the QAQC checks (see QAQC_CHECKS). Checks that write state another check reads or writes
+# are not run at the same time. The QAQC rows are not listed, since every check appends rows to its own buffer.
+QAQC_STATE_MAIN = "main"
+QAQC_STATE_CAL = "calibration"
+QAQC_STATE_DF = "df"
+QAQC_STATE_FULL_DF = "full_df"
+
+# The QAQC checks run by QPCRQAQC.run_qaqc, in order. Each check is called with the group name, plus df and full_df as
+# keyword arguments if it reads QAQC_STATE_DF or QAQC_STATE_FULL_DF. A check can be a QPCRQAQC method name or a function.
+# More checks can be added with QPCRQAQC.register_check.
+#
+# NOTE: qaqc_run_check_ct_stdev doesn't need to be run. Actual removal of outliers is
+# done in remove_all_outliers, and highlighting of the error cells is done independently of
+# qaqc_run_check_ct_stdev in add_qaqc_to_workbook. Running qaqc_run_check_ct_stdev will
+# highlight ALL Ct values if the standard deviation is too large
+QAQC_CHECKS = [
+    { "name" : "ntc", "func" : "qaqc_run_ntc", "reads" : [QAQC_STATE_DF, QAQC_STATE_FULL_DF, QAQC_STATE_CAL], "writes" : [] },
+    { "name" : "sample_data_available", "func" : "qaqc_run_sample_data_available", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    # { "name" : "no_detections", "func" : "qaqc_run_no_detections", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    { "name" : "standard_curves", "func" : "qaqc_run_standard_curves", "reads" : [QAQC_STATE_CAL], "writes" : [] },
+    { "name" : "standard_curve_inter_comparisons", "func" : "qaqc_run_standard_curve_inter_comparisons", "reads" : [QAQC_STATE_CAL], "writes" : [] },
+    { "name" : "samples_within_standard_curves", "func" : "qaqc_run_samples_within_standard_curves", "reads" : [QAQC_STATE_MAIN, QAQC_STATE_CAL], "writes" : [] },
+    { "name" : "loq", "func" : "qaqc_run_loq", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    { "name" : "normalizer_in_range", "func" : "qaqc_run_normalizer_in_range", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    { "name" : "inhibition", "func" : "qaqc_run_inhibition", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    { "name" : "comparable_targets", "func" : "qaqc_run_comparable_targets", "reads" : [QAQC_STATE_MAIN], "writes" : [] },
+    { "name" : "copies_outliers", "func" : "qaqc_run_copies_outliers", "reads" : [QAQC_STATE_MAIN, QAQC_STATE_CAL], "writes" : [] },
+    { "name" : "non_detects", "func" : "qaqc_run_non_detects", "reads" : [QAQC_STATE_MAIN, QAQC_STATE_CAL], "writes" : [] },
+]
+
+# Row numbers of QAQC rows that are not yet in the QAQC sheet are written as this marker, and replaced when the rows are
+# added to the sheet (see QAQCRows.extend).
+QAQC_ROW_MARKER = "\x00{}\x00"
+QAQC_ROW_MARKER_REGEX = re.compile("\x00([0-9]+)\x00")
+
+# Conditional formatting formulas are compared by translating them to this cell. Relative references then
+# become equal for rules that do the same thing relative to their own target cells.
+FORMATTING_CANONICAL_ORIGIN = "ZZ100000"
+
+def coalesce_formatting_rules(rules):
+    """Merge conditional formatting rules that have the same style and the same formula relative to their
+    target ranges into a single rule that covers all of their target ranges.
+
+    Excel evaluates the relative references of a conditional formatting formula relative to the top-left
+    cell of the rule's range. A merged rule therefore uses the formula of its top-left cell, and is only
+    built from ranges that are below and to the right of that cell. The formatting is identical to adding
+    each rule separately, but the workbook ends up with far fewer rules.
+
+    Parameters
+    ----------
+    rules : list
+        The rules, as dicts with keys "ws", "target_range" and "rule" (see QPCRQAQC.append_formatting_rule).
+
+    Returns
+    -------
+    list
+        The coalesced rules, as dicts with keys "ws", "target_range" and "rule". The target_range is a
+        space separated list of ranges (ie. an Excel sqref).
+    """
+    groups = {}
+    for rule in rules:
+        cf_rule = rule["rule"]
+        cell_range = CellRange(rule["target_range"])
+        origin = f"{get_column_letter(cell_range.min_col)}{cell_range.min_row}"
+        try:
+            formula = tuple(Translator(f"={f}", origin=origin).translate_formula(FORMATTING_CANONICAL_ORIGIN) for f in cf_rule.formula)
+        except TranslatorError:
+            # Can't be compared to other rules, so keep it as its own group
+            formula = id(rule)
+        key = (id(rule["ws"]), id(cf_rule.dxf), cf_rule.type, cf_rule.stopIfTrue, formula)
+        groups.setdefault(key, []).append((cell_range, rule))
+
+    coalesced = []
+    for group in groups.values():
+        group = sorted(group, key=lambda item: (item[0].min_row, item[0].min_col))
+        while len(group) > 0:
+            # The top-left range of the group is the anchor of the new rule. Ranges to the left of it are
+            # left for the next rule.
+            anchor_range, anchor_rule = group[0]
+            merged = [item for item in group if item[0].min_col >= anchor_range.min_col]
+            group = [item for item in group if item[0].min_col < anchor_range.min_col]
+            ranges = merge_cell_ranges([item[0] for item in merged])
+            coalesced.append({
+                "ws" : anchor_rule["ws"],
+                "target_range" : " ".join([r.coord for r in ranges]),
+                "rule" : anchor_rule["rule"],
+            })
+    return coalesced
+
+def merge_cell_ranges(ranges):
+    """Merge ranges of cells into as few rectangular ranges as possible, by first joining ranges that
+    are next to each other in the same rows and then ranges that are next to each other in the same columns.
+
+    Parameters
+    ----------
+    ranges : list
+        A list of CellRange objects.
+
+    Returns
+    -------
+    list
+        The merged CellRange objects, sorted by their top-left cell (row first).
+    """
+    def _merge(bounds, same_axis, along_axis):
+        # bounds are (min_col, min_row, max_col, max_row). Join bounds that have the same extents on same_axis
+        # and touch or overlap on along_axis (0 for columns, 1 for rows).
+        merged = []
+        for b in sorted(set(bounds), key=lambda b: (b[same_axis], b[same_axis+2], b[along_axis])):
+            last = merged[-1] if len(merged) > 0 else None
+            if last is not None and (last[same_axis], last[same_axis+2]) == (b[same_axis], b[same_axis+2]) and b[along_axis] <= last[along_axis+2] + 1:
+                last = list(last)
+                last[along_axis+2] = max(last[along_axis+2], b[along_axis+2])
+                merged[-1] = tuple(last)
+            else:
+                merged.append(b)
+        return merged
+
+    bounds = [(r.min_col, r.min_row, r.max_col, r.max_row) for r in ranges]
+    bounds = _merge(bounds, 1, 0)
+    bounds = _merge(bounds, 0, 1)
+    bounds = sorted(bounds, key=lambda b: (b[1], b[0]))
+    return [CellRange(min_col=b[0], min_row=b[1], max_col=b[2], max_row=b[3]) for b in bounds]
+
+class QAQCCellLink(object):
+    """A hyperlink from a QAQC row to the cells that it checks (see QPCRQAQC.make_cell_link).
+
+    Parameters
+    ----------
+    formula : str
+        The =HYPERLINK() Excel formula placed in the QAQC sheet.
+    refs : list
+        The cells shown in the hyperlink, as (sheet name, cell coordinate) tuples. These are the cells highlighted
+        when the QAQC row fails.
+    """
+    def __init__(self, formula, refs):
+        super().__init__()
+        self.formula = formula
+        self.refs = refs
+
+    def __str__(self):
+        return self.formula
+
+class QAQCRows(object):
+    """Accumulate the rows of a QAQC sheet as one buffer per column.
+
+    Appending to a DataFrame copies the entire table, so building a QAQC sheet one row at a time with
+    DataFrame.append is quadratic in the number of rows. QAQCRows only appends to Python lists and builds
+    the DataFrame once, when it is requested.
+
+    Parameters
+    ----------
+    columns : list
+        The column names, in the order they appear in the QAQC sheet.
+    first_row : int
+        The Excel row number of the first row in the QAQC sheet. If None then the rows are not placed in the sheet yet (eg.
+        the rows of a single check), and their row numbers are written as markers until they are added to the sheet with
+        extend.
+    """
+    def __init__(self, columns, first_row=2):
+        super().__init__()
+        self.columns = list(columns)
+        self.first_row = first_row
+        self.buffers = {c : [] for c in self.columns}
+        # The link target cells of each row, as {column name : refs} (see QAQCCellLink)
+        self.links = []
+        self.num_rows = 0
+        self._df = None
+
+    def __len__(self):
+        return self.num_rows
+
+    def next_row(self):
+        """Get the Excel row number of the next row appended, or its marker if first_row is None.
+        """
+        if self.first_row is None:
+            return QAQC_ROW_MARKER.format(self.num_rows)
+        return self.first_row + self.num_rows
+
+    def extend(self, rows):
+        """Append all rows of another QAQCRows (with the same columns), replacing its row number markers with the final
+        row numbers.
+        """
+        first_row = self.next_row()
+        for c in self.columns:
+            if isinstance(first_row, str):
+                self.buffers[c].extend(rows.buffers[c])
+            else:
+                self.buffers[c].extend([QAQC_ROW_MARKER_REGEX.sub(lambda m: str(first_row + int(m.group(1))), v) if isinstance(v, str) else v for v in rows.buffers[c]])
+        self.links.extend(rows.links)
+        self.num_rows += len(rows)
+        self._df = None
+
+    def append(self, row):
+        """Add a row. Columns missing from row are left blank (None).
+
+        Parameters
+        ----------
+        row : dict
+            The column values of the new row, keyed by column name. The values are copied, so the same dict can be
+            reused for the next row. For QAQCCellLink values the formula is stored as the value, and the refs
+            are kept in links.
+        """
+        links = {}
+        for c in self.columns:
+            value = row.get(c, None)
+            if isinstance(value, QAQCCellLink):
+                links[c] = value.refs
+                value = value.formula
+            self.buffers[c].append(value)
+        self.links.append(links)
+        self.num_rows += 1
+        self._df = None
+
+    def column_index(self, column):
+        """Get the 0-based index of the column.
+        """
+        return self.columns.index(column)
+
+    def iter_rows(self, header=True):
+        """Iterate over all rows as lists of values, in column order (for writing directly to a Worksheet).
+
+        Parameters
+        ----------
+        header : bool
+            If True, then the first row returned contains the column names.
+        """
+        if header:
+            yield list(self.columns)
+        for row in zip(*[self.buffers[c] for c in self.columns]):
+            yield list(row)
+
+    def to_frame(self):
+        """Get all rows as a DataFrame. The DataFrame is only rebuilt if rows were appended since the last call.
+        """
+        if self._df is None:
+            self._df = pd.DataFrame(self.buffers, columns=self.columns)
+        return self._df
+
 class QPCRQAQC(object):
-    def __init__(self, populator, qaqc_config_file, config_file):
+    def __init__(self, populator, qaqc_config_file, config_file, max_workers=1):
+        """
+        Parameters
+        ----------
+        populator : QPCRPopulator
+            The populator that generated the sheets to perform QAQC on.
+        qaqc_config_file : str | list[str]
+            The QAQC config file(s).
+        config_file : str | list[str]
+            The populator config file(s).
+        max_workers : int
+            The number of threads used to run independent QAQC checks at the same time (see run_checks). If None then the
+            ThreadPoolExecutor default is used.
+        """
         super().__init__()
         self.populator = populator
         self.qaqc_config = load_config(qaqc_config_file)
         self.config = load_config(config_file)
         self.current_name = None
         self.formatting_rules = {}
+        self.qaqc_table = QPCRQAQCTable(qaqc_config_file, config_file)
+        self.checks = [dict(check) for check in QAQC_CHECKS]
+        self.max_workers = max_workers
+        self.main_qaqc_rows = None
+        # The QAQC rows of the check running in the current thread
+        self.check_local = threading.local()
         if self.has_qaqc():
             self.prepare_styles()
 
+    @property
+    def qaqc_rows(self):
+        """The QAQCRows that rows are appended to, which is the buffer of the current check while run_qaqc is running
+        the checks.
+        """
+        rows = getattr(self.check_local, "qaqc_rows", None)
+        return rows if rows is not None else self.main_qaqc_rows
+
+    @qaqc_rows.setter
+    def qaqc_rows(self, rows):
+        self.main_qaqc_rows = rows
+
+    def register_check(self, name, func, reads=None, writes=None, before=None):
+        """Add a QAQC check to run in run_qaqc.
+
+        Parameters
+        ----------
+        name : str
+            The name of the check. An existing check with the same name is replaced.
+        func : str | function
+            The QPCRQAQC method name, or a function. It is called with the group name, and df and full_df as
+            keyword arguments if they are in reads. The check should append its rows to self.qaqc_rows.
+        reads : list[str]
+            The state read by the check (eg. QAQC_STATE_MAIN).
+        writes : list[str]
+            The state changed by the check, other than the QAQC rows. A check is not run at the same time as
+            other checks that read or write the same state.
+        before : str
+            The name of the check to insert the new check before. If None then it is run last.
+        """
+        check = { "name" : name, "func" : func, "reads" : list(reads or []), "writes" : list(writes or []) }
+        names = [c["name"] for c in self.checks]
+        if name in names:
+            self.checks.pop(names.index(name))
+            names.remove(name)
+        self.checks.insert(names.index(before) if before in names else len(self.checks), check)
+
+    def get_check_stages(self):
+        """Split the checks into stages of consecutive checks that don't conflict, so each stage can be run at the same
+        time. A check conflicts with another if it writes state the other check reads or writes.
+
+        Returns
+        -------
+        list[list[dict]]
+            The stages, each a list of checks. The stages and their checks are in the order of self.checks.
+        """
+        stages = []
+        reads, writes = set(), set()
+        for check in self.checks:
+            cur_reads, cur_writes = set(check["reads"]), set(check["writes"])
+            if len(stages) == 0 or (cur_writes & (reads | writes)) or (cur_reads & writes):
+                stages.append([])
+                reads, writes = set(), set()
+            stages[-1].append(check)
+            reads |= cur_reads
+            writes |= cur_writes
+        return stages
+
+    def run_check(self, check, df, full_df):
+        """Run a single QAQC check, appending its rows to a new QAQCRows.
+
+        Returns
+        -------
+        QAQCRows
+            The rows added by the check, with row number markers (see QAQCRows.extend).
+        """
+        func = getattr(self, check["func"]) if isinstance(check["func"], str) else check["func"]
+        kwargs = {k : v for k, v in [(QAQC_STATE_DF, df), (QAQC_STATE_FULL_DF, full_df)] if k in check["reads"]}
+        self.check_local.qaqc_rows = QAQCRows(self.main_qaqc_rows.columns, first_row=None)
+        try:
+            func(self.current_name, **kwargs)
+            return self.check_local.qaqc_rows
+        finally:
+            self.check_local.qaqc_rows = None
+
+    def run_checks(self, df, full_df):
+        """Run all QAQC checks and add their rows to the QAQC rows, in the order of self.checks. If max_workers is not 1
+        then the checks of each stage (see get_check_stages) run in a thread pool.
+        """
+        for stage in self.get_check_stages():
+            if self.max_workers != 1 and len(stage) > 1:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    all_rows = list(executor.map(lambda check: self.run_check(check, df, full_df), stage))
+            else:
+                all_rows = [self.run_check(check, df, full_df) for check in stage]
+            for rows in all_rows:
+                self.main_qaqc_rows.extend(rows)
+
     def get_qaqc_column_index(self, column):
         if column not in DEFAULT_QAQC_DATA.keys():
             return None
@@ -103,19 +457,17 @@ class QPCRQAQC(object):
 
     def get_next_qaqc_row(self):
         """Get the next empty row number in the QA/QC sheet. The row number is the Excel row number
-        (ie. first row (1) is header, then the data rows start at row 2)
+        (ie. first row (1) is header, then the data rows start at row 2). While the checks are running this
+        is a marker that is replaced by the row number once the check's rows are added to the sheet.
         """
-        return len(self.qaqc_df.index) + 2        
+        return self.qaqc_rows.next_row()
 
     def init_qaqc(self, wb, group):
         """Initialize the QAQC Worksheet for the specified group name. The group is usually an analysis date.
         """
-        self.qaqc_df = None
+        self.qaqc_rows = QAQCRows(DEFAULT_QAQC_DATA.keys())
         # self.formatting_rules = {}
 
-        if self.qaqc_df is None:
-            self.qaqc_df = pd.DataFrame(columns=DEFAULT_QAQC_DATA.keys())
-
     def run_qaqc(self, output_wb, df, full_df, name=None):
         """Run a full QAQC on the final generated output sheets. Uses both the
         populated Excel sheets currently in memory and the original df used to generate it.
@@ -147,23 +499,51 @@ class QPCRQAQC(object):
 
         main_ws, main_info = self.populator.get_worksheet_and_info(MAIN_SHEET)
 
-        # NOTE: qaqc_run_check_ct_stdev doesn't need to be run. Actual removal of outliers is
-        # done in remove_all_outliers, and highlighting of the error cells is done independently of
-        # qaqc_run_check_ct_stdev in add_qaqc_to_workbook. Running qaqc_run_check_ct_stdev will
-        # highlight ALL Ct values if the standard deviation is too large
-        # self.qaqc_run_check_ct_stdev(self.current_name)
-        self.qaqc_run_ntc(self.current_name, df, full_df)
-        self.qaqc_run_sample_data_available(self.current_name)
-        # self.qaqc_run_no_detections(self.current_name)
-        self.qaqc_run_standard_curves(self.current_name)
-        self.qaqc_run_standard_curve_inter_comparisons(self.current_name)
-        self.qaqc_run_samples_within_standard_curves(self.current_name)
-        self.qaqc_run_loq(self.current_name)
-        self.qaqc_run_normalizer_in_range(self.current_name)
-        self.qaqc_run_inhibition(self.current_name)
-        self.qaqc_run_comparable_targets(self.current_name)
-        self.qaqc_run_copies_outliers(self.current_name)
-        self.qaqc_run_non_detects(self.current_name)
+        self.run_checks(df, full_df)
+
+    def run_qaqc_table(self, df, full_df, name=None):
+        """Calculate all QAQC checks in pandas, without the Excel formulas (see qpcr_qaqc_table.py). The standard curves
+        of the calibration sheets currently in memory are used, so this should be called after create_calibration.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The DataFrame for the current subgroup of the full df (same as for run_qaqc).
+        full_df : pd.DataFrame
+            The full DataFrame containing all input (same as for run_qaqc).
+        name : str
+            The group name. If None then the value last passed to set_current_name is used.
+
+        Returns
+        -------
+        pd.DataFrame
+            The QAQC results, with one row per check (see qpcr_qaqc_table.QAQC_TABLE_COLUMNS), or None if there is no QAQC.
+        """
+        if not self.has_qaqc():
+            return None
+        if name is not None:
+            self.set_current_name(name)
+
+        curves = {}
+        for _, info in self.populator.get_all_cal_worksheets_and_info():
+            if "cal_curve" in info:
+                curves[info["sheet_name"]] = { **info["cal_curve"], "target" : info["target"], "plateID" : info["plateID"] }
+        _, main_info = self.populator.get_worksheet_and_info(MAIN_SHEET)
+        prefix = add_sheet_name_to_colrow_name(MAIN_SHEET, "")
+        main_columns = [n[len(prefix):] for names in (main_info or {}).get("col_names", None) or [] for n in names if n and n.startswith(prefix)]
+        return self.qaqc_table.run(df, full_df, curves=curves, name=self.current_name, methods=self.populator.methods, main_columns=main_columns)
+
+    def index_plates(self, full_df):
+        """Index the NTCs and maximum unknown Ct values of all plates in full_df (see qpcr_qaqc_table.PlateIndex), so that the
+        NTC checks of each analysis group don't need to scan all of full_df. If this is not called then the index is created
+        on the first NTC check.
+
+        Parameters
+        ----------
+        full_df : pd.DataFrame
+            The full DataFrame containing all input, that will be passed to run_qaqc and run_qaqc_table.
+        """
+        return self.qaqc_table.index_plates(full_df)
 
     def excel_range_check_formula(self, rng, value_refs, combine_func):
         """Create an Excel formula to check if values are within the specified range (without the leading '=').
@@ -243,7 +623,7 @@ class QPCRQAQC(object):
             formula = f"OR({formula}, {QAQC_ACCEPT_BLANK_FORMULA})"
         errors_result = "FALSE" if fail_if_errors else "TRUE"
         formula = f"IF({QAQC_DEFAULT_ISERROR}, {errors_result}, {formula})"
-        return "={}".format(parse_colrow_tags(formula, self.qaqc_df, row_num))
+        return "={}".format(parse_colrow_tags(formula, self.qaqc_rows.columns, row_num))
 
     def qaqc_run_per_sample(self, name, match_targets, sheet_name, match_col_name, match_row_name, rng, populate_data_func, accept_blanks=False, fail_if_errors=True, mode="flatten"):
         """Go through the specified generated spreadsheet and call a callback (with data) for each row. The
@@ -306,55 +686,56 @@ class QPCRQAQC(object):
         target_column = [add_sheet_name_to_colrow_name(sheet_name, m) for m in match_col_name]
         target_row = [add_sheet_name_to_colrow_name(sheet_name, m) for m in match_row_name]
         origin = info["origin"]
-        # Go through all the rows in the sheet: We use both the row data (if we need it later on) and the row names
-        for num, (row_data, row_names) in enumerate(zip(info["row_data"], info["row_names"])):
+
+        # The column layout is the same for every row, so get the columns once
+        cols = self.populator.get_named_columns(sheet_name, target_column)
+        if mode == "flatten":
+            # Flatten, then call callback once per item in the flattened array
+            cols = flatten(cols)
+        elif mode == "one_per_match":
+            # Call callback with a single value for each match, ie. call for [cola[0], colb[0], ... coln[0]], then
+            # [cola[1], colb[1], ..., coln[1]], ...
+            cols = np.transpose(cols).tolist()
+        elif mode == "all_at_once":
+            # Flatten, then call callback once with the entire flattened array
+            cols = [flatten(cols)]
+        elif mode == "separate_groups":
+            pass
+        else:
+            raise ValueError(f"Unrecognized mode in qaqc_run_per_sample: {mode}")
+
+        # Go through the rows that have any of the names in target_row, and that have data. We use the row data (if we need it later on)
+        for num in self.populator.get_named_rows(sheet_name, target_row):
+            if num not in info["row_keys"]:
+                continue
             # cur_row is the Excel spreadsheet's row number
             cur_row = num + origin[0]
-            # If any of the names in target_row match any of the names assigned to the current row (row_names) the
-            # we have a match (we'll check for column matches later)
-            if len(set(target_row).intersection(set(row_names))) > 0 and len(row_data) > 0:
-                # We'll use the first data element assigned to this row for matching based on the target
-                data = row_data[0]
-                row_target = data[self.config.input.target_col].iloc[0]
-                row_sample_id = data[self.config.input.sample_id_col].iloc[0]
-                if match_targets is None or len(match_targets) == 0 or (row_target is not None and row_target.lower() in match_targets):
-                    cols = self.populator.get_named_columns(sheet_name, target_column)
-                    if mode == "flatten":
-                        # Flatten, then call callback once per item in the flattened array
-                        cols = flatten(cols)
-                    elif mode == "one_per_match":
-                        # Call callback with a single value for each match, ie. call for [cola[0], colb[0], ... coln[0]], then
-                        # [cola[1], colb[1], ..., coln[1]], ...
-                        cols = np.transpose(cols).tolist()
-                    elif mode == "all_at_once":
-                        # Flatten, then call callback once with the entire flattened array
-                        cols = [flatten(cols)]
-                    elif mode == "separate_groups":
-                        pass
+            # We'll use the first data element assigned to this row for matching based on the target
+            data = info["row_data"][num][0]
+            row_target, row_sample_id = info["row_keys"][num]
+            if match_targets is None or len(match_targets) == 0 or (row_target is not None and row_target.lower() in match_targets):
+                for cur_col in cols:
+                    if isinstance(cur_col, (list, tuple, np.ndarray)):
+                        if len(cur_col) == 0:
+                            continue
+                        cell_ref = None
+                        cell_refs = [f"'{ws.title}'!{c}{cur_row}" for c in cur_col]
                     else:
-                        raise ValueError(f"Unrecognized mode in qaqc_run_per_sample: {mode}")
-                    for cur_col in cols:
-                        if isinstance(cur_col, (list, tuple, np.ndarray)):
-                            if len(cur_col) == 0:
-                                continue
-                            cell_ref = None
-                            cell_refs = [f"'{ws.title}'!{c}{cur_row}" for c in cur_col]
-                        else:
-                            cell_ref = f"'{ws.title}'!{cur_col}{cur_row}"
-                            cell_refs = [cell_ref]
-                        qaqc_data[GROUP_COL] = name
-                        # qaqc_data[DESC_COL] = f"{row_target} LOQ (per well)"
-                        qaqc_data[LOWER_LIMIT_COL] = rng[0] if rng is not None else None
-                        qaqc_data[UPPER_LIMIT_COL] = rng[1] if rng is not None else None
-                        # qaqc_data[VALUE_COL] = f"=IF(ISNUMBER({cell_ref}), {cell_ref}, \"\")" if cell_ref is not None else None
-                        qaqc_data[VALUE_COL] = QAQC_VALUE_FORMULA.format(cell_ref=cell_ref)
-                        qaqc_data[SAMPLE_ID_COL] = row_sample_id
-                        qaqc_data[TARGETS_COL] = self.get_qaqc_target_for_column(cur_col, sheet_name, row_target) # row_target
-                        qaqc_data[CELL_A_COL] = self.make_cell_link(cell_refs, 1)
-                        qaqc_data[CELL_B_COL] = self.make_cell_link(cell_refs, 2)
-                        qaqc_data[VALIDATES_COL] = self.get_validates_formula(accept_blanks=accept_blanks, fail_if_errors=fail_if_errors)
-                        if populate_data_func(sheet_name, qaqc_data, data, name, rng, cur_row, cur_col):
-                            self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                        cell_ref = f"'{ws.title}'!{cur_col}{cur_row}"
+                        cell_refs = [cell_ref]
+                    qaqc_data[GROUP_COL] = name
+                    # qaqc_data[DESC_COL] = f"{row_target} LOQ (per well)"
+                    qaqc_data[LOWER_LIMIT_COL] = rng[0] if rng is not None else None
+                    qaqc_data[UPPER_LIMIT_COL] = rng[1] if rng is not None else None
+                    # qaqc_data[VALUE_COL] = f"=IF(ISNUMBER({cell_ref}), {cell_ref}, \"\")" if cell_ref is not None else None
+                    qaqc_data[VALUE_COL] = QAQC_VALUE_FORMULA.format(cell_ref=cell_ref)
+                    qaqc_data[SAMPLE_ID_COL] = row_sample_id
+                    qaqc_data[TARGETS_COL] = self.get_qaqc_target_for_column(cur_col, sheet_name, row_target) # row_target
+                    qaqc_data[CELL_A_COL] = self.make_cell_link(cell_refs, 1)
+                    qaqc_data[CELL_B_COL] = self.make_cell_link(cell_refs, 2)
+                    qaqc_data[VALIDATES_COL] = self.get_validates_formula(accept_blanks=accept_blanks, fail_if_errors=fail_if_errors)
+                    if populate_data_func(sheet_name, qaqc_data, data, name, rng, cur_row, cur_col):
+                        self.qaqc_rows.append(qaqc_data)
 
     def qaqc_run_ntc(self, name, df, full_df):
         if "ntcs" not in self.qaqc_config:
@@ -362,6 +743,7 @@ class QPCRQAQC(object):
             return
 
         match_row_name = add_sheet_name_to_colrow_name(MAIN_SHEET, MAIN_ROW_DATA)
+        plate_index = self.qaqc_table.get_plate_index(full_df)
 
         for ntc_info in self.qaqc_config.ntcs:
             measure_type = ntc_info.measure_type
@@ -370,16 +752,19 @@ class QPCRQAQC(object):
 
             plates = df[self.config.input.plate_id_col].unique()
             
-            ntc_samples = full_df[full_df[self.config.input.measure_type_col].isin(measure_type) & full_df[self.config.input.plate_id_col].isin(plates)]
+            ntc_samples = plate_index.get_rows(plates, measure_type)
             targets = [g.strip() for g in ntc_info.targets]
             if len(targets) == 0:
                 targets = ntc_samples[self.config.input.target_col].unique()
             ct_range = ntc_info.ct_range
+            ntc_targets = ntc_samples[self.config.input.target_col].map(lambda t: (t or "").strip().lower())
 
             # Do each target separately
             for target in targets:
-                # Go through all NTCs
-                for idx, ntc_sample in ntc_samples.iterrows():
+                if target is None:
+                    continue
+                # Go through all NTCs of the target
+                for idx, ntc_sample in ntc_samples[ntc_targets == target.lower()].iterrows():
                     ntc_target = (ntc_sample[self.config.input.target_col] or "").strip()
                     plate_id = (ntc_sample[self.config.input.plate_id_col] or "").strip()
                     standard_curve_id = (ntc_sample[self.config.input.standard_curve_id_col] or "")#.strip()
@@ -392,8 +777,7 @@ class QPCRQAQC(object):
                         # if ntc_info.source_max != "cal_target_ct" and lower_ntc_target == self.config.input.normalizer_id.strip().lower() and self.config.template.hide_normalizer_target_from_main:
                         # We're hiding the normalizer target from the main output, so we need to calculate the minimum Ct from the df
                         if ntc_info.source_max == "all_target_ct":
-                            calc_df = full_df[(full_df[self.config.input.measure_type_col] == self.config.input.measure_type_unknown) & (full_df[self.config.input.target_col].str.lower() == lower_ntc_target) & (full_df[self.config.input.plate_id_col].str.lower() == plate_id.lower())]
-                            max_formula = max(calc_df[self.config.input.ct_col].max(), calc_df[OUTLIER_COL].max())
+                            max_formula = plate_index.get_max_ct(lower_ntc_target, plate_id)
                             # calc_df = df[(df[self.config.input.unit_col] == "Ct") & (df[self.config.input.target_col].str.lower() == lower_ntc_target) & (df[self.config.input.qa_col].isin(["FALSE", False]))]
                             # max_formula = calc_df[self.config.input.ct_col].max()
                         elif ntc_info.source_max == "cal_target_ct":
@@ -457,7 +841,7 @@ class QPCRQAQC(object):
                         qaqc_data[VALIDATES_COL] = self.get_validates_formula(accept_blanks=True)
                         qaqc_data[NOTES_COL] = '="Max Ct="&{}'.format(max_formula if not pd.isna(max_formula) else '""')
 
-                        self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                        self.qaqc_rows.append(qaqc_data)
 
     def qaqc_run_no_detections(self, name):
         all_no_detections_config = self.qaqc_config.get("no_detections", None)
@@ -616,7 +1000,7 @@ class QPCRQAQC(object):
                         qaqc_data[CELL_B_COL] = self.make_cell_link(cell_ref_b)
                         qaqc_data[VALUE_COL] = f"=ABS({cell_ref_a}-{cell_ref_b})"
                         value_ref = "{col='Value'}{row}"
-                        value_ref = parse_colrow_tags(value_ref, self.qaqc_df, self.get_next_qaqc_row())                        
+                        value_ref = parse_colrow_tags(value_ref, self.qaqc_rows.columns, self.get_next_qaqc_row())                        
                             
                         depth = 0
                         upper_range_formula = ""
@@ -700,7 +1084,7 @@ class QPCRQAQC(object):
         qaqc_data[DESC_COL] = match_config.description.format(target=target)
         qaqc_data[PRIORITY_COL] = match_config.priority
 
-        value_cell = parse_colrow_tags("{col='Value'}{row}", self.qaqc_df, self.get_next_qaqc_row())
+        value_cell = parse_colrow_tags("{col='Value'}{row}", self.qaqc_rows.columns, self.get_next_qaqc_row())
         good_formulas = []
         bad_formulas = []
         info = []
@@ -911,7 +1295,7 @@ class QPCRQAQC(object):
                 qaqc_data[CELL_A_COL] = self.make_cell_link(cell_ref)
                 qaqc_data[CELL_B_COL] = None
                 qaqc_data[VALIDATES_COL] = self.get_validates_formula(accept_blanks=accept_blanks)
-                self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                self.qaqc_rows.append(qaqc_data)
         
         return False
 
@@ -1006,7 +1390,7 @@ class QPCRQAQC(object):
                     else:
                         qaqc_data[VALUE_COL] = "MISSING"
                         qaqc_data[VALIDATES_COL] = False
-                    self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                    self.qaqc_rows.append(qaqc_data)
 
     def qaqc_run_standard_curves(self, name):        
         if "standard_curves" not in self.qaqc_config:
@@ -1058,7 +1442,7 @@ class QPCRQAQC(object):
                         else:
                             qaqc_data[VALUE_COL] = "MISSING"
                             qaqc_data[VALIDATES_COL] = False
-                        self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                        self.qaqc_rows.append(qaqc_data)
 
                     # Check if each standard replicates average is in range
                     if "average_replicates_range" in curve:
@@ -1085,7 +1469,7 @@ class QPCRQAQC(object):
                             else:
                                 qaqc_data[VALUE_COL] = "MISSING"
                                 qaqc_data[VALIDATES_COL] = False
-                            self.qaqc_df = self.qaqc_df.append(qaqc_data, ignore_index=True)
+                            self.qaqc_rows.append(qaqc_data)
 
     def qaqc_highlight_outliers(self):
         main_ws, main_info = self.populator.get_worksheet_and_info(MAIN_SHEET)
@@ -1232,10 +1616,11 @@ class QPCRQAQC(object):
 
         # Formatting added first is applied last (has higher precedence)
 
-        # Apply known priorities
+        # Apply known priorities. All rules of a priority share the same style, so they can be merged
+        # without changing which style wins on a cell.
         for prio_info in self.qaqc_config.qaqc_priorities:
             if prio_info["name"] in self.formatting_rules:
-                for rule in self.formatting_rules[prio_info["name"]]:
+                for rule in coalesce_formatting_rules(self.formatting_rules[prio_info["name"]]):
                     _apply(rule)
 
         # Apply unknown priorities (ie. not in the config file)
@@ -1243,7 +1628,7 @@ class QPCRQAQC(object):
         for prio_key, prio_info in self.formatting_rules.items():
             if prio_key in known_prios:
                 continue
-            for rule in self.formatting_rules[prio_key]:
+            for rule in coalesce_formatting_rules(self.formatting_rules[prio_key]):
                 _apply(rule)
 
         self.formatting_rules = {}
@@ -1267,9 +1652,9 @@ class QPCRQAQC(object):
         if not self.has_qaqc():
             return
 
-        # Make a new sheet and copy data over from qaqc_df
+        # Make a new sheet and copy data over from qaqc_rows
         ws = None
-        if len(self.qaqc_df.index) > 0:
+        if len(self.qaqc_rows) > 0:
             sheet_name = self.get_sheet_name()
             if DELETE_EXISTING_SHEET:
                 if sheet_name in wb.sheetnames:
@@ -1286,59 +1671,54 @@ class QPCRQAQC(object):
             ws = self.output_wb[sheet_name]
             ws.freeze_panes = "A2"
 
-            # Add all the rows from QAQC DataFrame
-            for r in dataframe_to_rows(self.qaqc_df, index=False, header=True):
+            # Add all the QAQC rows
+            for r in self.qaqc_rows.iter_rows(header=True):
                 ws.append(r)
         
-        if len(self.qaqc_df.index) > 0:
+        if len(self.qaqc_rows) > 0:
             # Add hyperlinks to CELL_A_COL and CELL_B_COL columns in QAQC sheet
-            col_id_a = get_column_letter(self.qaqc_df.columns.tolist().index(CELL_A_COL)+1)
-            col_id_b = get_column_letter(self.qaqc_df.columns.tolist().index(CELL_B_COL)+1)
-            for col_id in [col_id_a, col_id_b]:
-                for cell in ws[f"{col_id}:{col_id}"]:
-                    if isinstance(cell.value, str) and re.search("=[\s]*hYPERLINK[\s]*\(", cell.value, re.IGNORECASE) is not None:
-                        cell.style = "Hyperlink"
+            for link_col in [CELL_A_COL, CELL_B_COL]:
+                col_id = get_column_letter(self.qaqc_rows.column_index(link_col)+1)
+                for row_num, links in enumerate(self.qaqc_rows.links, start=2):
+                    if link_col in links:
+                        ws[f"{col_id}{row_num}"].style = "Hyperlink"
         
 
-            val_col = get_column_letter(self.qaqc_df.columns.tolist().index(VALIDATES_COL)+1)
-            priority_col = get_column_letter(self.qaqc_df.columns.tolist().index(PRIORITY_COL)+1)
+            val_col = get_column_letter(self.qaqc_rows.column_index(VALIDATES_COL)+1)
+            priority_col = get_column_letter(self.qaqc_rows.column_index(PRIORITY_COL)+1)
 
             # Highlight all rows in QAQC sheet with FALSE in the Validates column
             for prio, style in self.styles.items():
                 r = Rule(type="expression", dxf=style["dxf"], stopIfTrue=False)
                 r.formula = [f'AND(NOT(${val_col}2),${priority_col}2="{prio}")']
-                max_col = get_column_letter(len(self.qaqc_df.columns))
-                max_row = len(self.qaqc_df.index) + 1
+                max_col = get_column_letter(len(self.qaqc_rows.columns))
+                max_row = len(self.qaqc_rows) + 1
                 # ws.conditional_formatting.add(f"A2:{max_col}{max_row}", r)
                 self.append_formatting_rule(ws, prio, f"A2:{max_col}{max_row}", r)
                 ws.number_format = "#.##"
             
             # Conditional formatting for target cells that are invalid. We check the Validates column and
             # if FALSE we mark change coloring of the target cell
-            cell_a_col = get_column_letter(self.qaqc_df.columns.tolist().index(CELL_A_COL)+1)
-            cell_b_col = get_column_letter(self.qaqc_df.columns.tolist().index(CELL_B_COL)+1)
-            for rng in [ws[f"{cell_a_col}2:{cell_a_col}{max_row}"], ws[f"{cell_b_col}2:{cell_b_col}{max_row}"]]:
-                for cell in rng:
-                    # eg: =HYPERLINK("#'Main'!D33", "'Main'!D33")
-                    # We will retrieve the first parameter, which is the actual link
-                    cell = cell[0]
-                    if cell.value is None:
+            for link_col in [CELL_A_COL, CELL_B_COL]:
+                for row_num, (links, row_prio) in enumerate(zip(self.qaqc_rows.links, self.qaqc_rows.buffers[PRIORITY_COL]), start=2):
+                    # The cells shown in the hyperlink, eg. [("Main", "D33")] for =HYPERLINK("#'Main'!D33", "'Main'!D33")
+                    cell_refs = links.get(link_col, None)
+                    if not cell_refs:
                         continue
 
-                    res = re.search('"(?=[^#,])([^"]*)"\)', cell.value)
-                    if not res:
-                        continue
-                    cell_refs = [r.strip() for r in res[1].split(",")]
+                    # The formatting rules compare the row's priority to each style's priority. If the priority is a
+                    # literal then only the rule for that priority can ever apply, so skip the others.
+                    if isinstance(row_prio, str) and not row_prio.startswith("="):
+                        row_styles = {prio : style for prio, style in self.styles.items() if str(prio).lower() == row_prio.lower()}
+                    else:
+                        row_styles = self.styles
                     
-                    for ref in cell_refs:
-                        target_sheet, target_cell = ref.split("!")
-                        target_sheet = target_sheet.strip("'")
-
-                        for prio, style in self.styles.items():
+                    for target_sheet, target_cell in cell_refs:
+                        for prio, style in row_styles.items():
                             r = Rule(type="expression", dxf=style["dxf"], stopIfTrue=False)
-                            # formula = f"AND(NOT('{sheet_name}'!${val_col}${cell.row}),'{sheet_name}'!${priority_col}${cell.row}=\"{prio}\")"
-                            val_cell = f"'{sheet_name}'!${val_col}${cell.row}"
-                            prio_cell = f"'{sheet_name}'!${priority_col}${cell.row}"
+                            # formula = f"AND(NOT('{sheet_name}'!${val_col}${row_num}),'{sheet_name}'!${priority_col}${row_num}=\"{prio}\")"
+                            val_cell = f"'{sheet_name}'!${val_col}${row_num}"
+                            prio_cell = f"'{sheet_name}'!${priority_col}${row_num}"
                             # indirect_val_cell = f"INDIRECT(\"'{sheet_name}'!\"&ADDRESS(ROW({val_cell}),COLUMN({val_cell})))"
                             # indirect_prio_cell = f"INDIRECT(\"'{sheet_name}'!\"&ADDRESS(ROW({prio_cell}), COLUMN({prio_cell})))"
                             formula = f"AND(NOT({val_cell}),{prio_cell}=\"{prio}\")"
@@ -1353,7 +1733,7 @@ class QPCRQAQC(object):
         self.qaqc_higlight_conditional_formatting()
 
         # Make sure Validates column is boolean
-        # col = get_column_letter(self.qaqc_df.columns.tolist().index(VALIDATES_COL) + 1)
+        # col = get_column_letter(self.qaqc_rows.column_index(VALIDATES_COL) + 1)
         # for cell in ws[f"{col}:{col}"]:
         #     cell.data_type = "b"
 
@@ -1364,9 +1744,25 @@ class QPCRQAQC(object):
             for cell in ws["1:1"]:
                 cell.font = Font(color="00000000", bold=True)
 
+    def get_ct_outliers_settings(self):
+        """Get the settings of the QAQC config that decide which Ct values are outliers (see CT_OUTLIERS_SETTINGS). These
+        are saved in the QAQC cache, so that QPCRPopulator.rerun_qaqc can tell if they changed.
+
+        Returns
+        -------
+        dict
+            The settings, as {"main_ct_outliers" : [{setting : value}], "cal_ct_outliers" : [{setting : value}]}.
+        """
+        settings = {}
+        for key in ["main_ct_outliers", "cal_ct_outliers"]:
+            all_outliers_info = (self.qaqc_config.get(key, None) if self.has_qaqc() else None) or []
+            settings[key] = [{ s : outliers_info.get(s, None) for s in CT_OUTLIERS_SETTINGS } for outliers_info in all_outliers_info]
+        return settings
+
     def remove_all_outliers(self, data, master_df):
         """Remove all outlier Ct values in the data by setting them to None. Data are matched together
-        based on target and sample ID.
+        based on target and sample ID. The original Ct values of the outliers are moved to OUTLIER_COL, in both
+        data and master_df.
         """            
         # data[OUTLIER_COL] = None
 
@@ -1376,112 +1772,123 @@ class QPCRQAQC(object):
         main_outliers_info = self.qaqc_config.get("main_ct_outliers", None)
         cal_outliers_info = self.qaqc_config.get("cal_ct_outliers", None)
 
-        # for all_outliers_info, unit_tag, use_unit_col in [(main_outliers_info, "Ct", True), (cal_outliers_info, "Ct_Std", False)]:
+        # Ct values with the outliers found so far removed, since each outliers_info is applied to the result of the previous ones
+        ct_values = data[self.config.input.ct_col].astype(float)
+        outliers = pd.Series(False, index=data.index)
+
         for all_outliers_info, measure_type in [(main_outliers_info, self.config.input.measure_type_unknown), (cal_outliers_info, self.config.input.measure_type_std)]:
             if all_outliers_info is None:
                 continue
             
             for outliers_info in all_outliers_info:
-                ct_values = data[data[self.config.input.measure_type_col] == measure_type]
-                target_groups = ct_values.groupby(self.config.input.target_col)
                 apply_to_targets = outliers_info.get("targets", [])
                 if isinstance(apply_to_targets, str):
                     apply_to_targets = [apply_to_targets]
-                if apply_to_targets is not None:
-                    apply_to_targets = [g.strip().lower() for g in apply_to_targets]
-                rng = outliers_info.get("range", None)
-                max_stdev = outliers_info.get("max_stdev", None)
-                min_replicates = outliers_info.get("min_replicates", None)
-                max_replicates = outliers_info.get("max_replicates", None)
-
-                # We group by target and sample ID
-                for target_name, target_group in target_groups:
-                    if len(apply_to_targets) > 0 and target_name.lower() not in apply_to_targets:
-                        continue
-                    for idx, sample_id in enumerate(target_group[self.config.input.sample_id_col].str.lower().unique()):
-                        cur_data = target_group[target_group[self.config.input.sample_id_col].str.lower() == sample_id]
-                        cur_data = cur_data.copy()
-
-                        self.flag_outliers(cur_data, [data, master_df], max_stdev, rng, min_replicates, max_replicates)
-
-                        # orderings = None
-                        # if "grouped_values" in outliers_info:
-                        #     for grouped_values in outliers_info.grouped_values:
-                        #         targets = grouped_values.targets
-                        #         if isinstance(targets, str):
-                        #             targets = [targets]
-                        #         targets = [g.strip().lower() for g in targets]
-                        #         if target_name.lower() in targets:
-                        #             orderings = grouped_values.groups
-                        #             break
-
-                        # # orderings is an optional 2d array. Each subarray specifies the indices to group values by
-                        # # eg. [[0,1,2], [3,4,5]] will group items [0,1,2] and remove outliers from them, then group
-                        # # items [3,4,5] and separately remove outliers from them. Groupings are specified
-                        # # in outliers.grouped_values in the config file.
-                        # if orderings is None:
-                        #     self.flag_outliers(cur_data, [data, master_df], max_stdev, rng, min_replicates, max_replicates)
-                        # else:
-                        #     for ordering in orderings:
-                        #         ordering = [o for o in ordering if o < len(cur_data.index)]
-                        #         ordered_data = cur_data.sort_values(self.config.input.index_col).iloc[ordering]
-                        #         ordered_data = ordered_data.copy()
-                        #         self.flag_outliers(ordered_data, [data, cur_data, master_df], max_stdev, rng, min_replicates, max_replicates)
+                apply_to_targets = [g.strip().lower() for g in apply_to_targets or []]
+
+                use_rows = data[self.config.input.measure_type_col] == measure_type
+                if len(apply_to_targets) > 0:
+                    use_rows &= data[self.config.input.target_col].str.lower().isin(apply_to_targets)
+                cur_data = data.loc[use_rows, [self.config.input.target_col, self.config.input.sample_id_col]].copy()
+                cur_data[self.config.input.ct_col] = ct_values[use_rows]
 
-    def flag_outliers(self, data, modify_dfs, max_stdev, rng, min_replicates, max_replicates):
-        """Go through the data and mark all outliers with None in the Ct column until the
-        standard deviation is <= max_stdev (with at least min_replicates items). The data are
-        treated as a single group.
+                cur_outliers = self.flag_outliers(cur_data, outliers_info.get("max_stdev", None), outliers_info.get("range", None), outliers_info.get("min_replicates", None), outliers_info.get("max_replicates", None))
+                cur_outliers = cur_outliers[cur_outliers].index
+                ct_values[cur_outliers] = np.nan
+                outliers[cur_outliers] = True
+
+        outliers = outliers[outliers].index
+        if len(outliers) == 0:
+            return
+        for df in [data, master_df]:
+            df.loc[outliers, OUTLIER_COL] = df.loc[outliers, self.config.input.ct_col]
+            df.loc[outliers, self.config.input.ct_col] = None
+
+    def flag_outliers(self, data, max_stdev, rng, min_replicates, max_replicates):
+        """Find all outlier Ct values in the data. Values are grouped into replicates by target and sample ID (case insensitive),
+        and outliers are found separately in each group. First all values outside of rng are outliers, then the value furthest
+        from the mean of its group is repeatedly flagged until the standard deviation of each group is <= max_stdev
+        (with at least min_replicates items).
+
+        All groups are handled at once, as the rows of a (group x replicate) matrix of Ct values.
 
         Parameters
         ----------
         data : pd.DataFrame
-            Data to remove outliers from (by setting the Ct value to None).
-        modify_dfs: pd.DataFrame | list | tuple | np.ndarray
-            If specified, then the matching Ct values in these DataFrames are also set to None, using
-            the same index used in data. The indices in each of these dfs should correspond to the indices
-            in data (eg. they can be the parent DataFrame that data was taken from).
+            Data to find outliers in. Must have the target, sample ID, and Ct columns. Replicates are ordered as in data.
         max_stdev : float
-            Maximum value of the standard deviation. We remove values until the standard
+            Maximum value of the standard deviation. We flag values until the standard
             deviation of the group is <= this.
+        rng : list
+            The range [min, max] of valid Ct values, either of which can be None. Values outside this range are outliers, but
+            only for groups that have more than min_replicates missing Ct values.
         min_replicates : int
-            Minimum number of replicates allowed. If we reach this then we stop removing outliers.
+            Minimum number of replicates allowed. If we reach this then we stop flagging outliers.
         max_replicates : int
             Maximum replicates to use for calculating standard deviation to determine outliers. At most the first
-            max_replicates numbers in data are used (value beyond that are ignored)
-        """
-        if isinstance(modify_dfs, pd.DataFrame):
-            modify_dfs = [modify_dfs]
+            max_replicates numbers in each group are used (value beyond that are ignored)
 
-        ct = self.config.input.ct_col
-        max_replicates = min(len(data.index), max_replicates) if max_replicates is not None else len(data.index)
+        Returns
+        -------
+        pd.Series
+            Boolean mask with the same index as data, True for all outliers.
+        """
         min_replicates = min_replicates or 0
-        
+        outliers = pd.Series(False, index=data.index)
+
+        sample_ids = data[self.config.input.sample_id_col].str.lower()
+        data = data[data[self.config.input.target_col].notna() & sample_ids.notna()]
+        if len(data.index) == 0:
+            return outliers
+        groups = data.groupby([self.config.input.target_col, sample_ids[data.index]], sort=False).ngroup().to_numpy()
+        replicates = data.groupby(groups).cumcount().to_numpy()
+        values = data[self.config.input.ct_col].to_numpy(dtype=float)
+        labels = data.index.to_numpy()
+        if max_replicates is not None:
+            keep = replicates < max_replicates
+            groups, replicates, values, labels = groups[keep], replicates[keep], values[keep], labels[keep]
+            if len(values) == 0:
+                return outliers
+
+        num_groups = groups.max() + 1
+        num_replicates = replicates.max() + 1
+        cts = np.full((num_groups, num_replicates), np.nan)
+        cts[groups, replicates] = values
+        has_replicate = np.zeros(cts.shape, dtype=bool)
+        has_replicate[groups, replicates] = True
+        flagged = np.zeros(cts.shape, dtype=bool)
+
         if rng is not None:
-            for idx in data[ct].iloc[:max_replicates].index:
-                if (data[ct].iloc[:max_replicates].isna()).sum() <= min_replicates:
-                    break
-                if not self.is_in_range(data.loc[idx, ct], rng):
-                    data.loc[idx, ct] = None
-                    for df in modify_dfs:
-                        df.loc[idx, OUTLIER_COL] = df.loc[idx, ct]
-                        df.loc[idx, ct] = None
+            out_of_range = np.zeros(cts.shape, dtype=bool)
+            if rng[0] is not None:
+                out_of_range |= cts < rng[0]
+            if rng[1] is not None:
+                out_of_range |= cts > rng[1]
+            num_missing = (np.isnan(cts) & has_replicate).sum(axis=1)
+            out_of_range &= (num_missing > min_replicates)[:, None]
+            flagged |= out_of_range
+            cts[out_of_range] = np.nan
 
         if max_stdev is not None:
-            mean = data[ct].iloc[:max_replicates].mean()
-            stdev = data[ct].iloc[:max_replicates].std()
-            while stdev > max_stdev and (~data[ct].iloc[:max_replicates].isna()).sum() > min_replicates:
-                diff = (data.iloc[:max_replicates][~data[ct].iloc[:max_replicates].isna()][ct] - mean).abs()
-                argmax = diff.argmax()
-                idx = diff.index[argmax]
-                val = data.loc[idx, ct]
-                data.loc[idx, ct] = None
-                if modify_dfs is not None:
-                    for df in modify_dfs:
-                        df.loc[idx, OUTLIER_COL] = df.loc[idx, ct]
-                        df.loc[idx, ct] = None
-                mean = data[ct].iloc[:max_replicates].mean()
-                stdev = data[ct].iloc[:max_replicates].std()
+            while True:
+                # Same arithmetic as pd.Series.mean() and pd.Series.std() on each group, so that ties and values
+                # at exactly max_stdev are handled the same
+                count = (~np.isnan(cts)).sum(axis=1)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = np.nansum(cts, axis=1) / count
+                    sqr = (mean[:, None] - cts) ** 2
+                    stdev = np.sqrt(np.nansum(sqr, axis=1) / (count - 1))
+                stdev[count <= 1] = np.nan
+                with np.errstate(invalid="ignore"):
+                    candidates = np.flatnonzero((stdev > max_stdev) & (count > min_replicates))
+                if len(candidates) == 0:
+                    break
+                furthest = np.nanargmax(np.abs(cts[candidates] - mean[candidates, None]), axis=1)
+                flagged[candidates, furthest] = True
+                cts[candidates, furthest] = np.nan
+
+        outliers[labels[flagged[groups, replicates]]] = True
+        return outliers
 
     def make_cell_link(self, cell_addr, type=1):
         """Get a hyperlink Excel formula to link to the specified cells.
@@ -1500,8 +1907,9 @@ class QPCRQAQC(object):
 
         Returns
         -------
-        str
-            A =HYPERLINK() Excel formula that can be placed in an Excel cell.
+        QAQCCellLink
+            The =HYPERLINK() Excel formula that can be placed in an Excel cell, with the cells it shows, or None
+            if there is nothing to link to.
         """
         # If type = 1, then only return a link to the first address in cell_addr
         if isinstance(cell_addr, str):
@@ -1512,6 +1920,8 @@ class QPCRQAQC(object):
 
         use_addr = cell_addr
         use_name = cell_addr
+        # The addresses shown in the hyperlink
+        shown_addr = cell_addr
 
         if type == 0:
             use_addr = cell_addr[0]
@@ -1519,14 +1929,20 @@ class QPCRQAQC(object):
         elif type == 1:
             use_addr = cell_addr[0]
             use_name = cell_addr[0]
+            shown_addr = cell_addr[:1]
         elif type == 2:
             if len(cell_addr) < 2:
                 return None
             else:
                 use_addr = cell_addr[1]
                 use_name = ", ".join(cell_addr[1:])
+                shown_addr = cell_addr[1:]
 
-        return f"=HYPERLINK(\"#{use_addr}\", \"{use_name}\")"
+        refs = []
+        for addr in shown_addr:
+            target_sheet, target_cell = addr.split("!")
+            refs.append((target_sheet.strip("'"), target_cell))
+        return QAQCCellLink(f"=HYPERLINK(\"#{use_addr}\", \"{use_name}\")", refs)
 
     def add_failed_category_qaqc_cell(self, category, failed, success, empty, target_ws, target_coordinates):
         if not self.has_qaqc():
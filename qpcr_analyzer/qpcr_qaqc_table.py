@@ -0,0 +1,953 @@
+"""
+qpcr_qaqc_table.py
+==================
+
+Compute the QA/QC checks directly from the QPCR data, without generating or calculating the output workbook.
+
+The QAQC sheets created by qpcr_qaqc.py are made of Excel formulas, so the pass/fail outcome of each check is only known
+once the workbook is calculated. QPCRQAQCTable instead calculates every check in pandas and returns a tidy DataFrame, with
+one row per check (see QAQC_TABLE_COLUMNS). The same QAQC config file as QPCRQAQC is used.
+
+Usage:
+
+    table = QPCRQAQCTable("qaqc_long-2main-inh.yaml", "qpcr_populator_long-2main-inh.yaml")
+    qaqc_df = table.run(df, full_df=full_df, name="2021-08-10", methods=QPCRMethods("qpcr_methods.yaml", "qpcr_methods.xlsx"))
+    failed = qaqc_df[qaqc_df["status"] != STATUS_PASS]
+
+df is the QPCR data (as used by QPCRPopulator, after the sample IDs, targets and standard curve IDs are assigned and the outliers
+are removed). If the standard curves are not passed in to run then they are fitted from the standards in df, the same way
+QPCRPopulator does. The methods are needed to convert the copies per well to the copies per extracted mass, per L and per copies
+of the normalizer for the copies outliers check. These conversions follow the formulas of qpcr_template_long-2main-inh.xlsx, so
+only the columns listed in qaqc_table.copies_columns of the populator config are checked, and the copies outliers of all other
+columns have the status STATUS_UNSUPPORTED. Note that the "_b" copies per extracted mass columns of
+qpcr_template_wide-2main-inh.xlsx divide by the template volume of the second target instead of by the extracted mass, so they
+are not listed in qpcr_populator_wide_diff-2main-inh.yaml.
+"""
+
+import pandas as pd
+import numpy as np
+import math
+import re
+import itertools
+import warnings
+from openpyxl.utils import column_index_from_string
+
+from qpcr_utils import (
+    OUTLIER_COL,
+    load_config,
+    fit_standard_curve,
+)
+from qpcr_methods import DILUTION_FACTOR_COLUMN
+
+STATUS_PASS = "pass"
+STATUS_FAIL = "fail"
+STATUS_MISSING = "missing"
+# The check is in the QAQC config but can not be calculated by the QAQC table (eg. a copies outliers column with a formula that is
+# not calculated by the table)
+STATUS_UNSUPPORTED = "unsupported"
+
+QAQC_TABLE_COLUMNS = ["group", "check", "category", "description", "priority", "target", "sample", "replicate", "status", "value", "lower", "upper"]
+
+# All checks, in the order they are run
+QAQC_TABLE_CHECKS = ["ntc", "sample_data_available", "standard_curve", "standard_curve_comparison", "samples_within_standard_curves", "loq", "inhibition", "normalizer", "comparable_targets", "copies_outliers", "non_detect"]
+
+# Inhibition Delta Ct columns in the QAQC config, eg. "main_col_inhibition_b_a_dct" is the average Ct of the second
+# inhibition target (input.inhibition_targets) minus the average Ct of the first inhibition target.
+INHIBITION_DCT_REGEX = re.compile(r"inhibition_([a-z]+)_([a-z]+)_dct$", re.IGNORECASE)
+
+# Main sheet copies columns in the QAQC config, eg. "main_col_copies_per_mass" and "main_col_copies_per_mass_b" are the copies
+# per extracted mass. The other units are "volume" (copies per L) and "copies" (copies per copies of the normalizer).
+COPIES_COLUMN_REGEX = re.compile(r"copies_per_(mass|volume|copies)(_[a-z])?$", re.IGNORECASE)
+
+# The sample columns used to convert the copies per well in the main sheet
+SAMPLE_VALUE_COLUMNS = ["totalVolume", "emptyTubeMass", "totalTubeMass", "settledSolids", "extractedMass"]
+
+ND_VALUE = "<ND>"
+MISSING_VALUE = "<MISSING>"
+
+class PlateIndex(object):
+    def __init__(self, df, config):
+        """Index the rows of the QPCR data by plate, so that the controls and maximum unknown Ct values of the plates of an
+        analysis group can be looked up without scanning all of the data for every group. Only the row positions are indexed,
+        the values are read from df on each lookup, so Ct values and outliers can still change after indexing (eg. in
+        QPCRQAQC.remove_all_outliers).
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            All QPCR data (ie. the full_df passed to QPCRQAQC.run_qaqc).
+        config : EasyDict
+            The populator config.
+        """
+        super().__init__()
+        inp = config.input
+        self.df = df
+        self.num_rows = len(df.index)
+        self.ct_col = inp.ct_col
+
+        # {(plateID, measure type) : row positions}, with None for missing plate IDs. Grouped on object arrays, since groupby drops
+        # missing categorical keys from indices even with dropna=False.
+        keys = [df[inp.plate_id_col].to_numpy(dtype=object), df[inp.measure_type_col].to_numpy(dtype=object)]
+        self.measure_type_rows = { (None if pd.isna(plate_id) else plate_id, measure_type) : pos
+            for (plate_id, measure_type), pos in pd.Series(np.arange(self.num_rows)).groupby(keys, sort=False, dropna=False).indices.items() }
+
+        # {(target, plateID) : row positions} of all unknowns, with lower case keys
+        unknowns = np.flatnonzero((df[inp.measure_type_col] == inp.measure_type_unknown).to_numpy())
+        keys = [df[inp.target_col].iloc[unknowns].str.lower().to_numpy(), df[inp.plate_id_col].iloc[unknowns].str.lower().to_numpy()]
+        self.unknown_rows = { key : unknowns[pos] for key, pos in pd.Series(unknowns).groupby(keys, sort=False).indices.items() }
+
+    def indexes(self, df):
+        """Check if df is the DataFrame that was indexed.
+        """
+        return df is self.df and len(df.index) == self.num_rows
+
+    def get_rows(self, plates, measure_types):
+        """Get all rows that are on any of the plates and have any of the measure types, in the same order as in df. A missing
+        plate ID (None or NaN) in plates matches the rows with no plate ID.
+        """
+        plates = [None if pd.isna(plate_id) else plate_id for plate_id in plates]
+        pos = [self.measure_type_rows[key] for key in itertools.product(plates, measure_types) if key in self.measure_type_rows]
+        pos = np.sort(np.concatenate(pos)) if len(pos) > 0 else []
+        return self.df.iloc[pos]
+
+    def get_max_ct(self, target, plate_id):
+        """Get the maximum Ct of the unknowns for the target on the plate (case insensitive), including outliers. This is the larger
+        of the maximum Ct and the maximum outlier, or NaN if there are no Ct values.
+        """
+        rows = self.df.iloc[self.unknown_rows.get((target.lower(), plate_id.lower()), [])]
+        return max(rows[self.ct_col].max(), rows[OUTLIER_COL].max())
+
+class QPCRQAQCTable(object):
+    def __init__(self, qaqc_config_file, config_file, num_replicates=3):
+        """
+        Parameters
+        ----------
+        qaqc_config_file : str | list[str]
+            The QAQC config file(s), as used by QPCRQAQC.
+        config_file : str | list[str]
+            The populator config file(s), as used by QPCRPopulator.
+        num_replicates : int
+            The number of replicates of each sample that are checked (ie. the number of Ct columns per target in the template).
+        """
+        super().__init__()
+        self.qaqc_config = load_config(qaqc_config_file)
+        self.config = load_config(config_file)
+        self.num_replicates = num_replicates
+        self.plate_index = None
+
+    def has_qaqc(self):
+        return self.qaqc_config is not None
+
+    def index_plates(self, full_df):
+        """Create the PlateIndex of full_df, used by the NTC checks. Call this once up front (eg. before splitting the data into
+        analysis groups), otherwise the index is created on the first NTC check.
+        """
+        self.plate_index = PlateIndex(full_df, self.config)
+        return self.plate_index
+
+    def get_plate_index(self, full_df):
+        """Get the PlateIndex of full_df, creating it if full_df was not the last DataFrame indexed.
+        """
+        if self.plate_index is None or not self.plate_index.indexes(full_df):
+            self.index_plates(full_df)
+        return self.plate_index
+
+    def run(self, df, full_df=None, curves=None, name="", checks=None, methods=None, main_columns=None):
+        """Run the QAQC checks on the data.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The QPCR data to check (eg. a single analysis group).
+        full_df : pd.DataFrame
+            All QPCR data. The NTCs and maximum Ct values for each plate in df are taken from full_df. If None then df is used.
+        curves : dict
+            The standard curves, as {standard_curve_id : curve}, where each curve is a dict with the keys "target", "plateID",
+            "slope", "intercept", "rsq" and "avg_std_{n}" (see QPCRPopulator.get_calibration_value). If None then the curves are
+            fitted from the standards in df.
+        name : str
+            The group name, stored in the "group" column.
+        checks : list[str]
+            The checks to run (see QAQC_TABLE_CHECKS). If None then all checks are run.
+        methods : QPCRMethods
+            The methods, used to convert the copies per well in the copies outliers check. If None then that check is skipped.
+        main_columns : list[str]
+            The names of the columns in the main sheet (eg. "main_col_copies_per_mass"). The copies outliers columns that are not
+            in the main sheet are skipped, the same as in the QAQC sheets. If None then all columns are checked.
+
+        Returns
+        -------
+        pd.DataFrame
+            The QAQC results, with the columns QAQC_TABLE_COLUMNS.
+        """
+        if not self.has_qaqc():
+            return pd.DataFrame(columns=QAQC_TABLE_COLUMNS)
+        if full_df is None:
+            full_df = df
+        if curves is None:
+            curves = self.fit_standard_curves(df)
+
+        run_funcs = {
+            "ntc" : lambda: self.check_ntc(df, full_df),
+            "sample_data_available" : lambda: self.check_sample_data_available(df, main_columns),
+            "standard_curve" : lambda: self.check_standard_curves(curves),
+            "standard_curve_comparison" : lambda: self.check_standard_curve_comparisons(curves),
+            "samples_within_standard_curves" : lambda: self.check_samples_within_standard_curves(df, curves, main_columns),
+            "loq" : lambda: self.check_loq(df, curves),
+            "inhibition" : lambda: self.check_inhibition(df),
+            "normalizer" : lambda: self.check_normalizer(df),
+            "comparable_targets" : lambda: self.check_comparable_targets(df),
+            "copies_outliers" : lambda: self.check_copies_outliers(df, curves, methods, main_columns),
+            "non_detect" : lambda: self.check_non_detects(df),
+        }
+        results = []
+        for check in QAQC_TABLE_CHECKS:
+            if checks is not None and check not in checks:
+                continue
+            cur_results = run_funcs[check]()
+            if cur_results is not None and len(cur_results.index) > 0:
+                cur_results["check"] = check
+                results.append(cur_results)
+
+        if len(results) == 0:
+            return pd.DataFrame(columns=QAQC_TABLE_COLUMNS)
+        results = pd.concat(results, ignore_index=True)
+        results["group"] = name
+        return results.reindex(columns=QAQC_TABLE_COLUMNS)
+
+    def get_status(self, values, lower=None, upper=None, accept_blanks=False):
+        """Get the status of each value, for the inclusive range [lower, upper].
+
+        Parameters
+        ----------
+        values : pd.Series
+            The values to check. NaN values are missing.
+        lower, upper : pd.Series | float | None
+            The limits. None or NaN limits are not checked.
+        accept_blanks : bool
+            If True then missing values pass, otherwise their status is STATUS_MISSING.
+
+        Returns
+        -------
+        np.ndarray
+            The status of each value.
+        """
+        values = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+        in_range = np.ones(len(values), dtype=bool)
+        for limit, compare in [(lower, np.greater_equal), (upper, np.less_equal)]:
+            if limit is None:
+                continue
+            limit = np.broadcast_to(np.asarray(limit, dtype=float), values.shape)
+            with np.errstate(invalid="ignore"):
+                in_range &= np.isnan(limit) | compare(values, limit)
+        status = np.where(in_range, STATUS_PASS, STATUS_FAIL)
+        return np.where(np.isnan(values), STATUS_PASS if accept_blanks else STATUS_MISSING, status)
+
+    def make_results(self, info, values, status, lower=None, upper=None, **format_vars):
+        """Make the results DataFrame for a check, with the category, description and priority taken from the check's
+        QAQC config (info). values is a DataFrame with at least the columns "target", "sample" and "value". format_vars
+        are used for formatting the category and description, and are either a single value or an np.ndarray with a value
+        for each row ("target" is the row's target if not set).
+        """
+        results = values.reindex(columns=["target", "sample", "replicate", "value"]).reset_index(drop=True)
+        results["status"] = status
+        results["lower"] = lower
+        results["upper"] = upper
+        if len(results.index) == 0:
+            return results
+        format_vars.setdefault("target", results["target"].to_numpy())
+        for key in ["category", "description"]:
+            template = info.get(key, "") or ""
+            results[key] = [template.format(**{ k : v[idx] if isinstance(v, (np.ndarray, pd.Series)) else v for k, v in format_vars.items() }) for idx in range(len(results.index))]
+        results["priority"] = info.get("priority", None)
+        return results
+
+    def get_targets_filter(self, df, targets):
+        """Get a filter for all rows in df with any of the targets (case insensitive). If targets is empty then all
+        rows are matched.
+        """
+        if targets is None or len(targets) == 0:
+            return pd.Series(True, index=df.index)
+        if isinstance(targets, str):
+            targets = [targets]
+        return df[self.config.input.target_col].str.lower().isin([t.strip().lower() for t in targets])
+
+    def get_main_targets(self):
+        """Get the targets that have their own rows in the main sheet (input.main_targets and input.other_targets).
+        """
+        return list(self.config.input.get("main_targets", None) or []) + list(self.config.input.get("other_targets", None) or [])
+
+    def get_replicates(self, df, measure_type):
+        """Get the replicates of each sample and target with the specified measure type, as a DataFrame with
+        the columns target, sample, sample_key (lower case sample ID), replicate, ct, outlier, siteID, plateID and
+        standardCurveID. Only the first num_replicates of each sample/target are returned (same as in the main sheet).
+        The categorical columns of df (see QPCRPopulator.get_qpcr_df_schema) are returned as plain object columns.
+        """
+        inp = self.config.input
+        data = df[df[inp.measure_type_col] == measure_type]
+        reps = pd.DataFrame({
+            "target" : data[inp.target_col],
+            "sample" : data[inp.sample_id_col],
+            "sample_key" : data[inp.sample_id_col].str.lower(),
+            "ct" : pd.to_numeric(data[inp.ct_col], errors="coerce"),
+            "outlier" : pd.to_numeric(data[OUTLIER_COL], errors="coerce") if OUTLIER_COL in data.columns else np.nan,
+            "siteID" : data[inp.site_id_col].astype(object) if inp.site_id_col in data.columns else None,
+            "plateID" : data[inp.plate_id_col].astype(object),
+            "standardCurveID" : data[inp.standard_curve_id_col] if inp.standard_curve_id_col in data.columns else None,
+        })
+        reps["target_key"] = reps["target"].str.lower()
+        reps["replicate"] = reps.groupby(["target_key", "sample_key"], sort=False).cumcount()
+        return reps[reps["replicate"] < self.num_replicates].reset_index(drop=True)
+
+    def get_main_samples(self, reps):
+        """Get the samples that have a row in the main sheet (ie. that have replicates of a main target), as a DataFrame
+        with the columns sample_key, sample and siteID.
+        """
+        main_reps = reps[self.get_targets_filter(reps, self.get_main_targets()).to_numpy()]
+        return main_reps.drop_duplicates("sample_key")[["sample_key", "sample", "siteID"]].reset_index(drop=True)
+
+    def get_main_rows(self, reps, targets=None):
+        """Get the rows of the main sheet (ie. each main target in input.main_targets and each sample with replicates of that target),
+        as a DataFrame with the columns target, target_key, sample and sample_key. If targets is not empty then only the rows of
+        those targets are returned.
+        """
+        main_reps = reps[self.get_targets_filter(reps, self.config.input.get("main_targets", None) or []).to_numpy()]
+        if targets:
+            main_reps = main_reps[self.get_targets_filter(main_reps, targets).to_numpy()]
+        return main_reps.drop_duplicates(["target_key", "sample_key"])[["target", "target_key", "sample", "sample_key"]].reset_index(drop=True)
+
+    def get_replicate_grid(self, reps, samples, targets):
+        """Get all num_replicates replicates of each target for each sample, including those that are not in reps.
+
+        Parameters
+        ----------
+        reps : pd.DataFrame
+            The replicates, from get_replicates.
+        samples : pd.DataFrame
+            The samples, with at least the columns sample_key and sample.
+        targets : list[str]
+            The targets.
+
+        Returns
+        -------
+        pd.DataFrame
+            The replicates, with the same columns as reps (the sample columns are from samples) and the additional column
+            "found", which is False for replicates that are not in reps.
+        """
+        grid = pd.DataFrame({
+            "target" : np.repeat(list(targets), len(samples.index) * self.num_replicates),
+            "sample_key" : np.tile(np.repeat(samples["sample_key"].to_numpy(), self.num_replicates), len(targets)),
+            "replicate" : np.tile(np.arange(self.num_replicates), len(samples.index) * len(targets)),
+        })
+        grid["target_key"] = grid["target"].str.lower()
+        grid = grid.merge(samples, how="left", on="sample_key")
+        reps = reps.drop(columns=["target"] + [c for c in samples.columns if c != "sample_key"])
+        grid = grid.merge(reps, how="left", on=["target_key", "sample_key", "replicate"], indicator=True)
+        grid["found"] = grid["_merge"] == "both"
+        return grid.drop(columns=["_merge"])
+
+    def get_average_ct(self, reps):
+        """Get the average Ct of each sample and target, as a DataFrame indexed by (target_key, sample_key).
+        """
+        return reps.groupby(["target_key", "sample_key"], sort=False).agg(
+            target=("target", "first"), sample=("sample", "first"), siteID=("siteID", "first"), ct=("ct", "mean"))
+
+    def get_copies(self, reps, curves):
+        """Get the copies per well of each replicate, using the replicate's standard curve. NaN is returned for
+        non-detects and replicates without a standard curve.
+        """
+        slopes = reps["standardCurveID"].map(lambda c: (curves.get(c) or {}).get("slope", np.nan)).astype(float)
+        intercepts = reps["standardCurveID"].map(lambda c: (curves.get(c) or {}).get("intercept", np.nan)).astype(float)
+        return 10**((reps["ct"] - intercepts) / slopes)
+
+    def fit_standard_curves(self, df):
+        """Fit the standard curves of all standards in df, the same way that QPCRPopulator.create_calibration does.
+
+        Returns
+        -------
+        dict
+            The curves, as {standard_curve_id : curve}.
+        """
+        inp = self.config.input
+        std_data = df[df[inp.measure_type_col] == inp.measure_type_std].sort_values(inp.index_col)
+        curves = {}
+        # Plate IDs are categorical, and groupby with observed=True keeps the categories in order of appearance, so sort explicitly
+        for (target, plate_id), plate_df in sorted(std_data.groupby([inp.target_col, inp.plate_id_col], observed=True), key=lambda group: group[0]):
+            sample_keys = plate_df[inp.sample_id_col].str.lower()
+            cal_logsq, cal_ct = [], []
+            for sample_key in plate_df.sort_values(inp.sq_col, ascending=False)[inp.sample_id_col].str.lower().unique():
+                cur_data = plate_df[sample_keys == sample_key].iloc[:inp.slope_and_intercept_replicates]
+                ct = pd.to_numeric(cur_data[inp.ct_col], errors="coerce")
+                if OUTLIER_COL in cur_data.columns:
+                    ct = ct[cur_data[OUTLIER_COL].isna()]
+                logsq = math.log10(cur_data[inp.sq_col].iloc[0])
+                cal_logsq.extend([logsq] * len(ct.index))
+                cal_ct.extend(ct.tolist())
+            if len(cal_ct) < 2:
+                continue
+            curve = fit_standard_curve(cal_logsq, cal_ct, inp.get("calibration_multi", None))
+            curve.update({ f"avg_std_{idx}" : ct for idx, ct in enumerate(cal_ct) })
+            curve.update({ "target" : target, "plateID" : plate_id })
+            curves[plate_df[inp.standard_curve_id_col].iloc[0]] = curve
+        return curves
+
+    def get_curves_by_target(self, curves, target):
+        return [(curve_id, curve) for curve_id, curve in curves.items() if str(curve.get("target", "")).lower() == target.strip().lower()]
+
+    def check_ntc(self, df, full_df):
+        """NTCs (and extraction blanks) must have a Ct above the maximum unknown Ct of the same target on the plate plus
+        delta_from_max_ct (see QPCRQAQC.qaqc_run_ntc).
+        """
+        if "ntcs" not in self.qaqc_config:
+            return None
+        inp = self.config.input
+        plate_index = self.get_plate_index(full_df)
+        plates = df[inp.plate_id_col].unique()
+        results = []
+        for ntc_info in self.qaqc_config.ntcs:
+            measure_type = ntc_info.measure_type
+            if isinstance(measure_type, str):
+                measure_type = [measure_type]
+            ntc_samples = plate_index.get_rows(plates, measure_type)
+            targets = [g.strip() for g in ntc_info.targets]
+            if len(targets) == 0:
+                targets = ntc_samples[inp.target_col].unique()
+            for target in targets:
+                ntcs = ntc_samples[ntc_samples[inp.target_col].fillna("").str.strip().str.lower() == target.lower()]
+                if len(ntcs.index) == 0:
+                    continue
+                keys = list(zip(ntcs[inp.target_col].str.strip().str.lower(), ntcs[inp.plate_id_col].str.strip().str.lower().fillna("")))
+                lower = np.array([plate_index.get_max_ct(*key) for key in keys], dtype=float) + ntc_info.delta_from_max_ct
+                if ntc_info.ct_range[0] is not None:
+                    lower = np.where(np.isnan(lower), lower, np.minimum(lower, ntc_info.ct_range[0]))
+                upper = ntc_info.ct_range[1]
+                values = pd.DataFrame({
+                    "target" : ntcs[inp.target_col].str.strip(),
+                    "sample" : ntcs[inp.sample_id_col].fillna("").str.strip(),
+                    "value" : pd.to_numeric(ntcs[inp.ct_col], errors="coerce"),
+                })
+                status = self.get_status(values["value"], lower, upper, accept_blanks=True)
+                results.append(self.make_results(ntc_info, values, status, lower, upper))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def check_sample_data_available(self, df, main_columns=None):
+        """The sample date of each row of the main sheet must be available (ie. the sample is in the samples log), and must not
+        be any of not_available_matches.
+        """
+        samples_info = self.qaqc_config.get("sample_data_available", None)
+        if samples_info is None:
+            return None
+        inp = self.config.input
+        columns = samples_info.columns
+        if isinstance(columns, str):
+            columns = [columns]
+        columns = [c for c in columns if main_columns is None or c in main_columns]
+        if len(columns) == 0:
+            return None
+        rows = self.get_main_rows(self.get_replicates(df, inp.measure_type_unknown), samples_info.get("targets", None))
+        data = df[df[inp.measure_type_col] == inp.measure_type_unknown]
+        data = data.set_axis(pd.MultiIndex.from_arrays([data[inp.target_col].str.lower(), data[inp.sample_id_col].str.lower()]), axis=0)
+        data = data[~data.index.duplicated()]
+        values = pd.DataFrame({
+            "target" : [self.get_column_target(columns[0], t) for t in rows["target"]],
+            "sample" : rows["sample"],
+            "value" : data[inp.sample_date_col].reindex(pd.MultiIndex.from_arrays([rows["target_key"], rows["sample_key"]])).to_numpy(),
+        })
+        matches = [str(m) for m in samples_info.not_available_matches]
+        available = values["value"].notna() & ~values["value"].astype(str).isin(matches)
+        status = np.where(available, STATUS_PASS, STATUS_FAIL)
+        return self.make_results(samples_info, values, status)
+
+    def check_standard_curves(self, curves):
+        """The slope, intercept and R-sq of each standard curve, and the average Ct of each standard, must be in range.
+        """
+        if "curves" not in self.qaqc_config.get("standard_curves", {}):
+            return None
+        rows = []
+        for curve_info in self.qaqc_config.standard_curves.curves:
+            for target in curve_info.targets:
+                for curve_id, curve in self.get_curves_by_target(curves, target):
+                    params = []
+                    for id in ["rsq", "slope", "intercept"]:
+                        if f"{id}_range" in curve_info:
+                            params.append((curve_info[f"{id}_description"], curve_info[f"{id}_priority"], id, curve_info[f"{id}_range"]))
+                    for num, rng in enumerate(curve_info.get("average_replicates_range", None) or []):
+                        params.append((curve_info.replicates_description.replace("{std_num}", str(num+1)), curve_info.replicates_priority, f"avg_std_{num}", rng))
+                    for desc, priority, id, rng in params:
+                        rows.append({
+                            "category" : curve_info.category.format(target=target),
+                            "description" : desc.format(target=target),
+                            "priority" : priority,
+                            "target" : target,
+                            "sample" : curve_id,
+                            "replicate" : id,
+                            "value" : curve.get(id, np.nan),
+                            "lower" : rng[0] if rng is not None else None,
+                            "upper" : rng[1] if rng is not None else None,
+                        })
+        results = pd.DataFrame(rows, columns=["category", "description", "priority", "target", "sample", "replicate", "value", "lower", "upper"])
+        results["status"] = self.get_status(results["value"], results["lower"], results["upper"])
+        return results
+
+    def check_standard_curve_comparisons(self, curves):
+        """The average Ct of each standard must be comparable between the curves of two targets (on the same plate if possible,
+        see QPCRPopulator.get_all_paired_cal_sheets).
+        """
+        if "inter_comparisons" not in self.qaqc_config.get("standard_curves", {}):
+            return None
+        rows = []
+        for comp in self.qaqc_config.standard_curves.inter_comparisons:
+            target_a, target_b = comp.targets
+            curves_a = self.get_curves_by_target(curves, target_a)
+            curves_b = self.get_curves_by_target(curves, target_b)
+            if len(curves_a) == 0 or len(curves_b) == 0:
+                continue
+            for idx_a, (curve_id_a, curve_a) in enumerate(curves_a):
+                matches = [c for c in curves_b if c[1].get("plateID") == curve_a.get("plateID")]
+                curve_id_b, curve_b = matches[0] if len(matches) > 0 else curves_b[min(idx_a, len(curves_b)-1)]
+                # A YAML list without commas is loaded as a single string (eg. [ "0.6 0.6 1.0" ])
+                abs_diff_maxes = [float(v) for item in comp.abs_diff_max for v in str(item).split()]
+                for num, abs_diff_max in enumerate(abs_diff_maxes):
+                    format_vars = { "target_a" : target_a, "target_b" : target_b, "std_num" : num+1 }
+                    rows.append({
+                        "category" : comp.category.format(**format_vars),
+                        "description" : comp.description.format(**format_vars),
+                        "priority" : comp.priority,
+                        "target" : ",".join(comp.targets),
+                        "sample" : f"{curve_id_a},{curve_id_b}",
+                        "replicate" : f"avg_std_{num}",
+                        "value" : abs(curve_a.get(f"avg_std_{num}", np.nan) - curve_b.get(f"avg_std_{num}", np.nan)),
+                        "lower" : None,
+                        "upper" : abs_diff_max,
+                    })
+        results = pd.DataFrame(rows, columns=["category", "description", "priority", "target", "sample", "replicate", "value", "lower", "upper"])
+        results["status"] = self.get_status(results["value"], results["lower"], results["upper"])
+        return results
+
+    def get_standard_ct_limits(self, df):
+        """Get the average Ct of the first and last standards (ie. the largest and smallest SQ) of each standard curve, the
+        same as the avg_std cells of the calibration sheets. The averages are of the first num_replicates replicates of each
+        standard, and are NaN if the standard has no Ct values.
+
+        Returns
+        -------
+        dict
+            The limits, as {standard_curve_id : (first average Ct, last average Ct)}.
+        """
+        inp = self.config.input
+        reps = self.get_replicates(df, inp.measure_type_std)
+        avg = self.get_average_ct(reps)["ct"]
+        std_data = df[df[inp.measure_type_col] == inp.measure_type_std].sort_values(inp.index_col).sort_values(inp.sq_col, ascending=False)
+        limits = {}
+        for curve_id, curve_df in std_data.groupby(inp.standard_curve_id_col, sort=False):
+            target_key = curve_df[inp.target_col].iloc[0].lower()
+            sample_keys = curve_df[inp.sample_id_col].str.lower().unique()
+            limits[curve_id] = (avg.get((target_key, sample_keys[0]), np.nan), avg.get((target_key, sample_keys[-1]), np.nan))
+        return limits
+
+    def check_samples_within_standard_curves(self, df, curves, main_columns=None):
+        """The Ct of each replicate in the main sheet must be within the average Cts of the first and last standards of the
+        replicate's standard curve. Outliers pass, and non-detects fail. The normalizer replicates of each row are also checked
+        (normalizer_columns in the QAQC config).
+        """
+        cal_infos = (self.qaqc_config.get("standard_curves", None) or {}).get("samples_within_calibration_curve", None)
+        if cal_infos is None:
+            return None
+        inp = self.config.input
+        reps = self.get_replicates(df, inp.measure_type_unknown)
+        limits = self.get_standard_ct_limits(df)
+        normalizing_targets = inp.get("normalizing_targets", None) or []
+        results = []
+        for cal_info in cal_infos:
+            rows = self.get_main_rows(reps, cal_info.get("targets", None))
+            check_columns = [(column, None) for column in cal_info.columns]
+            norm_target = normalizing_targets[0] if len(normalizing_targets) > 0 else cal_info.get("normalizer_target", None)
+            if norm_target is not None:
+                check_columns.extend([(column, norm_target) for column in cal_info.get("normalizer_columns", None) or []])
+            for column, data_target in check_columns:
+                if main_columns is not None and column not in main_columns:
+                    continue
+                if data_target is None:
+                    targets = [self.get_column_target(column, t) for t in rows["target"]]
+                    data_targets = targets
+                else:
+                    targets = [self.get_column_target(column, cal_info.normalizer_target)] * len(rows.index)
+                    data_targets = [data_target] * len(rows.index)
+                target_keys = np.asarray([t.lower() for t in data_targets], dtype=object)
+                curve_ids = self.get_sample_values(df, target_keys, rows["sample_key"].to_numpy())["standardCurveID"].to_numpy()
+                grid = pd.DataFrame({
+                    "target" : np.repeat(targets, self.num_replicates),
+                    "target_key" : np.repeat(target_keys, self.num_replicates),
+                    "sample" : np.repeat(rows["sample"].to_numpy(), self.num_replicates),
+                    "sample_key" : np.repeat(rows["sample_key"].to_numpy(), self.num_replicates),
+                    "replicate" : np.tile(np.arange(self.num_replicates), len(rows.index)),
+                    "standardCurveID" : np.repeat(curve_ids, self.num_replicates),
+                })
+                grid = grid.merge(reps[["target_key", "sample_key", "replicate", "ct", "outlier"]], how="left", on=["target_key", "sample_key", "replicate"], indicator=True)
+                # Replicates without a standard curve in the calibration sheets are not checked
+                grid = grid[(grid["_merge"] == "both") & grid["standardCurveID"].isin(list(limits.keys()))].reset_index(drop=True)
+                lower = grid["standardCurveID"].map(lambda c: limits[c][0]).to_numpy(dtype=float)
+                upper = grid["standardCurveID"].map(lambda c: limits[c][1]).to_numpy(dtype=float)
+                grid["value"] = grid["ct"]
+                status = self.get_status(grid["value"], lower, upper, accept_blanks=False)
+                # The limits are errors if a standard has no Ct values, which fails
+                status = np.where(np.isnan(lower) | np.isnan(upper), STATUS_FAIL, status)
+                status = np.where(grid["ct"].isna() & grid["outlier"].notna(), STATUS_PASS, status)
+                results.append(self.make_results(cal_info, grid, status, lower, upper))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def check_loq(self, df, curves):
+        """The copies per well of each unknown replicate must be above the limit of quantification.
+        """
+        if "loq" not in self.qaqc_config:
+            return None
+        reps = self.get_replicates(df, self.config.input.measure_type_unknown)
+        results = []
+        for loq_config in self.qaqc_config.loq:
+            values = reps[self.get_targets_filter(reps, loq_config.targets).to_numpy()].copy()
+            values["value"] = self.get_copies(values, curves)
+            rng = loq_config.copies_per_well_range
+            status = self.get_status(values["value"], rng[0], rng[1], accept_blanks=True)
+            # A Ct without a standard curve can not be converted to copies
+            status = np.where(values["value"].isna() & values["ct"].notna(), STATUS_MISSING, status)
+            results.append(self.make_results(loq_config, values, status, rng[0], rng[1]))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def check_inhibition(self, df):
+        """The Delta Ct between the average Cts of two inhibition targets (eg. PMMoV 1/10 dilution vs full) of each sample in
+        the main sheet must be in range.
+        """
+        if "inhibitions" not in self.qaqc_config:
+            return None
+        inhibition_targets = self.config.input.get("inhibition_targets", None) or []
+        reps = self.get_replicates(df, self.config.input.measure_type_unknown)
+        avg = self.get_average_ct(reps)["ct"]
+        samples = self.get_main_samples(reps)
+        results = []
+        for inhibition in self.qaqc_config.inhibitions:
+            columns = inhibition.columns
+            if isinstance(columns, str):
+                columns = [columns]
+            for column in columns:
+                res = INHIBITION_DCT_REGEX.search(column)
+                if res is None:
+                    print(f"WARNING: Unrecognized inhibition column '{column}' in QAQC config, must be in the format '*_inhibition_b_a_dct'")
+                    continue
+                idx_b, idx_a = column_index_from_string(res[1].upper())-1, column_index_from_string(res[2].upper())-1
+                if max(idx_a, idx_b) >= len(inhibition_targets):
+                    continue
+                target_b, target_a = inhibition_targets[idx_b], inhibition_targets[idx_a]
+                ct_a = avg.reindex(pd.MultiIndex.from_product([[target_a.lower()], samples["sample_key"]])).to_numpy()
+                ct_b = avg.reindex(pd.MultiIndex.from_product([[target_b.lower()], samples["sample_key"]])).to_numpy()
+                values = pd.DataFrame({
+                    "target" : f"{target_b},{target_a}",
+                    "sample" : samples["sample"],
+                    "value" : ct_b - ct_a,
+                })
+                rng = inhibition.range
+                status = self.get_status(values["value"], rng[0], rng[1], accept_blanks=inhibition.get("accept_blanks", True))
+                results.append(self.make_results(inhibition, values, status, rng[0], rng[1], range=rng))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def check_normalizer(self, df):
+        """The Ct of each normalizer replicate of each sample in the main sheet must be in the range for the sample's site.
+        """
+        normalizer_info = self.qaqc_config.get("normalizer_ct_range", None)
+        if normalizer_info is None:
+            return None
+        normalizing_targets = self.config.input.get("normalizing_targets", None) or [normalizer_info.target]
+        reps = self.get_replicates(df, self.config.input.measure_type_unknown)
+        samples = self.get_main_samples(reps)
+        samples["siteID"] = samples["siteID"].fillna("").replace("", "<default>")
+        samples = samples[samples["siteID"].isin(list(normalizer_info.ranges.keys()))]
+        values = self.get_replicate_grid(reps, samples, normalizing_targets[:1])
+        values["value"] = values["ct"]
+        lower = values["siteID"].map(lambda s: normalizer_info.ranges[s][0]).to_numpy()
+        upper = values["siteID"].map(lambda s: normalizer_info.ranges[s][1]).to_numpy()
+        # Non-detects and missing replicates do not validate, since the main sheet shows them as <ND> and <MISSING>
+        status = self.get_status(values["value"], lower, upper, accept_blanks=False)
+        return self.make_results(normalizer_info, values, status, lower, upper, target=normalizer_info.target, site=values["siteID"].to_numpy())
+
+    def check_comparable_targets(self, df):
+        """The average Ct of two targets (eg. covN1 and covN2) of each sample must be comparable. The maximum absolute
+        difference depends on the average Cts (see comparable_targets.ranges in the QAQC config).
+        """
+        if "comparable_targets" not in self.qaqc_config:
+            return None
+        avg = self.get_average_ct(self.get_replicates(df, self.config.input.measure_type_unknown))
+        results = []
+        for comp_info in self.qaqc_config.comparable_targets:
+            target_a, target_b = [t.strip() for t in comp_info.targets[:2]]
+            avg_a = avg.xs(target_a.lower(), level="target_key") if target_a.lower() in avg.index.get_level_values("target_key") else avg.iloc[0:0].droplevel(0)
+            avg_b = avg["ct"].xs(target_b.lower(), level="target_key") if target_b.lower() in avg.index.get_level_values("target_key") else pd.Series(dtype=float)
+            avg_a = avg_a[avg_a.index.isin(avg_b.index)]
+            ct_a = avg_a["ct"].to_numpy()
+            ct_b = avg_b.reindex(avg_a.index).to_numpy()
+
+            # The maximum difference is from the first range where all (or one) of the Cts are within ct_range_filter
+            upper = np.full(len(ct_a), np.nan)
+            for rng in reversed(comp_info.ranges):
+                lower_limit, upper_limit = rng.ct_range_filter
+                in_range = []
+                for ct in [ct_a, ct_b]:
+                    with np.errstate(invalid="ignore"):
+                        cur_in_range = np.ones(len(ct), dtype=bool)
+                        if lower_limit is not None:
+                            cur_in_range &= ct > lower_limit
+                        if upper_limit is not None:
+                            cur_in_range &= ct <= upper_limit
+                    in_range.append(cur_in_range)
+                matched = (in_range[0] & in_range[1]) if rng.requires == "all" else (in_range[0] | in_range[1])
+                upper = np.where(matched, rng.abs_diff_max, upper)
+
+            values = pd.DataFrame({
+                "target" : avg_a["target"].to_numpy(),
+                "sample" : avg_a["sample"].to_numpy(),
+                "value" : np.abs(ct_a - ct_b),
+            })
+            status = self.get_status(values["value"], None, upper)
+            # No range for the Cts, so the difference can not be validated
+            status = np.where(np.isnan(upper) & (status == STATUS_PASS), STATUS_FAIL, status)
+            results.append(self.make_results(comp_info, values, status, None, upper, target_a=target_a, target_b=target_b))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def get_column_target(self, column, row_target):
+        """Get the target of a main sheet column, from column_targets in the QAQC config (see QPCRQAQC.get_qaqc_target_for_column).
+        If the column is not in column_targets then the row's target is used.
+        """
+        for target, columns in (self.qaqc_config.get("column_targets", None) or {}).items():
+            if column in columns:
+                return target
+        return row_target
+
+    def get_sample_values(self, df, target_keys, sample_keys):
+        """Get the sample values (eg. the extracted mass) shown in the main sheet for each target and sample, as a DataFrame
+        with the columns SAMPLE_VALUE_COLUMNS and standardCurveID (from the first unknown of the target and sample, the same
+        as in QPCRPopulator.get_row_data_for_target). The values are numeric, with NaN for blanks.
+        """
+        inp = self.config.input
+        data = df[df[inp.measure_type_col] == inp.measure_type_unknown]
+        data = data.set_axis(pd.MultiIndex.from_arrays([data[inp.target_col].str.lower(), data[inp.sample_id_col].str.lower()]), axis=0)
+        data = data[~data.index.duplicated()].reindex(pd.MultiIndex.from_arrays([target_keys, sample_keys]))
+        values = pd.DataFrame({ col : pd.to_numeric(data[col], errors="coerce") if col in data.columns else np.nan for col in SAMPLE_VALUE_COLUMNS })
+        values[inp.sample_short_description_col] = data[inp.sample_short_description_col].astype(object) if inp.sample_short_description_col in data.columns else None
+        values["standardCurveID"] = data[inp.standard_curve_id_col].astype(object) if inp.standard_curve_id_col in data.columns else None
+        return values.reset_index(drop=True)
+
+    def get_copies_grid(self, reps, curves, target_keys, sample_keys, curve_ids):
+        """Get the copies per well of the first num_replicates replicates of each target and sample, as an array with one row per
+        target/sample and one column per replicate. NaN is returned for non-detects, outliers and missing replicates. Each
+        target/sample uses a single standard curve (curve_ids), the same as in the main sheet.
+
+        Returns
+        -------
+        copies : np.ndarray
+            The copies per well.
+        errors : np.ndarray
+            True for Ct values that have no standard curve (errors in the main sheet).
+        """
+        grid = pd.DataFrame({
+            "target_key" : np.repeat(np.asarray(target_keys, dtype=object), self.num_replicates),
+            "sample_key" : np.repeat(np.asarray(sample_keys, dtype=object), self.num_replicates),
+            "replicate" : np.tile(np.arange(self.num_replicates), len(sample_keys)),
+        })
+        ct = grid.merge(reps[["target_key", "sample_key", "replicate", "ct"]], how="left", on=["target_key", "sample_key", "replicate"])["ct"].to_numpy(dtype=float)
+        slopes = np.repeat([(curves.get(c) or {}).get("slope", np.nan) for c in curve_ids], self.num_replicates).astype(float)
+        intercepts = np.repeat([(curves.get(c) or {}).get("intercept", np.nan) for c in curve_ids], self.num_replicates).astype(float)
+        with np.errstate(all="ignore"):
+            copies = 10**((ct - intercepts) / slopes)
+        errors = ~np.isnan(ct) & np.isnan(copies)
+        shape = (len(sample_keys), self.num_replicates)
+        return np.where(errors, np.nan, copies).reshape(shape), errors.reshape(shape)
+
+    def get_method_values(self, methods, targets, column):
+        """Get a column of the method (see QPCRMethods.get_row_for_target) of each target, with NaN for unknown targets.
+        """
+        values = []
+        for target in targets:
+            row = methods.get_row_for_target(target)
+            values.append(np.nan if row is None else pd.to_numeric(row.get(column, np.nan), errors="coerce"))
+        return np.asarray(values, dtype=float)
+
+    def get_main_copies_values(self, df, curves, methods, unit, rows, targets):
+        """Calculate the values of a copies per extracted mass, per L or per copies of the normalizer column of the main sheet,
+        the same way as the main_col_copies_per_* formulas of qpcr_template_long-2main-inh.xlsx. The total volume of the sample
+        types in qaqc_table.fixed_total_volumes of the populator config is taken from the config instead of from the sample. Excel
+        errors are kept apart from blanks, since they change the outcome of the copies outliers check.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The QPCR data.
+        curves : dict
+            The standard curves (see run).
+        methods : QPCRMethods
+            The methods, for the dilution factors, template volumes and elution volumes.
+        unit : str
+            "mass", "volume" or "copies".
+        rows : pd.DataFrame
+            The main sheet rows, with the columns target_key and sample_key. The sample values are from the row's target.
+        targets : list[str]
+            The target of the column of each row. The copies and the method are from this target.
+
+        Returns
+        -------
+        values : np.ndarray
+            The values, with one row per main sheet row and one column per replicate. NaN for blanks and errors.
+        errors : np.ndarray
+            True for values that are Excel errors (eg. #DIV/0! for a settled solids of 0).
+        """
+        inp = self.config.input
+        reps = self.get_replicates(df, inp.measure_type_unknown)
+        target_keys = np.asarray([t.lower() for t in targets], dtype=object)
+        sample_keys = rows["sample_key"].to_numpy()
+        samples = self.get_sample_values(df, rows["target_key"].to_numpy(), sample_keys)
+        curve_ids = self.get_sample_values(df, target_keys, sample_keys)["standardCurveID"]
+        copies, _ = self.get_copies_grid(reps, curves, target_keys, sample_keys, curve_ids)
+
+        extracted_mass = samples["extractedMass"].to_numpy()[:, None]
+        pellet_mass = (samples["totalTubeMass"] - samples["emptyTubeMass"]).to_numpy()[:, None]
+        settled_solids = samples["settledSolids"].to_numpy()[:, None]
+        fixed_total_volumes = (self.config.get("qaqc_table", None) or {}).get("fixed_total_volumes", None) or {}
+        total_volume = samples[inp.sample_short_description_col].map(fixed_total_volumes).astype(float).fillna(samples["totalVolume"]).to_numpy()[:, None]
+        dilution = self.get_method_values(methods, targets, DILUTION_FACTOR_COLUMN)[:, None]
+        template_volume = self.get_method_values(methods, targets, "templateVolume")[:, None]
+        elution_volume = self.get_method_values(methods, targets, "elutionVolume")[:, None]
+
+        with np.errstate(all="ignore"):
+            # Copies per extracted mass (blank if there is no extracted mass)
+            to_mass = dilution / template_volume * elution_volume / extracted_mass
+            has_mass = ~np.isnan(copies) & ~np.isnan(extracted_mass)
+            errors = has_mass & ~np.isfinite(to_mass)
+            values = np.where(has_mass & ~errors, copies * to_mass, np.nan)
+
+            # Copies per L (an error if the pellet mass, settled solids or total volume is blank)
+            to_volume = pellet_mass / settled_solids * settled_solids / total_volume * 1000
+            if unit in ["volume", "copies"]:
+                has_volume = ~np.isnan(values)
+                errors = has_volume & ~np.isfinite(to_volume)
+                values = np.where(has_volume & ~errors, values * to_volume, np.nan)
+
+            # Copies per copies of the normalizer per L (blank if the normalizer has no copies)
+            if unit == "copies":
+                normalizing_targets = inp.get("normalizing_targets", None) or []
+                if len(normalizing_targets) == 0:
+                    return np.full(values.shape, np.nan), np.zeros(values.shape, dtype=bool)
+                norm_target = normalizing_targets[0]
+                norm_keys = np.full(len(sample_keys), norm_target.lower(), dtype=object)
+                norm_curve_ids = self.get_sample_values(df, norm_keys, sample_keys)["standardCurveID"]
+                norm_copies, norm_errors = self.get_copies_grid(reps, curves, norm_keys, sample_keys, norm_curve_ids)
+                # The average is an error if any copies are errors
+                norm_avg = np.where(norm_errors.any(axis=1) | np.isnan(norm_copies).all(axis=1), np.nan, np.nanmean(np.where(norm_errors, 0, norm_copies), axis=1))
+                norm_avg = norm_avg[:, None] * self.get_method_values(methods, [norm_target], DILUTION_FACTOR_COLUMN)[0]
+                norm_per_mass = norm_avg / self.get_method_values(methods, [norm_target], "templateVolume")[0] * self.get_method_values(methods, [norm_target], "elutionVolume")[0] / extracted_mass
+                norm_per_volume = np.where(np.isfinite(norm_per_mass), norm_per_mass * to_volume, np.nan)
+                has_copies = ~np.isnan(values) & np.isfinite(norm_per_volume)
+                errors = has_copies & (norm_per_volume == 0)
+                values = np.where(has_copies & ~errors, values / norm_per_volume, np.nan)
+
+        return values, errors
+
+    def check_copies_outliers(self, df, curves, methods, main_columns=None):
+        """The value of each replicate in a copies column of the main sheet (eg. copies per extracted mass) must be within
+        num_stdev standard deviations of the average of the replicates in the same row and column.
+
+        Each row of the main sheet (ie. each main target and sample) is checked, for each column in the QAQC config. The same
+        as in the QAQC sheets, all values of a row pass if any of its values are errors or if it has no values, and a value
+        fails if it is the only value in its row (since the standard deviation is blank). Blank values pass. The values of the
+        columns that are not in qaqc_table.copies_columns of the populator config are not calculated, and have the status
+        STATUS_UNSUPPORTED.
+        """
+        if "copies_outliers" not in self.qaqc_config:
+            return None
+        if methods is None:
+            print("WARNING: No methods passed to the QAQC table, can not calculate the copies outliers")
+            return None
+        rows = self.get_main_rows(self.get_replicates(df, self.config.input.measure_type_unknown))
+        supported_columns = (self.config.get("qaqc_table", None) or {}).get("copies_columns", None) or []
+        results = []
+        for info in self.qaqc_config.copies_outliers:
+            if info.get("use_cal_sheets", False):
+                print(f"WARNING: Copies outliers of the calibration sheets are not supported by the QAQC table ({info.description})")
+                continue
+            columns = info.columns
+            if isinstance(columns, str):
+                columns = [columns]
+            for column in columns:
+                if main_columns is not None and column not in main_columns:
+                    continue
+                res = COPIES_COLUMN_REGEX.search(column)
+                if res is None:
+                    print(f"WARNING: Unrecognized copies outliers column '{column}' in QAQC config, must be in the format '*_copies_per_mass', '*_copies_per_volume' or '*_copies_per_copies'")
+                    continue
+                targets = [self.get_column_target(column, t) for t in rows["target"]]
+                if column not in supported_columns:
+                    print(f"WARNING: The formulas of the main sheet column '{column}' are not calculated by the QAQC table (see qaqc_table.copies_columns in the populator config), the copies outliers are marked as '{STATUS_UNSUPPORTED}'")
+                    cur_values = pd.DataFrame({
+                        "target" : np.repeat(targets, self.num_replicates),
+                        "sample" : np.repeat(rows["sample"].to_numpy(), self.num_replicates),
+                        "replicate" : np.tile(np.arange(self.num_replicates), len(rows.index)),
+                        "value" : np.nan,
+                    })
+                    results.append(self.make_results(info, cur_values, np.full(len(cur_values.index), STATUS_UNSUPPORTED)))
+                    continue
+                values, errors = self.get_main_copies_values(df, curves, methods, res[1].lower(), rows, targets)
+                num_values = (~np.isnan(values)).sum(axis=1)
+                with np.errstate(all="ignore"), warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    avg = np.nanmean(values, axis=1)
+                    stdev = np.nanstd(values, axis=1, ddof=1)
+                # The limits are errors (which validates) if any value is an error or there are no values, and are blank
+                # (which fails) if there is a single value
+                has_limits = ~errors.any(axis=1) & (num_values >= 2)
+                lower = np.repeat(np.where(has_limits, avg - info.num_stdev * stdev, np.nan), self.num_replicates)
+                upper = np.repeat(np.where(has_limits, avg + info.num_stdev * stdev, np.nan), self.num_replicates)
+                cur_values = pd.DataFrame({
+                    "target" : np.repeat(targets, self.num_replicates),
+                    "sample" : np.repeat(rows["sample"].to_numpy(), self.num_replicates),
+                    "replicate" : np.tile(np.arange(self.num_replicates), len(rows.index)),
+                    "value" : values.flatten(),
+                })
+                status = self.get_status(cur_values["value"], lower, upper, accept_blanks=True)
+                single = np.repeat(~errors.any(axis=1) & (num_values == 1), self.num_replicates)
+                status = np.where(single & cur_values["value"].notna(), STATUS_FAIL, status)
+                results.append(self.make_results(info, cur_values, status, lower, upper))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+    def check_non_detects(self, df):
+        """All replicates (up to num_replicates) of each sample must have a Ct value (unless it is an outlier).
+        """
+        if "non_detects" not in self.qaqc_config:
+            return None
+        inp = self.config.input
+        results = []
+        for non_detect in self.qaqc_config.non_detects:
+            sheets = non_detect.sheets
+            if isinstance(sheets, str):
+                sheets = [sheets]
+            measure_types = [t for sheet, t in [("main", inp.measure_type_unknown), ("cal", inp.measure_type_std)] if sheet in sheets]
+            bad_matches = [str(m) for m in non_detect.get("bad_matches", None) or []]
+            good_matches = non_detect.get("good_matches", None)
+            for measure_type in measure_types:
+                reps = self.get_replicates(df, measure_type)
+                reps = reps[self.get_targets_filter(reps, non_detect.get("targets", [])).to_numpy()]
+                if len(reps.index) == 0:
+                    continue
+                if measure_type == inp.measure_type_unknown:
+                    # Each main sheet row shows the replicates of all targets
+                    full = self.get_replicate_grid(reps, self.get_main_samples(reps), reps["target"].drop_duplicates().tolist())
+                else:
+                    full = pd.concat([self.get_replicate_grid(cur_reps, cur_reps.drop_duplicates("sample_key")[["sample_key", "sample"]], [target])
+                        for target, cur_reps in reps.groupby("target", sort=False)], ignore_index=True)
+                value = full["ct"].astype(object)
+                value[full["ct"].isna() & full["outlier"].notna()] = full["outlier"].apply(lambda v: f"[{v}]")
+                value[full["ct"].isna() & full["outlier"].isna()] = ND_VALUE
+                value[~full["found"]] = MISSING_VALUE
+                full["value"] = value
+                str_value = value.astype(str)
+                passes = ~str_value.isin(bad_matches)
+                if good_matches is not None:
+                    passes &= str_value.isin([str(m) for m in good_matches])
+                status = np.where(passes, STATUS_PASS, STATUS_FAIL)
+                results.append(self.make_results(non_detect, full, status))
+        return pd.concat(results, ignore_index=True) if len(results) > 0 else None
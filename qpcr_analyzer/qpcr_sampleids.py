@@ -22,21 +22,60 @@ Creates sample IDs in the correct format.
     
     # Result is: ('uo_na.3.03.03.22', 'uo_na.03.03.22')
     sample_id, match_sample_id = sampleids.make_sample_id("uo_na3", "March 3rd, 2022")
+
+    # Vectorized version, returns two pd.Series
+    sample_ids, match_sample_ids = sampleids.make_sample_ids(df["sampleid"], df["date"])
 """
 
 from easydict import EasyDict
 import pandas as pd
+import numpy as np
 import yaml
 import argparse
 from datetime import datetime
+from functools import lru_cache
 import re
 from qpcr_sites import QPCRSites
+from qpcr_utils import factorize_by_type
+
+# Maximum number of (sample ID, date) pairs to remember the formatted sample IDs for
+SAMPLE_ID_CACHE_SIZE = 65536
+
+RERUN_REGEX = re.compile("_r[0-9]*$")
+RERUN_AFTER_NUMBER_REGEX = re.compile("(?<=[0-9])r[0-9]*$")
+UNDERSCORE_BEFORE_NUMBER_REGEX = re.compile("_(?=[0-9])")
+SPACE_OR_DASH_REGEX = re.compile("[ -]")
+DOUBLE_DOT_REGEX = re.compile("\.\.")
+SINGLE_DIGIT_GROUP_REGEX = re.compile("(?<=\.)([0-9])(?=\.|$)")
+LONG_DIGIT_GROUP_REGEX = re.compile("(?<=\.)([0-9]*([0-9][0-9]))(?=\.|$)")
+DOT_BEFORE_LETTER_REGEX = re.compile("\.(?=[A-Za-z])")
+PS_REGEX = re.compile("_ps")
 
 class QPCRSampleIDs(object):
-    def __init__(self, config, sites_config, sites_file):
+    def __init__(self, config, sites_config, sites_file, cache_dir=None):
         with open(config, "r") as f:
             self.config = yaml.safe_load(f)
-        self.sites = QPCRSites(sites_config, sites_file)
+        self.sites = QPCRSites(sites_config, sites_file, cache_dir=cache_dir)
+        self.compile_month_regex()
+        self.make_sample_id_cached = lru_cache(maxsize=SAMPLE_ID_CACHE_SIZE, typed=True)(self.normalize_sample_id)
+
+    def compile_month_regex(self):
+        """Compile all month spellings in month_mapper (in the config) into one regex, so that text months are replaced
+        with a single substitution. Longer spellings are tried first (eg. "April" will match with "April" to get 04,
+        instead of with "Apr" to get "04il"). Creates self.month_regex, where the name of the matching group is
+        "m" followed by the month number (1 to 12) and the spelling index.
+        """
+        months = []
+        for month_num, month_spellings in enumerate(self.config["month_mapper"]):
+            for spelling_num, month in enumerate(month_spellings):
+                months.append((f"m{month_num+1}_{spelling_num}", month))
+        months.sort(key=lambda m: len(m[1]), reverse=True)
+        self.month_regex = re.compile("|".join([f"(?P<{name}>{month})" for name, month in months]), flags=re.IGNORECASE)
+
+    def replace_month(self, match):
+        """Replacement function for self.month_regex, returning the month number followed by a dot (eg. "4." for "April").
+        """
+        return f"{match.lastgroup[1:].split('_')[0]}."
         
     def make_all_sample_ids(self, df, sample_id_col, sample_date_col, *, target_sample_id_col=None, target_match_sample_id_col=None, inplace=True):
         """Convert all sample IDs (with optional dates) in a DataFrame to the correct format, and optionally also set
@@ -61,14 +100,47 @@ class QPCRSampleIDs(object):
         if not inplace:
             df = df.copy()
         target_sample_id_col = target_sample_id_col or sample_id_col
-        df[target_sample_id_col] = df.apply(lambda x: self.make_sample_id(x[sample_id_col], x[sample_date_col] if sample_date_col else None), axis=1)
+        sample_ids, match_sample_ids = self.make_sample_ids(df[sample_id_col], df[sample_date_col] if sample_date_col else None)
+        df[target_sample_id_col] = sample_ids
         if target_match_sample_id_col is not None:
-            df[target_match_sample_id_col] = df[target_sample_id_col].map(lambda x: x[1])
-        df[target_sample_id_col] = df[target_sample_id_col].map(lambda x: x[0])
+            df[target_match_sample_id_col] = match_sample_ids
         return df
 
+    def make_sample_ids(self, sample_ids, sample_dates=None):
+        """Make sample IDs in the correct format for all sample IDs (and optional dates) in a pd.Series. Each distinct
+        (sample ID, date) pair is only formatted once (see make_sample_id).
+
+        Args:
+            sample_ids (pd.Series): The sample IDs to format.
+            sample_dates (pd.Series, optional): The dates of the sample IDs, with the same index as sample_ids. Defaults to None.
+
+        Returns:
+            tuple[pd.Series, pd.Series]: The formatted sample IDs and the match sample IDs, with the same index as sample_ids.
+        """
+        # Sample IDs of different types that are equal (eg. 1, 1.0 and True) are not formatted the same
+        id_codes, id_uniques = factorize_by_type(sample_ids)
+        if sample_dates is None:
+            date_codes, date_uniques = np.zeros(len(id_codes), dtype=int), [None]
+        else:
+            date_codes, date_uniques = factorize_by_type(sample_dates)
+
+        # Format each distinct pair once. Pairs with a missing value (None, NaN, NaT) are formatted one at a time,
+        # since the missing values are not all formatted the same.
+        res = np.empty((len(id_codes), 2), dtype=object)
+        valid = (id_codes >= 0) & (date_codes >= 0)
+        pair_codes, pairs = pd.factorize(id_codes[valid].astype(np.int64) * len(date_uniques) + date_codes[valid])
+        pair_res = np.empty((len(pairs), 2), dtype=object)
+        for idx, pair in enumerate(pairs):
+            pair_res[idx] = self.make_sample_id(id_uniques[pair // len(date_uniques)], date_uniques[pair % len(date_uniques)])
+        res[valid] = pair_res[pair_codes]
+        for pos in np.flatnonzero(~valid):
+            res[pos] = self.make_sample_id(sample_ids.iloc[pos], sample_dates.iloc[pos] if sample_dates is not None else None)
+
+        return pd.Series(res[:, 0], index=sample_ids.index), pd.Series(res[:, 1], index=sample_ids.index)
+
     def make_sample_id(self, sample_id, sample_date):
-        """Make a sample ID, in the correct format, from the specified sample ID and date. The date can be None.
+        """Make a sample ID, in the correct format, from the specified sample ID and date. The date can be None. The
+        results are cached for the last SAMPLE_ID_CACHE_SIZE (sample ID, date) pairs.
 
         Parameters
         ----------
@@ -90,13 +162,22 @@ class QPCRSampleIDs(object):
             this is run #2 of the sample. In the samples log file we would search for uo_na.05.01.22, instead of the other
             format with a 2.
         """
+        try:
+            return self.make_sample_id_cached(sample_id, sample_date)
+        except TypeError:
+            # Unhashable sample ID or date
+            return self.normalize_sample_id(sample_id, sample_date)
+
+    def normalize_sample_id(self, sample_id, sample_date):
+        """Make a sample ID, in the correct format, from the specified sample ID and date, without caching. See make_sample_id.
+        """
         sample_id = str(sample_id).strip().lower()
 
         # Remove any trailing _r (or _r#). These are reruns (ie. samples that were previously run, but had to be rerun due to some error)
         # We'll re-add the _r# at the end.
-        rerun = re.search("_r[0-9]*$", sample_id)
+        rerun = RERUN_REGEX.search(sample_id)
         if rerun is None:
-            rerun = re.search("(?<=[0-9])r[0-9]*$", sample_id)
+            rerun = RERUN_AFTER_NUMBER_REGEX.search(sample_id)
         if rerun:
             rerun = rerun[0]
             sample_id = sample_id[:-len(rerun)]
@@ -104,29 +185,24 @@ class QPCRSampleIDs(object):
                 rerun = f"_{rerun}"
 
         # All numbers should be preceded by a dot, rather than an underscore
-        sample_id = re.sub("_(?=[0-9])", ".", sample_id)
+        sample_id = UNDERSCORE_BEFORE_NUMBER_REGEX.sub(".", sample_id)
         
         #  Replace spaces and dashes with dots
-        sample_id = re.sub("[ -]", ".", sample_id)
+        sample_id = SPACE_OR_DASH_REGEX.sub(".", sample_id)
 
         # Replace text months to integers
-        for month_num, months in enumerate(self.config["month_mapper"]):
-            # Sort by month length, to match longer month first (eg. "April" will match with "April" to get 04,
-            # instead of with "Apr" to get "04il")
-            months.sort(key=len, reverse=True)
-            for month in months:
-                sample_id = re.sub(month, f"{month_num+1}.", sample_id, flags=re.IGNORECASE)
-        sample_id = re.sub("\.\.", ".", sample_id)
+        sample_id = self.month_regex.sub(self.replace_month, sample_id)
+        sample_id = DOUBLE_DOT_REGEX.sub(".", sample_id)
 
         # Number groups are preceded by a dot and trailed by a dot or end of string
         # Add leading 0 to number groups that are 1 character long
-        sample_id = re.sub("(?<=\.)([0-9])(?=\.|$)", "0\\1", sample_id)
+        sample_id = SINGLE_DIGIT_GROUP_REGEX.sub("0\\1", sample_id)
         # Reduce length of number groups down to last 2 digits if longer than 2 digits
-        sample_id = re.sub("(?<=\.)([0-9]*([0-9][0-9]))(?=\.|$)", "\\2", sample_id)
+        sample_id = LONG_DIGIT_GROUP_REGEX.sub("\\2", sample_id)
 
         # All letter groups should be preceded by an underscore (except for PS).
-        sample_id = re.sub("\.(?=[A-Za-z])", "_", sample_id)
-        sample_id = re.sub("_ps", ".ps", sample_id)
+        sample_id = DOT_BEFORE_LETTER_REGEX.sub("_", sample_id)
+        sample_id = PS_REGEX.sub(".ps", sample_id)
 
         # Last numbers should be mm.dd.yy
         comps = sample_id.split(".")
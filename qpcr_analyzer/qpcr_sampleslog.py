@@ -9,6 +9,7 @@
 import yaml
 import cloud_utils
 import pandas as pd
+import numpy as np
 import warnings
 import argparse
 from easydict import EasyDict
@@ -22,14 +23,19 @@ from qpcr_sampleids import QPCRSampleIDs
 from qpcr_utils import (
     QPCRError,
     rename_columns, 
+    load_cached_reference,
+    map_unique,
 )
 
 class QPCRSamplesLog(object):
-    def __init__(self, config, samples_log_file, sampleids_config, sites_config, sites_file):
+    def __init__(self, config, samples_log_file, sampleids_config, sites_config, sites_file, cache_dir=None):
         with open(config, "r") as f:
             self.config = yaml.safe_load(f)
             
-        self.sampleids = QPCRSampleIDs(sampleids_config, sites_config, sites_file)
+        self.sampleids = QPCRSampleIDs(sampleids_config, sites_config, sites_file, cache_dir=cache_dir)
+        self.cache_dir = cache_dir
+        # All files the cleaned samples log depends on (the sample IDs are made with the sample IDs and sites configs)
+        self.cache_source_files = [config, sampleids_config, sites_config, sites_file]
             
         self.samples_log_file = samples_log_file
         self.download_samples_file(samples_log_file)
@@ -80,24 +86,64 @@ class QPCRSamplesLog(object):
         all columns specified in the config file (eg. sampleDate, analysisDate, totalVolume, etc.)
 
         Args:
-            sample_id (str): The sample ID to get the row for.
+            sample_id (str|pd.Series): The sample ID to get the row for. If a pd.Series of sample IDs then
+                get_samples_info is used instead.
 
         Returns:
             pd.Series|None: The row in the samples log file for the specified sample ID. If multiple
                 rows are found then the last one is returned.
         """
-        sample_data = self.sampleslog_df[self.sampleslog_df[self.config["sample_id_col"]] == sample_id]
-        if len(sample_data.index) > 0:
-            return sample_data.iloc[-1]
-        return None
-        
+        if isinstance(sample_id, pd.Series):
+            return self.get_samples_info(sample_id)
+
+        samples_df = self.samples_by_id[self.config["sample_id_col"]]
+        try:
+            if sample_id not in samples_df.index:
+                return None
+        except TypeError:
+            # Unhashable sample ID
+            return None
+        return samples_df.loc[sample_id]
+
+    def get_samples_info(self, sample_ids, id_col=None):
+        """Get the full rows for many samples from the samples log file at once (see get_sample_info).
+
+        Args:
+            sample_ids (pd.Series): The sample IDs to get the rows for.
+            id_col (str, optional): The column of the samples log to match sample_ids with, either the sample ID column
+                or the match sample ID column (see sample_id_col and match_sample_id_col in the config file). If None
+                then the sample ID column is used. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The rows in the samples log file, with the same index as sample_ids. If multiple rows are found for
+                a sample ID then the last one is used. All values are empty for sample IDs that are not in the samples log.
+        """
+        samples_df = self.samples_by_id[id_col or self.config["sample_id_col"]]
+        samples_info = samples_df.reindex(sample_ids.to_numpy())
+        samples_info.index = sample_ids.index
+        return samples_info
+
     def get_sample_date(self, sample_id):
-        """Get the sample date string, from the ODM samples table.
+        """Get the sample date string, from the ODM samples table. sample_id can also be a pd.Series of sample IDs.
         """
+        if isinstance(sample_id, pd.Series):
+            return self.get_samples_info(sample_id)[self.config["sample_date_col"]]
+
         info = self.get_sample_info(sample_id)
         if info is None:
             return None
         return info[self.config["sample_date_col"]]
+
+    def index_samples(self):
+        """Index the samples log by sample ID and by match sample ID, so that samples are found without searching all rows.
+        Creates self.samples_by_id, which maps each of the two column names to the samples log indexed by that column. If
+        a sample ID is in multiple rows then only the last row is kept, the same as searching all rows and using the last match.
+        """
+        self.samples_by_id = {}
+        for id_col in [self.config["sample_id_col"], self.config["match_sample_id_col"]]:
+            ids = self.sampleslog_df[id_col]
+            samples_df = self.sampleslog_df[ids.notna() & ~ids.duplicated(keep="last")]
+            self.samples_by_id[id_col] = samples_df.set_index(samples_df[id_col].rename(None))
         
     def download_samples_file(self, samples_log_file):
         """Load the samples file, which contains sample dates, qpcr dates, sample extracted mass, sample volumes, etc.
@@ -109,23 +155,46 @@ class QPCRSamplesLog(object):
             QPCRError: An error occurred trying to download and parse the samples file.
         """
         self.sampleslog_df = None
+        samples_file = None
         try:
             samples_file = cloud_utils.download_file(samples_log_file)
-            
+            if not samples_file or not os.path.isfile(samples_file):
+                raise FileNotFoundError(samples_log_file)
+        except Exception as e:
+            file_name_error = os.path.basename(samples_file) if samples_file else samples_log_file
+            raise QPCRError(f"Could not load samples data file '{file_name_error}'")
+
+        # The cleaned samples log is cached in cache_dir (if set) while the samples file and configs are unchanged
+        self.sampleslog_df = load_cached_reference(self.cache_dir, "sampleslog", self.cache_source_files + [samples_file], lambda: self.load_samples_file(samples_file))
+        self.index_samples()
+
+    def load_samples_file(self, samples_file):
+        """Load and clean the local samples file: rename the columns, make the sample IDs, remove duplicates and cast the columns.
+
+        Args:
+            samples_file (str): Local path to the samples log file.
+
+        Returns:
+            pd.DataFrame: The cleaned samples log.
+
+        Raises:
+            QPCRError: An error occurred trying to parse the samples file.
+        """
+        try:
             # Load the samples file
             xl = pd.ExcelFile(samples_file)
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                self.sampleslog_df = xl.parse(xl.sheet_names[0])
-                self.sampleslog_df.columns = [c.strip() for c in self.sampleslog_df.columns]
+                sampleslog_df = xl.parse(xl.sheet_names[0])
+                sampleslog_df.columns = [c.strip() for c in sampleslog_df.columns]
         except Exception as e:
-            file_name_error = os.path.basename(samples_file) if samples_file else samples_log_file
-            raise QPCRError(f"Could not load samples data file '{file_name_error}'")
+            raise QPCRError(f"Could not load samples data file '{os.path.basename(samples_file)}'")
 
-        self.sampleslog_df = self.rename_columns(self.sampleslog_df, self.config["columns"])
-        self.sampleslog_df = self.sampleids.make_all_sample_ids(self.sampleslog_df, self.config["sample_location_col"], self.config["sample_date_col"], target_sample_id_col=self.config["sample_id_col"], target_match_sample_id_col=self.config["match_sample_id_col"])
-        self.sampleslog_df = self.sampleslog_df.drop_duplicates(subset=[self.config["match_sample_id_col"]])
-        self.cast_columns(self.sampleslog_df)
+        sampleslog_df = self.rename_columns(sampleslog_df, self.config["columns"])
+        sampleslog_df = self.sampleids.make_all_sample_ids(sampleslog_df, self.config["sample_location_col"], self.config["sample_date_col"], target_sample_id_col=self.config["sample_id_col"], target_match_sample_id_col=self.config["match_sample_id_col"])
+        sampleslog_df = sampleslog_df.drop_duplicates(subset=[self.config["match_sample_id_col"]])
+        self.cast_columns(sampleslog_df)
+        return sampleslog_df
             
     def join_and_cast(self, df, on):
         sampleslog_df = self.sampleslog_df
@@ -135,13 +204,55 @@ class QPCRSamplesLog(object):
             if col not in df.columns or col == on:
                 keep_cols.append(col)
         sampleslog_df = sampleslog_df[keep_cols]
+        sampleslog_columns = [c for c in keep_cols if c != self.config["match_sample_id_col"]]
 
         df = df.join(sampleslog_df.set_index(self.config["match_sample_id_col"]), on=on, how="left")
-        self.cast_columns(df)
+
+        # The samples log was already cast when it was loaded, so only the cells left empty by the join (ie. samples
+        # that are not in the samples log) are cast. Columns that were already in df are cast in full.
+        self.cast_columns(df, columns=[c for c in df.columns if c not in sampleslog_columns])
+        self.cast_columns(df, columns=sampleslog_columns, missing_only=True)
         return df
                     
-    def cast_columns(self, df):
-        """Cast columns to types specified in the config file (see cast_info in config file).
+    def cast_columns(self, df, columns=None, missing_only=False):
+        """Cast columns to types specified in the config file (see cast_info in config file). The df is modified in place.
+
+        Args:
+            df (pd.DataFrame): The DataFrame to cast.
+            columns (list[str], optional): Only cast the columns in cast_info that are also in this list. If None then all columns in
+                cast_info are cast. Defaults to None.
+            missing_only (bool, optional): If True then only cast the empty (None, NaN, NaT) cells. Defaults to False.
+        """
+        for cast_info in self.config.get("cast_info", []):
+            cur_columns = cast_info["columns"]
+            if not isinstance(cur_columns, (list, tuple)):
+                cur_columns = [cur_columns]
+            if columns is not None:
+                cur_columns = [c for c in cur_columns if c in columns]
+
+            for col in cur_columns:
+                if missing_only:
+                    missing = df[col].isna()
+                    if not missing.all():
+                        if missing.any():
+                            cast_values = self.cast_values(df.loc[missing, col], cast_info["type"], cast_info["default"])
+                            # Missing numbers that stay missing are already NaN (assigning None would make the column an object column)
+                            if not (cast_values.isna().all() and pd.api.types.is_numeric_dtype(df[col])):
+                                df.loc[missing, col] = cast_values
+                        continue
+                df[col] = self.cast_values(df[col], cast_info["type"], cast_info["default"])
+
+    def cast_values(self, values, cast_type, default):
+        """Cast the values in a pd.Series to the specified type. Numbers are cast with pd.to_numeric, and for all other
+        types each distinct value is only parsed once.
+
+        Args:
+            values (pd.Series): The values to cast.
+            cast_type (str): The type to cast to, one of "number", "string", "date" or "datetime" (see cast_info in config file).
+            default (any): The value to use for values that cannot be cast.
+
+        Returns:
+            pd.Series: The cast values.
         """
         def _cast_number(x, default):
             try:
@@ -179,26 +290,28 @@ class QPCRSamplesLog(object):
                 x = pd.NaT
             return x
         
-        for cast_info in self.config.get("cast_info", []):
-            func = None
-            cur_default = cast_info["default"]
-            cur_type = cast_info["type"]
-            if cur_type == "number":
-                func = _cast_number
-            elif cur_type == "string":
-                func = _cast_string
-            elif cur_type == "date":
-                func = _cast_date
-            elif cur_type == "datetime":
-                func = _cast_datetime
-            else:
-                raise ValueError(f"Unrecognized defaults type in QPCRSamplesLog config file: '{cur_type}' for columns {cur_columns}")
-            
-            cur_columns = cast_info["columns"]
-            if not isinstance(cur_columns, (list, tuple)):
-                cur_columns = [cur_columns]
-            
-            df[cur_columns] = df[cur_columns].applymap(lambda x: func(x, cur_default))
+        if cast_type == "number":
+            numbers = pd.to_numeric(values, errors="coerce").astype(float)
+            # Retry the values that pd.to_numeric rejected but that float() might still accept (eg. "1_000")
+            retry = numbers.isna() & values.notna()
+            if retry.any():
+                numbers[retry] = values[retry].map(lambda x: _cast_number(x, np.nan))
+            if numbers.isna().all():
+                # Nothing could be cast, so all values are the default
+                return pd.Series([default] * len(values), index=values.index, name=values.name, dtype=object).infer_objects()
+            if default is not None:
+                numbers = numbers.fillna(default)
+            return numbers
+        elif cast_type == "string":
+            func = _cast_string
+        elif cast_type == "date":
+            func = _cast_date
+        elif cast_type == "datetime":
+            func = _cast_datetime
+        else:
+            raise ValueError(f"Unrecognized defaults type in QPCRSamplesLog config file: '{cast_type}' for column {values.name}")
+
+        return map_unique(values, lambda x: func(x, default))
             
 if __name__ == "__main__":
     if "get_ipython" in globals():
@@ -209,6 +322,7 @@ if __name__ == "__main__":
             "samples_log_file" : "https://docs.google.com/spreadsheets/d/1apOidERKMcMbRnBfGr7W4cjY7fC63wRd/edit#gid=339812442",
             "sites_file" : "qpcr_sites.xlsx",
             "sites_config" : "qpcr_sites.yaml",
+            "cache_dir" : None,
         })
     else:
         args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -217,10 +331,11 @@ if __name__ == "__main__":
         args.add_argument("--sampleids_config", type=str, help="Config file for the sample IDs.", required=False)
         args.add_argument("--sites_file", type=str, help="Excel file specifying all WW sites with information about each site.", required=False)
         args.add_argument("--sites_config", type=str, help="Config file for the sites file.", required=False)
+        args.add_argument("--cache_dir", type=str, help="Directory to cache the cleaned samples log and sites tables in. No caching is done if not set.", required=False)
         
         opts = args.parse_args()
 
-    samples = QPCRSamplesLog(opts.config, opts.samples_log_file, opts.sampleids_config, opts.sites_config, opts.sites_file)
+    samples = QPCRSamplesLog(opts.config, opts.samples_log_file, opts.sampleids_config, opts.sites_config, opts.sites_file, cache_dir=opts.cache_dir)
     # print(samples.sampleslog_df)
     sample_id = "vc3.05.02.22"
     print(f"Sample date form {sample_id}:", samples.get_sample_date(sample_id))
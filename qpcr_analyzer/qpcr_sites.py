@@ -15,66 +15,138 @@ each site sampling type (eg. rawWW in ODM maps to the description "Influent" (sh
 """
 
 import pandas as pd
+import numpy as np
 import os
 from qpcr_utils import (
     rename_columns,
     parse_values,
     cleanup_file_name,
     load_config,
+    map_unique,
+    load_cached_reference,
     QPCRError
     )
 import re
 import cloud_utils
+from types import MappingProxyType
 
 class QPCRSites(object):
-    def __init__(self, config_file, sites_file=None):
+    def __init__(self, config_file, sites_file=None, cache_dir=None):
+        """
+        Parameters
+        ----------
+        config_file : str | list[str]
+            The sites config file(s).
+        sites_file : str
+            The local sites Excel file.
+        cache_dir : str
+            Directory of the reference data cache, where the cleaned sites table is saved so that it does not need to
+            be parsed again while the sites file and config are unchanged. If None then no caching is done.
+        """
         super().__init__()
 
         self.config = load_config(config_file)
 
         self.sites_df = None
         if sites_file:
-            try:
-                xl =  pd.ExcelFile(sites_file)
-            except:
-                raise QPCRError(f"Could not load sites file.")
-            self.sites_df = xl.parse(xl.sheet_names[0])
-            self.sites_df.columns = [c.strip() for c in self.sites_df.columns]
-            self.sites_df.dropna(subset=[])
-
-            # Clean up column names
-            all_columns = [c.column for c in self.config.columns.values()]
-            rename_columns(self.sites_df, all_columns)
+            self.sites_df = load_cached_reference(cache_dir, "sites", [config_file, sites_file], lambda: self.load_sites_file(sites_file))
+
+        self.index_sites()
+
+    def load_sites_file(self, sites_file):
+        """Load and clean the sites Excel file (rename columns and change the case of values, as specified in the config).
+
+        Returns
+        -------
+        pd.DataFrame
+            The cleaned sites table.
+        """
+        try:
+            xl =  pd.ExcelFile(sites_file)
+        except:
+            raise QPCRError(f"Could not load sites file.")
+        sites_df = xl.parse(xl.sheet_names[0])
+        sites_df.columns = [c.strip() for c in sites_df.columns]
+        sites_df.dropna(subset=[])
+
+        # Clean up column names
+        all_columns = [c.column for c in self.config.columns.values()]
+        rename_columns(sites_df, all_columns)
+        
+        missing_columns = []
+
+        # Process all columns
+        for c in self.config.columns.values():
+            # Make sure the column exists in the df
+            if c.column not in sites_df.columns:
+                missing_columns.append(c.column)
+                continue
             
-            missing_columns = []
-
-            # Process all columns
-            for c in self.config.columns.values():
-                # Make sure the column exists in the df
-                if c.column not in self.sites_df.columns:
-                    missing_columns.append(c.column)
-                    continue
+            # Change case of values
+            if c.get("make_lower", False):
+                sites_df[c.column] = sites_df[c.column].str.lower()
+            elif c.get("make_upper", False):
+                sites_df[c.column] = sites_df[c.column].str.upper()
                 
-                # Change case of values
-                if c.get("make_lower", False):
-                    self.sites_df[c.column] = self.sites_df[c.column].str.lower()
-                elif c.get("make_upper", False):
-                    self.sites_df[c.column] = self.sites_df[c.column].str.upper()
-                    
-                if c.get("remove_empty_items", False):
-                    # Split the values on commas, remove the empty items, then
-                    # rejoin with commas
-                    def _remove_empty_items(v):
-                        if not isinstance(v, str):
-                            return v
-                        items = [x for x in v.strip().split(",") if x.strip()]
-                        return ",".join(items)
-                    self.sites_df[c.column] = self.sites_df[c.column].map(_remove_empty_items)
-            
-            # Raise an exception if there are missing columns
-            if len(missing_columns) > 0:
-                columns_are = "columns are" if len(missing_columns) != 1 else "column is"
-                raise QPCRError(f"The following {columns_are} missing in the sites file:", missing_columns)
+            if c.get("remove_empty_items", False):
+                # Split the values on commas, remove the empty items, then
+                # rejoin with commas
+                def _remove_empty_items(v):
+                    if not isinstance(v, str):
+                        return v
+                    items = [x for x in v.strip().split(",") if x.strip()]
+                    return ",".join(items)
+                sites_df[c.column] = sites_df[c.column].map(_remove_empty_items)
+        
+        # Raise an exception if there are missing columns
+        if len(missing_columns) > 0:
+            columns_are = "columns are" if len(missing_columns) != 1 else "column is"
+            raise QPCRError(f"The following {columns_are} missing in the sites file:", missing_columns)
+
+        return sites_df
+
+    def index_sites(self):
+        """Index the sites file, so that site IDs and aliases are resolved with a single dictionary lookup. Creates
+        self.siteid_map, which maps each lower case site ID and alias to its resolved site ID (see resolve_aliases),
+        and self.siteid_rows, which maps each lower case site ID to its row position in self.sites_df. The first
+        matching row wins, the same as searching the rows in order.
+        """
+        self.siteid_map = MappingProxyType({})
+        self.siteid_rows = MappingProxyType({})
+        if self.sites_df is None:
+            return
+
+        siteid_column = self.config.columns.siteid.column
+        siteids = self.sites_df[siteid_column].tolist()
+
+        # Site IDs that match exactly (case insensitive)
+        siteid_rows = {}
+        for pos, siteid in enumerate(siteids):
+            if isinstance(siteid, str):
+                siteid_rows.setdefault(siteid.lower(), pos)
+
+        # Site IDs and aliases of all rows with aliases. An empty site ID only matches if no later row matches.
+        alias_map = {}
+        for siteid, aliases in zip(siteids, self.sites_df[self.config.columns.siteid_aliases.column].tolist()):
+            if pd.isna(aliases) or not isinstance(siteid, str):
+                continue
+            for key in [a.strip().lower() for a in aliases.split(",")] + [siteid.strip().lower()]:
+                if not alias_map.get(key, None):
+                    alias_map[key] = siteid
+
+        siteid_map = {}
+        for key in list(siteid_rows.keys()) + list(alias_map.keys()):
+            found_siteid = siteids[siteid_rows[key]] if key in siteid_rows else None
+            if not found_siteid:
+                found_siteid = alias_map.get(key, found_siteid)
+            if found_siteid and self.config.columns.siteid.get("make_lower", False):
+                found_siteid = found_siteid.lower()
+            elif found_siteid and self.config.columns.siteid.get("make_upper", False):
+                found_siteid = found_siteid.upper()
+            siteid_map[key] = found_siteid
+
+        self.siteid_map = MappingProxyType(siteid_map)
+        self.siteid_rows = MappingProxyType(siteid_rows)
 
     def get_siteid(self, siteid):
         """Get the valid siteid. If siteid is not recognized then None is returned. Site ID aliases will also be mapped to the actual site ID.
@@ -112,13 +184,14 @@ class QPCRSites(object):
 
     def run_map(self, df, func, *args, **kwargs):
         """Call the function on each cell in the df (either a pd.Series or a pd.DataFrame). The parameters passed to the function are the cell contents 
-        followed by args and kwargs. This is equivalent to calling map (for a pd.Series) or applymap (for a pd.DataFrame). The calls are not in-place,
-        but the returned and modified pd.Series or pd.DataFrame can be used.
+        followed by args and kwargs. This is equivalent to calling map (for a pd.Series) or applymap (for a pd.DataFrame), except that the function
+        is only called once for each distinct value (per column), and the result is broadcast back to all cells with that value. The calls are not
+        in-place, but the returned and modified pd.Series or pd.DataFrame can be used.
         """
         if isinstance(df, pd.Series):
-            return df.map(lambda x: func(x, *args, **kwargs))
+            return map_unique(df, lambda x: func(x, *args, **kwargs))
         elif isinstance(df, pd.DataFrame):
-            return df.applymap(lambda x: func(x, *args, **kwargs))
+            return df.apply(lambda col: map_unique(col, lambda x: func(x, *args, **kwargs)))
         return df
 
     def get_site_siteid_aliases(self, siteid):
@@ -224,28 +297,7 @@ class QPCRSites(object):
         if siteid is None:
             return None
 
-        lower_siteid = siteid.strip().lower()
-        found_siteid = None
-        matches = self.sites_df[self.config.columns.siteid.column].str.lower() == lower_siteid
-        if matches.sum() > 0:
-            found_siteid = self.sites_df[self.config.columns.siteid.column][matches].iloc[0]
-
-        if not found_siteid:
-            for idx, (cur_siteid, aliases) in self.sites_df[[self.config.columns.siteid.column, self.config.columns.siteid_aliases.column]].iterrows():
-                if pd.isna(aliases):
-                    continue
-                aliases = [a.strip().lower() for a in aliases.split(",")]
-                if lower_siteid in aliases:
-                    found_siteid = cur_siteid
-                if lower_siteid == cur_siteid.strip().lower():
-                    found_siteid = cur_siteid
-                if found_siteid:
-                    break
-        if found_siteid and self.config.columns.siteid.get("make_lower", False):
-            found_siteid = found_siteid.lower()
-        elif found_siteid and self.config.columns.siteid.get("make_upper", False):
-            found_siteid = found_siteid.upper()
-        return found_siteid
+        return self.siteid_map.get(siteid.strip().lower(), None)
 
     def get_site_info(self, siteid, retrieve_col=None, default=None):
         """Get info (from the sites.xlsx file passed to the constructor) for the specified site ID (or alias).
@@ -264,22 +316,18 @@ class QPCRSites(object):
         object | pd.Series | pd.DataFrame
             The requested info from the sites Excel file.
         """
+        if isinstance(siteid, pd.Series) and retrieve_col is not None:
+            if isinstance(retrieve_col, str):
+                return self.get_site_info_frame(siteid, [retrieve_col], default=default)[retrieve_col]
+            return self.get_site_info_frame(siteid, retrieve_col, default=default)
         if isinstance(siteid, (pd.Series, pd.DataFrame)):
-            return self.run_map(siteid, self.get_site_info, retrieve_col=retrieve_col)
-
-        if not siteid:
-            return default
-
-        siteid = self.resolve_aliases(siteid)
-        if siteid is None:
-            return default
-        siteid = siteid.strip().lower()
+            return self.run_map(siteid, self.get_site_info, retrieve_col=retrieve_col, default=default)
 
         # Find the matching site ID in the sites Excel file, return the value in retrieve_col
-        match = self.sites_df[self.sites_df[self.config.columns.siteid.column].str.lower() == siteid]
-        if len(match.index) == 0:
+        pos = self.get_site_row(siteid)
+        if pos is None:
             return default
-        match = match.iloc[0]
+        match = self.sites_df.iloc[pos]
         if retrieve_col is None:
             # Return all columns
             return match
@@ -289,6 +337,55 @@ class QPCRSites(object):
 
         return match
 
+    def get_site_row(self, siteid):
+        """Get the row position in self.sites_df of the specified site ID (or alias), or None if it is not recognized.
+        """
+        if not siteid:
+            return None
+
+        siteid = self.resolve_aliases(siteid)
+        if siteid is None:
+            return None
+        return self.siteid_rows.get(siteid.strip().lower(), None)
+
+    def get_site_info_frame(self, siteid, retrieve_cols=None, default=None):
+        """Get several columns of info (from the sites.xlsx file passed to the constructor) for all site IDs (or aliases) in
+        a pd.Series. Each distinct site ID is only resolved once, and the info is broadcast back to all rows with that site ID.
+        Each column is the same as calling get_site_info on the Series with that column.
+
+        Parameters
+        ----------
+        siteid : pd.Series
+            The site IDs or aliases to retrieve.
+        retrieve_cols : list[str]
+            The columns to retrieve. If None then all columns are retrieved.
+        default : any | dict
+            The default value to use if a site ID is not recognized. This can also be a dict, mapping each column in
+            retrieve_cols to its default value (columns not in the dict default to None).
+
+        Returns
+        -------
+        pd.DataFrame
+            The requested info, with the same index as siteid and one column for each column in retrieve_cols.
+        """
+        if retrieve_cols is None:
+            retrieve_cols = list(self.sites_df.columns)
+
+        codes, uniques = pd.factorize(siteid)
+        rows = np.array([self.get_site_row(s) for s in uniques] + [None], dtype=object)
+        rows = np.where(pd.isna(rows), -1, rows).astype(int)[codes]
+        found = rows >= 0
+
+        info_df = pd.DataFrame(index=siteid.index)
+        for col in retrieve_cols:
+            values = np.empty(len(rows), dtype=object)
+            values.fill(default.get(col, None) if isinstance(default, dict) else default)
+            if found.any():
+                site_values = self.sites_df[col].map(lambda v: v.strip() if isinstance(v, str) else v).to_numpy(dtype=object)
+                values[found] = site_values[rows[found]]
+            info_df[col] = pd.Series(values, index=siteid.index, name=col).infer_objects()
+        return info_df
+
     def get_site_info_from_sample_id(self, sample_id, retrieve_col=None):
         siteid = self.get_siteid_from_sampleid(sample_id)
         return self.get_site_info(siteid, retrieve_col=retrieve_col)
@@ -346,35 +443,39 @@ class QPCRSites(object):
             A list of groups. Each item in the list is one group, and consists of [dict, group_df], where dict contains group info such as the
             parentSiteID (str) and the parentSiteTitle (str). group_df is all the items in the group.
         """
-        groups = []
-
         site_id_column = "______site_id______"
-        site_title_column = "______site_id_title______"
-        parent_site_id_column = "______parent_site_id______"
-        parent_site_title_column = "______parent_site_title______"
-        sample_type_column = "______sample_type______"
-        file_id_column = "______file_id______"
-        file_column = "______filename______"
-
-        def _make_filename(row):
-            return parse_values(file_template, None, site_id=cleanup_file_name(row[site_id_column]), site_title=cleanup_file_name(row[site_title_column]), parent_site_id=cleanup_file_name(row[parent_site_id_column]), parent_site_title=cleanup_file_name(row[parent_site_title_column]), file_id=cleanup_file_name(row[file_id_column]), sample_type=cleanup_file_name(row[sample_type_column]))[0]
-
-        grouper_df = df[[siteid_col]].copy()
-        grouper_df[site_id_column] = self.get_siteid(grouper_df[siteid_col]).fillna(self.config.unknown_siteid)
-        # grouper_df[site_title_column] = self.get_site_title(grouper_df[siteid_col]).fillna(slf.config.unknown_siete_title)
-        # grouper_df[parent_site_id_column] = self.get_site_parentid(grouper_df[siteid_col]).fillna(self.config.unknown_parentid)
-        # grouper_df[parent_site_title_column] = self.get_site_parent_title(grouper_df[siteid_col]).fillna(self.config.unknown_parent_site_title)
-        # grouper_df[sample_type_column] = self.get_site_sample_type(grouper_df[siteid_col]).fillna(self.config.unknown_sample_type)
-        # grouper_df[file_id_column] = self.get_site_file_id(grouper_df[siteid_col])
-        # no_file_id_filt = (grouper_df[file_id_column] == "") | pd.isna(grouper_df[file_id_column])
-        # grouper_df.loc[no_file_id_filt, file_id_column] = grouper_df.loc[no_file_id_filt, site_id_column]
-        
-        # grouper_df[file_column] = grouper_df[[site_id_column, site_title_column, parent_site_id_column, parent_site_title_column, file_id_column, sample_type_column]].agg(_make_filename, axis=1)
-        grouper_df[file_column] = grouper_df[site_id_column].map(lambda siteid: self.parse_filename_for_siteid(file_template, siteid))
+
+        # Resolve the site IDs, then compute the output file name and the group info once for each unique site ID
+        site_ids = self.get_siteid(df[siteid_col]).fillna(self.config.unknown_siteid)
+        site_codes, unique_site_ids = pd.factorize(site_ids)
+        unique_site_ids = pd.Series(unique_site_ids, name=site_id_column)
+        site_file_names = np.array([self.parse_filename_for_siteid(file_template, siteid) for siteid in unique_site_ids], dtype=object)
+
+        info_columns = {
+            "siteTitle" : self.config.columns.site_title.column,
+            "parentSiteID" : self.config.columns.parentid.column,
+            "parentSiteTitle" : self.config.columns.parent_title.column,
+            "sampleType" : self.config.columns.sample_type.column,
+        }
+        site_info_df = self.get_site_info_frame(unique_site_ids, list(info_columns.values()), default={
+            self.config.columns.site_title.column : self.config.unknown_site_title,
+            self.config.columns.parentid.column : self.config.unknown_parentid,
+            self.config.columns.parent_title.column : self.config.unknown_parent_site_title,
+            self.config.columns.sample_type.column : self.config.unknown_sample_type,
+        })
+
+        # Group the rows by the integer code of their file name (in order of the file names)
+        file_codes, file_names = pd.factorize(site_file_names, sort=True)
+        row_file_codes = file_codes[site_codes]
+        file_rows = pd.Series(row_file_codes).groupby(row_file_codes).indices
 
         groups = []
-        for file_name, file_group in grouper_df.groupby(file_column):
-            filt = df.index.isin(file_group.index)
+        for file_code, file_name in enumerate(file_names):
+            rows = file_rows.get(file_code, None)
+            if rows is None:
+                continue
+            filt = np.zeros(len(df.index), dtype=bool)
+            filt[rows] = True
             if intersection_filter is not None:
                 filt = filt & intersection_filter
             if filt.sum() == 0:
@@ -383,15 +484,15 @@ class QPCRSites(object):
             if always_include_filter is not None:
                 filt = filt | always_include_filter
             
-            siteid = file_group[site_id_column]
-            groups.append(({
-                "fileName" : file_group[file_column].iloc[0],
-                "siteID" : siteid,
-                "siteTitle" : self.get_site_title(siteid, default=self.config.unknown_site_title), #file_group[site_title_column].iloc[0],
-                "parentSiteID" : self.get_site_parentid(siteid, default=self.config.unknown_parentid), #file_group[parent_site_id_column].iloc[0],
-                "parentSiteTitle" : self.get_site_parent_title(siteid, default=self.config.unknown_parent_site_title), #file_group[parent_site_title_column].iloc[0],
-                "sampleType" : self.get_site_sample_type(siteid, default=self.config.unknown_sample_type), #file_group[sample_type_column].iloc[0],
-            }, df[filt]))
+            group_index = df.index[rows]
+            group_site_codes = site_codes[rows]
+            group_info = {
+                "fileName" : file_name,
+                "siteID" : pd.Series(unique_site_ids.to_numpy()[group_site_codes], index=group_index, name=site_id_column),
+            }
+            for key, col in info_columns.items():
+                group_info[key] = pd.Series(site_info_df[col].to_numpy()[group_site_codes], index=group_index, name=site_id_column).infer_objects()
+            groups.append((group_info, df[filt]))
         
         return groups
 
@@ -0,0 +1,118 @@
+"""
+qpcr_targets.py
+===============
+
+Resolve target names to the canonical names in the populator config, so that target names are consistent.
+
+The recognized targets are input.main_targets, input.other_targets, input.inhibition_targets and input.normalizing_targets
+in the populator config file. All lookups are built once, when QPCRTargets is created, and target names are matched
+case-insensitively. Every method also accepts a pd.Series, in which case each distinct target is only resolved once.
+
+Usage:
+
+    targets = QPCRTargets(config)
+    targets.get_recognized_target("covn1")                    # eg. "covN1"
+    targets.get_target_class("pmmov")                         # eg. TARGET_CLASS_NORMALIZING
+    targets.get_standard_curve_common_target("PMMoV:10")      # eg. "PMMoV"
+"""
+
+import pandas as pd
+from types import MappingProxyType
+
+from qpcr_utils import (
+    map_unique,
+)
+
+TARGET_CLASS_MAIN = "main"
+TARGET_CLASS_OTHER = "other"
+TARGET_CLASS_INHIBITION = "inhibition"
+TARGET_CLASS_NORMALIZING = "normalizing"
+
+class QPCRTargets(object):
+    def __init__(self, config):
+        """
+        Parameters
+        ----------
+        config : EasyDict
+            The loaded populator config.
+        """
+        super().__init__()
+
+        target_classes = [
+            (TARGET_CLASS_MAIN, config.input.get("main_targets", None)),
+            (TARGET_CLASS_OTHER, config.input.get("other_targets", None)),
+            (TARGET_CLASS_INHIBITION, config.input.get("inhibition_targets", None)),
+            (TARGET_CLASS_NORMALIZING, config.input.get("normalizing_targets", None)),
+        ]
+
+        # Map each lower case target to its canonical name and its class. A target in more than one list keeps the
+        # first name and class, in the order of target_classes.
+        recognized_targets = {}
+        main_targets = {}
+        classes = {}
+        for target_class, targets in target_classes:
+            if isinstance(targets, str):
+                targets = [targets]
+            for target in targets or []:
+                recognized_targets.setdefault(target.lower(), target)
+                classes.setdefault(target.lower(), target_class)
+                if target_class == TARGET_CLASS_MAIN:
+                    main_targets.setdefault(target.lower(), target)
+        self.recognized_targets = MappingProxyType(recognized_targets)
+        self.main_targets = MappingProxyType(main_targets)
+        self.target_classes = MappingProxyType(classes)
+
+        # Map each lower case target to the target of its standard curve
+        common_targets = {}
+        for key, names in (config.input.get("standard_curve_common_targets", None) or {}).items():
+            for name in names:
+                common_targets.setdefault(name.lower(), key)
+        self.common_targets = MappingProxyType(common_targets)
+
+    def get_recognized_target(self, target_name, main_targets_only=False):
+        """Map the specified target name to a unique one, ensuring that target names are consistent.
+
+        Parameters
+        ----------
+        target_name : str | pd.Series
+            The target name(s) to map.
+        main_targets_only : bool
+            If True then only input.main_targets are recognized.
+
+        Returns
+        -------
+        str | pd.Series
+            The canonical target name, or None if the target is not recognized. If there are no recognized targets
+            in the config then target_name is returned unchanged.
+        """
+        if isinstance(target_name, pd.Series):
+            return map_unique(target_name, lambda t: self.get_recognized_target(t, main_targets_only=main_targets_only))
+
+        if target_name is None:
+            return None
+        recognized_targets = self.main_targets if main_targets_only else self.recognized_targets
+        if len(recognized_targets) == 0:
+            return target_name
+        return recognized_targets.get(target_name.lower(), None)
+
+    def get_target_class(self, target_name):
+        """Get the class of the target (TARGET_CLASS_MAIN, TARGET_CLASS_OTHER, TARGET_CLASS_INHIBITION or
+        TARGET_CLASS_NORMALIZING), or None if the target is not recognized. target_name can also be a pd.Series.
+        """
+        if isinstance(target_name, pd.Series):
+            return map_unique(target_name, self.get_target_class)
+
+        if not isinstance(target_name, str):
+            return None
+        return self.target_classes.get(target_name.lower(), None)
+
+    def get_standard_curve_common_target(self, target):
+        """Get the common root target name that is used for the specified target to refer to a standard curve (see
+        input.standard_curve_common_targets in the populator config). For example, the target PMMoV:10, which is a PMMoV
+        dilution, will typically be mapped to the target PMMoV, which is the undiluted form. Targets without a common target
+        are returned unchanged. target can also be a pd.Series.
+        """
+        if isinstance(target, pd.Series):
+            return map_unique(target, self.get_standard_curve_common_target)
+
+        return self.common_targets.get(target.lower(), target)
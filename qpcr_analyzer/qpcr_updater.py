@@ -46,7 +46,7 @@ from qpcr_utils import (
     load_config,
 )
 from excel_file_utils import fix_xlsx_file
-from excel_calculator import add_excel_calculated_values
+from excel_calculator import add_excel_calculated_values, save_calculated_values
 import tempfile
 from copy import copy
 from qpcr_sites import QPCRSites
@@ -55,14 +55,14 @@ from qpcr_sites import QPCRSites
 # logging.getLogger("pycel").setLevel(logging.CRITICAL)
 
 class QPCRUpdater(object):
-    def __init__(self, config_file, populator_config_file, sites_config, sites_file):
+    def __init__(self, config_file, populator_config_file, sites_config, sites_file, cache_dir=None):
         super().__init__()
         self.local_dir = tempfile.gettempdir()
         self.target_workbooks = {}
 
         self.config = load_config(config_file)
         self.populator_config = load_config(populator_config_file)
-        self.sites = QPCRSites(config_file=sites_config, sites_file=sites_file)
+        self.sites = QPCRSites(config_file=sites_config, sites_file=sites_file, cache_dir=cache_dir)
 
     def get_columns(self, worksheet):
         """Get all column names from the worksheet. These are the values found in row 1, and are the columns we'd
@@ -288,9 +288,10 @@ class QPCRUpdater(object):
             local_dir = os.path.dirname(local_target)
             if local_dir:
                 os.makedirs(local_dir, exist_ok=True)
-            add_excel_calculated_values(wb_info["wb"])
             print(f"Saving to {local_target}")
             wb_info["wb"].save(local_target)
+            calculated_values = add_excel_calculated_values(wb_info["wb"])
+            save_calculated_values(local_target, calculated_values)
             print(f"Uploading to {remote_target}")
             cloud_utils.upload_file(local_target, remote_target)
             remote_targets.append(remote_target)
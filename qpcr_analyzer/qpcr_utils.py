@@ -11,8 +11,12 @@ import numpy as np
 from openpyxl.utils import get_column_letter
 from openpyxl.utils import units
 import re
+import string
 import pandas as pd
 import traceback
+import hashlib
+import pickle
+import os
 
 OUTLIER_COL = "__outlier_values"
 
@@ -45,6 +49,14 @@ PARSE_REP_REGEX = re.compile("(.*)_([0-9]*)$", flags=re.IGNORECASE)
 
 TAG_KEY_SEPARATOR = ">"
 
+# Increment whenever the format of the reference data cache changes, so that old entries are no longer used (see
+# load_cached_reference).
+REFERENCE_CACHE_VERSION = 1
+
+# The modules that clean the sites, methods and samples log files. Their contents are part of the key of the reference data
+# cache, so that a new version of the code never loads tables cleaned by an older version.
+REFERENCE_CACHE_MODULES = ["qpcr_sites.py", "qpcr_sampleids.py", "qpcr_sampleslog.py", "qpcr_methods.py", "qpcr_utils.py"]
+
 class QPCRError(Exception):
     pass
 
@@ -82,6 +94,78 @@ def load_config(config_files):
     
     return config
 
+def get_files_hash(files):
+    """Get a hash of the contents of one or more files.
+
+    Parameters
+    ----------
+    files : str | list
+        The file(s) to hash. Nested lists are flattened, and None items are skipped.
+
+    Returns
+    -------
+    str
+        The hex digest (SHA-1) of the contents of all files, in order.
+    """
+    hasher = hashlib.sha1()
+    for file in flatten(files):
+        if file is None:
+            hasher.update(b"\0")
+            continue
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+def load_cached_reference(cache_dir, name, source_files, build_func):
+    """Load reference data (eg. the cleaned sites table) from the reference data cache, or build it with build_func
+    and save it to the cache. The cache entry is keyed by the contents of all source_files (including the config files
+    used to build the data) and of the cleaning code (REFERENCE_CACHE_MODULES), so any change to these files causes the
+    data to be rebuilt.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory of the cache (eg. "/tmp/qpcr_reference_cache"). If None then the cache is not used and build_func
+        is always called.
+    name : str
+        The name of the reference data (eg. "sites"), used in the cache file name.
+    source_files : list
+        All local files the reference data is built from.
+    build_func : function
+        Called with no arguments to build the reference data if it is not in the cache. The returned object must
+        be picklable.
+
+    Returns
+    -------
+    object
+        The reference data, either loaded from the cache or returned by build_func.
+    """
+    if not cache_dir:
+        return build_func()
+
+    module_files = [os.path.join(os.path.dirname(os.path.abspath(__file__)), module) for module in REFERENCE_CACHE_MODULES]
+    cache_key = f"{REFERENCE_CACHE_VERSION}-{pd.__version__}-{get_files_hash(module_files)}-{get_files_hash(source_files)}"
+    cache_file = os.path.join(cache_dir, f"{name}-{hashlib.sha1(cache_key.encode()).hexdigest()}.pkl")
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"WARNING: Could not load cached {name} reference data {cache_file}: {e}")
+
+    data = build_func()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, so that concurrent runs never load a partially written cache file
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "wb") as f:
+            pickle.dump(data, f)
+        os.replace(temp_file, cache_file)
+    except Exception as e:
+        print(f"WARNING: Could not save {name} reference data to cache {cache_file}: {e}")
+    return data
 
 def add_sheet_name_to_colrow_name(sheet_name, colrow_name):
     """Add the sheet name to the column or row name. This is to qualify the column/row name with the sheet name. Internally we
@@ -136,6 +220,117 @@ def flatten(arr):
     res = [arr]
     return res
 
+def format_columns(fmt, index, **columns):
+    """Format a string for every row of some columns, the same as fmt.format(**row) for each row. Simple fields (eg.
+    "{plateID}") are filled in by concatenating whole columns of strings, so no Python code runs per row. Other fields
+    (eg. "{plateID:>5}") fall back to formatting each row separately.
+
+    Parameters
+    ----------
+    fmt : str
+        The format string (eg. CAL_SHEET_FMT).
+    index : pd.Index
+        The index of the returned Series.
+    columns : pd.Series | scalar
+        The value of each field in fmt. Series must have the same index as index. Scalars are used for all rows.
+
+    Returns
+    -------
+    pd.Series
+        The formatted strings.
+    """
+    def _to_str(values):
+        if not isinstance(values, pd.Series):
+            return str(values)
+        if pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_timedelta64_dtype(values):
+            # astype(str) drops the time from dates, unlike str()
+            return values.map(str)
+        return values.astype(str)
+
+    res = pd.Series("", index=index, dtype=object)
+    for literal, field, spec, conversion in string.Formatter().parse(fmt):
+        if field is not None and (spec or conversion or field not in columns):
+            rows = pd.DataFrame({ k : v for k, v in columns.items() }, index=index)
+            return pd.Series([fmt.format(**row) for row in rows.to_dict("records")], index=index, dtype=object)
+        res = res + literal
+        if field is not None:
+            res = res + _to_str(columns[field])
+    return res
+
+def factorize_by_type(values):
+    """Encode the values as codes of the distinct values, the same as pd.factorize, except that values of different types that
+    are equal (eg. 1, 1.0 and True) are kept apart.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The values to encode.
+
+    Returns
+    -------
+    codes : np.ndarray
+        The code of each value, which is the position of the value in uniques. Missing values (None, NaN) have the code -1.
+    uniques : np.ndarray | pd.Index
+        The distinct values, in order of appearance.
+    """
+    if values.dtype != object:
+        return pd.factorize(values)
+    codes, uniques = pd.factorize(values.to_numpy())
+    if len(uniques) > 0:
+        type_codes, types = pd.factorize(values.map(type).to_numpy())
+        if len(types) > 1:
+            valid = codes >= 0
+            codes[valid] = pd.factorize(codes[valid].astype(np.int64) * len(types) + type_codes[valid])[0]
+            _, first = np.unique(codes[valid], return_index=True)
+            uniques = values.to_numpy()[np.flatnonzero(valid)[first]]
+    return codes, uniques
+
+def map_unique(values, func):
+    """Map each value of a Series with func, the same as values.map(func), but only calling func once for each distinct
+    value. Missing values (None, NaN) are passed to func one at a time, as they are.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The values to map.
+    func : function
+        Called with a single value, and returns the mapped value.
+
+    Returns
+    -------
+    pd.Series
+        The mapped values, with the same index and name as values.
+    """
+    codes, uniques = factorize_by_type(values)
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    for idx, value in enumerate(uniques):
+        mapped[idx] = func(value)
+    res = mapped[codes]
+    for pos in np.flatnonzero(codes < 0):
+        res[pos] = func(values.iloc[pos])
+    return pd.Series(res, index=values.index, name=values.name).infer_objects()
+
+def apply_schema(df, schema):
+    """Cast the columns of df to the dtypes in schema, in place. Columns in schema that are not in df, or that already
+    have the dtype, are skipped.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame to cast.
+    schema : dict
+        {column name : dtype}, eg. {"plateID" : "category"}.
+
+    Returns
+    -------
+    pd.DataFrame
+        df, with the cast columns.
+    """
+    for col, dtype in schema.items():
+        if col in df.columns and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
 def parse_colrow_tags(s, columns_source, cur_row):
     """
     """
@@ -420,3 +615,58 @@ def cleanup_file_name(file_name):
     file_name = re.sub(r"[^A-Za-z0-9\.\-\(\)\[\] {}\<\>_]", "-", file_name)
     return file_name
 
+
+def fit_standard_curve(logsq, ct, calibration_multi=None):
+    """Calculate the standard curve parameters (Ct = slope*log10(SQ) + intercept) for the standards.
+
+    Parameters
+    ----------
+    logsq : list
+        The log10(SQ) (copies/well) of each standard replicate, from the largest SQ to the smallest.
+    ct : list
+        The Ct values of each standard replicate (same length as logsq).
+    calibration_multi : EasyDict | None
+        If set, then we use at least calibration_multi.min_points points for the curve. If we have more points, we pick
+        whichever number of points (always from the start of logsq/ct) that results in a slope closest to
+        calibration_multi.preferred_slope. If None, then all points are used.
+
+    Returns
+    -------
+    dict
+        The curve, with keys "slope", "intercept", "rsq", "eff", "num_points", and "max_points".
+    """
+    max_points = len(logsq)
+    if calibration_multi is not None:
+        min_points = min(calibration_multi.min_points, max_points)
+        preferred_slope = calibration_multi.preferred_slope
+        items = [(logsq[:min_points], ct[:min_points])]
+        if max_points > min_points:
+            for i in range(min_points+1, max_points+1):
+                items.append((logsq[:i], ct[:i]))
+    else:
+        min_points = max_points
+        preferred_slope = None
+        items = [(logsq, ct)]
+    # Calculate all the slopes, and choose the best one
+    slope = intercept = rsq = None
+    num_points = max_points
+
+    for idx, (cur_logsq, cur_ct) in enumerate(items):
+        A = np.vstack([cur_logsq, np.ones(len(cur_logsq))]).T
+        _slope, _intercept = np.linalg.lstsq(A, cur_ct, rcond=None)[0]
+        corr_matrix = np.corrcoef(cur_logsq, cur_ct)
+        _rsq = corr_matrix[0,1]**2
+
+        if slope is None or abs(_slope - preferred_slope) < abs(slope - preferred_slope):
+            num_points = idx + min_points
+            slope, intercept = _slope, _intercept
+            rsq = _rsq
+
+    return {
+        "slope" : slope,
+        "intercept" : intercept,
+        "rsq" : rsq,
+        "eff" : 10**(-1/slope) - 1,
+        "num_points" : num_points,
+        "max_points" : max_points,
+    }